@@ -17,6 +17,10 @@ Update:  2017-06-28: Started
 from time import strftime, time                              # Library for time
 import os                                                    # Operating system
 import numpy as np
+try:                                   # Sparse incidence matrices are optional
+  import scipy.sparse as sp
+except ImportError:
+  sp = None
 import OntoSim
 import Common.indices
 import json                                               # JSON format library
@@ -212,8 +216,8 @@ class Graph(object):
     N.makeMapping(nmap)
     N.makeBlocking([1] * np.size(nmap))
 
-    F  = self.makeMatrix(nmapNode, amapArc)
-    Fm = self.makeMatrix(nmassNode, amassArc)
+    F  = self.makeMatrix(nmapNode, amapArc, sparse = True)
+    Fm = self.makeMatrix(nmassNode, amassArc, sparse = True)
     # self.N = IndexSet('N',nmap,)
     print(F)
     print(Fm)
@@ -230,24 +234,36 @@ class Graph(object):
       matrix = []
       # local
 
-  def makeMatrix(self, nodelist, arclist):
+  def makeMatrix(self, nodelist, arclist, sparse = False):
     """
     Produce incidence matrix based on nodelist and arclist
 
+    The matrix is assembled directly from the source and sink row of each arc.
+    Every column holds at most two non-zeros, -1 for the tail and 1 for the head.
+
     Args:
       nodelist: Local nodelist in this matrix
       arclist:  Local arclist in this matrix
+      sparse:   Return a scipy.sparse CSR matrix (dense if scipy is missing)
     Returns:
       matrix: Produced
     """
-    mat = np.zeros((np.size(nodelist),np.size(arclist)))
-    for i,node in enumerate(nodelist):                          # For every row
-      # print()zx
-      for j,arc in enumerate(arclist):                 # For column in that row
-        if str(arc.source) == node.label:        # Check if tail is current row
-          mat[i,j] = -1
-        elif str(arc.sink) == node.label:        # Check if head is current row
-          mat[i,j] = 1
+    rows = {node.label: i for i, node in enumerate(nodelist)}     # Row lookup
+    source = np.array([rows.get(str(arc.source), -1) for arc in arclist],
+                      dtype = int)
+    sink = np.array([rows.get(str(arc.sink), -1) for arc in arclist],
+                    dtype = int)
+    cols = np.arange(len(arclist))
+    tail = source >= 0                               # Tail is in the node list
+    head = (sink >= 0) & (sink != source)  # Head is in the list, no self loop
+    row = np.concatenate((source[tail], sink[head]))
+    col = np.concatenate((cols[tail], cols[head]))
+    data = np.concatenate((-np.ones(tail.sum()), np.ones(head.sum())))
+    shape = (len(nodelist), len(arclist))
+    if sparse and sp is not None:
+      return sp.csr_matrix((data, (row, col)), shape = shape)
+    mat = np.zeros(shape)
+    mat[row, col] = data
     return mat                        # Return the value of the produced matrix
 
 
@@ -16,3 +16,13 @@ import OntoSim.myerrors as myerrors
 import OntoSim.objects as objects
 import OntoSim.operators as operators
 import OntoSim.operatorImplementation as operatorImplementation
+import OntoSim.layout as layout
+import OntoSim.compiler as compiler
+import OntoSim.scheduler as scheduler
+import OntoSim.batch as batch
+import OntoSim.structure as structure
+import OntoSim.solver as solver
+import OntoSim.derivatives as derivatives
+import OntoSim.simulation as simulation
+import OntoSim.codegen as codegen
+import OntoSim.jit as jit
@@ -0,0 +1,158 @@
+"""
+..  module:: Batch
+    :platform: Unix, Windows
+    :synopsis: Run scenarios of one model in a pool of processes.
+
+.. moduleauthor:: Arne Tobias Elve <arne.t.elve@ntnu.no>
+
+.. date:: 2017-09-13
+
+.. contents:: - BatchRunner: parameter sweeps and scenario ensembles
+
+.. notes::    (2017-09-13) Building the index sets, variables and equations is
+              often more expensive than evaluating a scenario.  The model is
+              therefore built once and the worker processes are forked from
+              the process holding it, sharing the structure copy-on-write.
+              (2017-09-14) scenarios can also be stacked along a leading batch
+              axis and evaluated in a single vectorised pass.
+"""
+
+import multiprocessing
+import numpy as np                                     # NUMPY numerical python
+
+_runner = None                   # Runner inherited by the forked processes
+
+
+def _runScenario(scenario):
+  """Entry point of the worker processes"""
+  return _runner.runScenario(scenario)
+
+
+class BatchRunner(object):
+  """
+  Evaluate many scenarios of the same model
+
+  A scenario is a dictionary from the symbol (or the variable) of an input to
+  its value in this scenario.  Inputs that are varied in some of the scenarios
+  are reset to their value at the start of the run in the others, so that the
+  result of a scenario does not depend on the worker that evaluates it.
+
+  Without fork (e.g. on Windows) or with a single process the scenarios are run
+  serially in this process.
+  """
+  def __init__(self, scheduler, outputs, processes = None, chunksize = 1):
+    self.scheduler = scheduler
+    self.outputs = list(outputs)                    # Variables to be returned
+    self.processes = processes           # None: one process for each core
+    self.chunksize = chunksize                # Scenarios sent to a worker
+    self.symbols = dict((var.symbol, var) for var in scheduler.variables)
+    self.base = {}                           # Initial values of the inputs
+
+  def symbol(self, key):
+    """Symbol of a scenario key given as symbol or as variable"""
+    if isinstance(key, str):
+      return key
+    return key.symbol
+
+  def runScenario(self, scenario):
+    """
+    Evaluate a single scenario
+
+    Args:
+      scenario: Dictionary from symbol to value
+
+    Returns:
+      List with a copy of the value of each output
+    """
+    for symbol, value in self.base.items():
+      self.symbols[symbol].value = scenario.get(symbol, value)
+    self.scheduler.update()
+    return [np.array(var.value, copy = True) for var in self.outputs]
+
+  def forkable(self):
+    return self.processes != 1 and \
+           'fork' in multiprocessing.get_all_start_methods()
+
+  def prepare(self, scenarios):
+    """Normalise the scenario keys to symbols and store the initial inputs"""
+    scenarios = [dict((self.symbol(key), value)
+                      for key, value in scenario.items())
+                 for scenario in scenarios]
+    self.base = {}
+    for scenario in scenarios:
+      for symbol in scenario:
+        if symbol not in self.base:
+          self.base[symbol] = self.symbols[symbol].value
+    return scenarios
+
+  def run(self, scenarios):
+    """
+    Evaluate all the scenarios
+
+    Afterwards the inputs are restored and the variables depending on them are
+    evaluated again,  so that the model does not keep the values of the last
+    scenario evaluated in this process.
+
+    Args:
+      scenarios: List of dictionaries from symbol (or variable) to value
+
+    Returns:
+      Dictionary from output symbol to the stacked values of all scenarios
+    """
+    global _runner
+    scenarios = self.prepare(scenarios)
+    try:
+      if self.forkable() and len(scenarios) > 1:
+        _runner = self
+        context = multiprocessing.get_context('fork')
+        with context.Pool(self.processes) as pool:
+          results = pool.map(_runScenario, scenarios, self.chunksize)
+      else:
+        results = [self.runScenario(scenario) for scenario in scenarios]
+    finally:
+      _runner = None
+      for symbol, value in self.base.items():          # Restore the inputs
+        self.symbols[symbol].value = value
+      self.scheduler.update()      # Outputs of the restored inputs again
+    stacked = {}
+    for i, var in enumerate(self.outputs):
+      stacked[var.symbol] = np.stack([result[i] for result in results])
+    return stacked
+
+  def runVectorized(self, scenarios):
+    """
+    Evaluate all the scenarios in one pass
+
+    The varied inputs are stacked along a leading batch axis and the operators
+    broadcast over it.  Outputs that do not depend on a varied input are
+    repeated for every scenario.  Afterwards the inputs are restored and the
+    variables depending on them are evaluated again without the batch axis.
+
+    Args:
+      scenarios: List of dictionaries from symbol (or variable) to value
+
+    Returns:
+      Dictionary from output symbol to the stacked values of all scenarios
+    """
+    scenarios = self.prepare(scenarios)
+    varied = set(self.symbols[symbol] for symbol in self.base)
+    self.scheduler.release()                  # Buffers change their shape
+    try:
+      for symbol, value in self.base.items():
+        self.symbols[symbol].value = np.stack([
+          np.asarray(scenario.get(symbol, value), dtype = float)
+          for scenario in scenarios])
+      self.scheduler.update()
+      stacked = {}
+      for var in self.outputs:
+        value = np.asarray(var.value)
+        if var not in varied and varied.isdisjoint(self.scheduler.inputs.get(
+                                                      var, ())):
+          value = np.broadcast_to(value, (len(scenarios),) + value.shape)
+        stacked[var.symbol] = np.array(value, copy = True)
+    finally:
+      for symbol, value in self.base.items():          # Restore the inputs
+        self.symbols[symbol].value = value
+      self.scheduler.release()                # Buffers have the batch axis
+      self.scheduler.update()          # Outputs without the batch axis again
+    return stacked
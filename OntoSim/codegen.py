@@ -0,0 +1,257 @@
+"""
+..  module:: Code generation
+    :platform: Unix, Windows
+    :synopsis: Generate a standalone NumPy module evaluating a model.
+
+.. moduleauthor:: Arne Tobias Elve <arne.t.elve@ntnu.no>
+
+.. date:: 2017-09-28
+
+.. contents:: - Generator: straight line source of the compiled plans
+              - generateModule
+              - loadModule
+
+.. notes::    (2017-09-28) simtemplate writes the evaluation sequence, but the
+              generated files call the closures and need the whole model.  The
+              generator writes the instructions of the compiled plans in
+              evaluation order as NumPy calls on named arrays.  Selections and
+              block layouts become module constants,  so the module only
+              imports numpy and starts without building the model.
+"""
+
+import inspect
+import types
+from time import asctime, localtime, time                    # Library for time
+
+import numpy as np                                     # NUMPY numerical python
+from OntoSim.compiler import freeze
+import OntoSim.operatorImplementation as implementation
+import OntoSim.myerrors as myerrors                      # My error definitions
+
+UNARY = {                            # Source of the unary operators by name
+  'abs':  'np.fabs(%s)',
+  'exp':  'np.exp(%s)',
+  'inv':  'np.divide(1., %s)',
+  'sign': 'np.sign(%s)',
+  'cos':  'np.cos(%s)',
+  'sin':  'np.sin(%s)',
+  'sqrt': 'np.sqrt(%s)',
+  'ln':   'np.log(%s)',
+}
+
+TRANSPOSE = '''
+def _t(v):
+  """Transpose of the last two axes"""
+  if np.ndim(v) < 2:
+    return np.transpose(v)
+  return np.swapaxes(v, -1, -2)
+'''
+
+
+class Generator(object):
+  """
+  Source of the equations of a scheduler
+
+  The module defines  ``evaluate(values)``  that takes a dictionary with the
+  values of the inputs by symbol, adds the values of the variables with
+  equations and returns the dictionary.  The values are dense arrays.
+
+  Args:
+    scheduler: Scheduler of the model, without algebraic loops
+    name:      Name of the model in the module documentation
+  """
+  def __init__(self, scheduler, name = 'model'):
+    if scheduler.solvers:
+      raise myerrors.CodegenError('loop', sorted(var.symbol for var in
+                                                 scheduler.head))
+    self.scheduler = scheduler
+    self.name = name
+    self.constants = {}                         # Frozen value -> constant name
+    self.definitions = []                          # Source of the constants
+    self.helpers = [TRANSPOSE]                       # Source of the functions
+    self.count = 0                                # Temporaries in the module
+
+  def constant(self, prefix, value):
+    """Name of a module constant holding the value"""
+    key = freeze(value)
+    if key not in self.constants:
+      name = '%s%i' % (prefix, len(self.constants))
+      self.constants[key] = name
+      if isinstance(value, np.ndarray):
+        source = 'np.array(%r, dtype = np.%s)' % (value.tolist(), value.dtype)
+      else:
+        source = repr(value)
+      self.definitions.append('%s = %s' % (name, source))
+    return self.constants[key]
+
+  def helper(self, function):
+    """Copy a function of the implementation into the module"""
+    source = inspect.getsource(function)
+    if source not in self.helpers:
+      self.helpers.append(source)
+    return function.__name__
+
+  def temporary(self):
+    self.count += 1
+    return 't%i' % self.count
+
+  def statements(self, op, params, args, out):
+    """
+    Source of one instruction
+
+    Args:
+      op, params: Operation and parameters of the instruction
+      args:       Names of the operands
+      out:        Name of the result
+
+    Returns:
+      List of lines
+    """
+    if op in UNARY:
+      return ['%s = %s' % (out, UNARY[op] % args[0])]
+    if op == 'transpose':
+      return ['%s = _t(%s)' % (out, args[0])]
+    if op == 'ones':
+      return ['%s = np.ones(np.shape(%s))' % (out, args[0])]
+    if op in ('add', 'subtract', 'multiply'):
+      a, b = args
+      if params[0]:                                                   # Flip
+        b = '_t(%s)' % b
+      return ['%s = np.%s(%s, %s)' % (out, op, a, b)]
+    if op in ('contraction', 'expansion'):
+      spec = implementation.batchSpec(params[0])
+      return ['%s = np.einsum(%r, %s, %s)' % ((out, spec) + tuple(args))]
+    if op == 'rowreduction':
+      spec = implementation.batchSpec(params[0])
+      return ['%s = np.einsum(%r, %s, %s)[..., np.newaxis]' %
+              ((out, spec) + tuple(args))]
+    if op == 'blockreduction':
+      starts, full, count, total = implementation.blockSegments(params[0])
+      a, b = args
+      lines = []
+      if len(full) < count:                       # Empty blocks stay zero
+        lines.append('%s = np.zeros(np.shape(%s)[:-2] + (%i,) + '
+                     'np.shape(%s)[-1:])' % (out, a, count, a))
+      if total:
+        reduction = 'np.add.reduceat(np.multiply(%s, %s), %s, axis = -2)' % \
+                    (a, b, self.constant('STARTS', starts))
+        if len(full) == count:
+          lines.append('%s = %s' % (out, reduction))
+        else:
+          lines.append('%s[..., %s, :] = %s' %
+                       (out, self.constant('FULL', full), reduction))
+      return lines
+    if op == 'khatrirao':
+      sizea, sizeb, flip = params
+      a, b = args
+      if flip:
+        b = '_t(%s)' % b
+        sizeb = sizeb[::-1]
+      layout = implementation.krLayout(sizea, sizeb)
+      if layout is None:                              # Blocks do not pair up
+        self.helper(implementation.mkblocks)
+        name = self.helper(implementation.krBlocks)
+        return ['%s = %s(%s, %r, %s, %r)' % (out, name, a, sizea, b, sizeb)]
+      rowa, cola, rowb, colb = [self.constant('KR', index) for index in layout]
+      return ['%s = np.multiply(np.asarray(%s)[..., %s, %s], '
+              'np.asarray(%s)[..., %s, %s])' %
+              (out, a, rowa, cola, b, rowb, colb)]
+    if op == 'select':
+      axis, selection = params
+      a = args[0]
+      if axis is None:
+        return ['%s = []' % out]
+      if isinstance(selection, slice):
+        rows = '%i:%i' % (selection.start, selection.stop)
+        if axis == 0:
+          return ['%s = %s[..., %s, :]' % (out, a, rows)]
+        return ['%s = %s[..., %s]' % (out, a, rows)]
+      return ['%s = np.take(%s, %s, axis = %i)' %
+              (out, a, self.constant('SELECT', selection), axis - 2)]
+    raise myerrors.CodegenError(op)
+
+  def body(self):
+    """Lines of the evaluate function"""
+    lines = []
+    for var in self.scheduler.order:
+      plan = self.scheduler.plans[var]
+      names = {}
+      lines.append('# %s' % var.symbol)
+      for slot, leaf in plan.loads:
+        names[slot] = self.temporary()
+        lines.append('%s = values[%r]' % (names[slot], leaf.symbol))
+      for op, fn, inputs, output, node in plan.instructions:
+        if node.fn is None:                # Opaque closure, no source known
+          raise myerrors.CodegenError(op, [var.symbol])
+        names[output] = self.temporary()
+        lines.extend(self.statements(op, node.params,
+                                     [names[i] for i in inputs],
+                                     names[output]))
+      lines.append('values[%r] = %s' % (var.symbol, names[plan.outputs[0]]))
+      lines.append('')
+    return lines
+
+  def source(self):
+    """Source of the module"""
+    body = self.body()
+    computed = set(var.symbol for var in self.scheduler.order)
+    inputs = []
+    for var in self.scheduler.order:
+      for slot, leaf in self.scheduler.plans[var].loads:
+        if leaf.symbol not in computed and leaf.symbol not in inputs:
+          inputs.append(leaf.symbol)
+    outputs = [var.symbol for var in self.scheduler.order]
+    lines = ['"""',
+             'Equations of the model %s' % self.name,
+             '',
+             'Generated by OntoSim.codegen on %s.' % asctime(localtime(time())),
+             'Do not edit, generate again after changing the model.',
+             '"""',
+             '',
+             'import numpy as np',
+             '',
+             'INPUTS = %r' % (tuple(inputs),),
+             'OUTPUTS = %r' % (tuple(outputs),),
+             '']
+    lines.extend(self.definitions)
+    lines.extend(self.helpers)
+    lines.extend(['',
+                  'def evaluate(values):',
+                  '  """',
+                  '  Evaluate the equations in order',
+                  '',
+                  '  Args:',
+                  '    values: Dictionary symbol -> value of the INPUTS',
+                  '',
+                  '  Returns:',
+                  '    The dictionary with the values of the OUTPUTS added',
+                  '  """'])
+    lines.extend(('  ' + line).rstrip() for line in body)
+    lines.append('  return values')
+    return '\n'.join(lines) + '\n'
+
+
+def generateModule(scheduler, filename = None, name = 'model'):
+  """
+  Generate the NumPy module of a model
+
+  Args:
+    scheduler: Scheduler of the model
+    filename:  Optional file the module is written to
+    name:      Name of the model in the module documentation
+
+  Returns:
+    Source of the module
+  """
+  source = Generator(scheduler, name).source()
+  if filename is not None:
+    with open(filename, 'w') as of:
+      of.write(source)
+  return source
+
+
+def loadModule(source, name = 'model'):
+  """Module from generated source, without writing it to a file"""
+  module = types.ModuleType(name)
+  exec(compile(source, '<%s>' % name, 'exec'), module.__dict__)
+  return module
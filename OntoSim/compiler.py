@@ -0,0 +1,225 @@
+"""
+..  module:: Compiler
+    :platform: Unix, Windows
+    :synopsis: Flatten executable graphs into linear evaluation plans.
+
+.. moduleauthor:: Arne Tobias Elve <arne.t.elve@ntnu.no>
+
+.. date:: 2017-09-04
+
+.. contents:: - Plan: linear instruction list of an executable graph
+              - compileExecutable
+              - compileVariable
+
+.. notes::    (2017-09-04) Every operator returns an Executable whose closure
+              calls the closures of its operands.  Evaluating a variable thus
+              walks a deep chain of lambdas  and evaluates shared sub-
+              expressions once for every occurrence.  The compiler lowers the
+              graph into a topologically ordered list of instructions
+              (operation, input slots, output slot) where common sub-
+              expressions are only evaluated once.
+              (2017-09-05) buffered plans write into preallocated buffers.
+              (2017-10-01) layout pass removing transposes, see layout.
+"""
+
+import numpy as np                                     # NUMPY numerical python
+from OntoSim.layout import optimise
+
+
+def freeze(params):
+  """
+  Make the operation parameters hashable
+
+  Args:
+    params: Tuple of parameters, may contain lists, slices and arrays
+
+  Returns:
+    Hashable representation used as key for common sub-expressions
+  """
+  if isinstance(params, np.ndarray):
+    return ('array', params.shape, params.dtype.str, params.tobytes())
+  if isinstance(params, slice):
+    return ('slice', params.start, params.stop, params.step)
+  if isinstance(params, (list, tuple)):
+    return tuple(freeze(p) for p in params)
+  return params
+
+
+class Plan(object):
+  """
+  Linear evaluation plan of one or more executable graphs
+
+  The plan  consists of  load instructions  copying the  current values of the
+  variables at the leaves into slots and a list of instructions  of the form
+  (op, fn, inputs, output) where inputs  and output  are slot numbers.  Slots
+  are filled in order, so a single loop evaluates the whole graph.
+
+  A buffered  plan lets  every  in-place  kernel  write into the buffer  of its
+  executable.  The first execution is the warm-up:  it evaluates  normally and
+  allocates the buffers  for the results that are floating  point arrays.  The
+  later executions do not allocate these results again.  Some kernels still use
+  temporaries on every call:  the block reduction the element wise product,  the
+  Khatri-Rao product the gathers of both operands (the block by block fallback
+  all of its blocks) and the kernels given sparse operands their dense copies.
+  Kernels that are not in-place,  e.g. transposes and selections of slices,
+  return new arrays or views as before.  Note that the target values are then
+  the buffers themselves and are overwritten by the next execution.
+
+  With ``layout`` the instructions are rewritten by the layout pass,  removing
+  transposes where the operators can absorb them.
+  """
+  def __init__(self, targets, buffered = False, layout = True):
+    self.targets = list(targets)                     # Executables to evaluate
+    self.buffered = buffered                   # Write into result buffers
+    self.warm = False                       # Buffers allocated after warm-up
+    self.loads = []                               # (slot, variable) for leaves
+    self.instructions = []                   # (op, fn, inputs, output, node)
+    self.outputs = []                     # Result slot of each of the targets
+    self.nslots = 0
+    self.lower()
+    self.removed = optimise(self) if layout else 0   # Transposes eliminated
+    self.slots = [None] * self.nslots
+    self.buffers = [None] * self.nslots
+    self.owned = []                      # Executables whose buffer we claimed
+
+  def newSlot(self):
+    self.nslots += 1
+    return self.nslots - 1
+
+  def lower(self):
+    """
+    Lower the targets into instructions
+
+    Post-order traversal  of the executable  graph.  Every node  is visited once
+    (by identity) and nodes with the same operation, parameters and inputs are
+    merged (by structure).  Variables are leaves and are loaded from their value.
+    """
+    visited = {}                                      # id(node) -> output slot
+    common = {}                                # structural key -> output slot
+    for target in self.targets:
+      stack = [(target, False)]
+      while stack:
+        node, expanded = stack.pop()
+        if id(node) in visited:
+          continue
+        if node.variable:                                # Leaf: load the value
+          slot = self.newSlot()
+          self.loads.append((slot, node))
+          visited[id(node)] = slot
+        elif node.fn is None:              # Opaque executable: call its closure
+          slot = self.newSlot()
+          self.instructions.append((node.op, node.ex, (), slot, node))
+          visited[id(node)] = slot
+        elif not expanded:                     # First visit: operands first
+          stack.append((node, True))
+          for arg in reversed(node.args):
+            if id(arg) not in visited:
+              stack.append((arg, False))
+        else:
+          inputs = tuple(visited[id(arg)] for arg in node.args)
+          key = (node.op, freeze(node.params), inputs)
+          if key not in common:
+            common[key] = self.newSlot()
+            self.instructions.append((node.op, node.fn, inputs, common[key],
+                                      node))
+          visited[id(node)] = common[key]
+      self.outputs.append(visited[id(target)])
+
+  def execute(self):
+    """
+    Run the plan
+
+    Returns:
+      List with the value of each of the targets
+    """
+    slots = self.slots
+    buffers = self.buffers
+    for slot, var in self.loads:
+      slots[slot] = var.value
+    for op, fn, inputs, output, node in self.instructions:
+      out = buffers[output]
+      if out is None:
+        slots[output] = fn(*[slots[i] for i in inputs])
+      else:
+        slots[output] = fn(*[slots[i] for i in inputs], out = out)
+    if self.buffered and not self.warm:
+      self.allocate()
+    return [slots[i] for i in self.outputs]
+
+  def allocate(self):
+    """
+    Allocate the result buffers after the warm-up evaluation
+
+    The buffer is sized from the index sets  of the executable  when these agree
+    with the evaluated result, otherwise from the result itself.  An executable
+    shared with another plan that already claimed its buffer gets a private one,
+    so that plans never write into each other's results.
+    """
+    for op, fn, inputs, output, node in self.instructions:
+      value = self.slots[output]
+      if not node.inplace or not isinstance(value, np.ndarray) \
+         or value.dtype != np.float64:
+        continue
+      try:
+        shape = node.shape
+      except (AttributeError, TypeError):
+        shape = None
+      if shape != value.shape:
+        shape = value.shape
+      buffer = node.allocate(shape)
+      if buffer is None:                   # Claimed by another plan
+        buffer = np.empty(shape)
+      else:
+        self.owned.append(node)
+      self.buffers[output] = buffer
+    self.warm = True
+
+  def release(self):
+    """Drop the result buffers, the next execution is a new warm-up"""
+    for node in self.owned:
+      node.buffer = None
+    self.owned = []
+    self.buffers = [None] * self.nslots
+    self.warm = False
+
+  def __len__(self):
+    return len(self.instructions)
+
+  def __str__(self):
+    lines = ['%3i <- %s' % (slot, var.symbol) for slot, var in self.loads]
+    for op, fn, inputs, output, node in self.instructions:
+      lines.append('%3i <- %s%s' % (output, op, inputs))
+    return '\n'.join(lines)
+
+
+def compileExecutable(exe, buffered = False, layout = True):
+  """
+  Compile a single executable
+
+  Args:
+    exe:      Executable object (or variable)
+    buffered: Evaluate into preallocated buffers
+    layout:   Run the layout pass
+
+  Returns:
+    Plan evaluating the executable
+  """
+  return Plan([exe], buffered, layout)
+
+
+def compileVariable(var, selector = None, buffered = False, layout = True):
+  """
+  Compile the selected equation of a variable
+
+  Args:
+    var:      Variable with at least one equation
+    selector: Equation alternative, defaults to the selector of the variable
+    buffered: Evaluate into preallocated buffers
+    layout:   Run the layout pass
+
+  Returns:
+    Plan evaluating the selected equation
+  """
+  if selector is None:
+    selector = var.selector
+  return Plan([var.equations[selector]], buffered, layout)
@@ -0,0 +1,289 @@
+"""
+..  module:: Derivatives
+    :platform: Unix, Windows
+    :synopsis: Forward mode automatic differentiation of compiled equations.
+
+.. moduleauthor:: Arne Tobias Elve <arne.t.elve@ntnu.no>
+
+.. date:: 2017-09-26
+
+.. contents:: - tangent: derivative rule of one instruction
+              - jvp: values and directional derivatives of a plan
+              - Jacobian: Jacobian of variables with respect to variables
+              - colouring
+              - loopJacobian
+
+.. notes::    (2017-09-26) The tangent of a value carries the directions in a
+              leading axis,  so the batched kernels of the operators compute
+              the derivatives of all directions at once:  a linear operator is
+              applied to the tangents,  a bilinear one as fn(da, b) + fn(a, db)
+              and the unary functions scale the tangent by their derivative.
+              Structural  tangents  (all values one,  no cancellation)  give
+              the sparsity pattern of the Jacobian.  Columns that do not share
+              a row get the same colour and are computed in one direction.
+"""
+
+import numpy as np                                     # NUMPY numerical python
+from OntoSim.operatorImplementation import issparse
+import OntoSim.myerrors as myerrors                      # My error definitions
+
+try:
+  import scipy.sparse as sp
+except ImportError:                            # Dense Jacobians only
+  sp = None
+
+# Derivative of the unary functions given the argument and the value
+UNARY = {
+  'abs':  lambda a, value: np.sign(a),
+  'exp':  lambda a, value: value,
+  'inv':  lambda a, value: -value * value,
+  'sign': None,                                          # Zero almost everywhere
+  'cos':  lambda a, value: -np.sin(a),
+  'sin':  lambda a, value: np.cos(a),
+  'sqrt': lambda a, value: 0.5 / value,
+  'ln':   lambda a, value: 1. / a,
+}
+LINEAR = ('select', 'transpose')
+BILINEAR = ('blockreduction', 'rowreduction', 'contraction', 'multiply',
+            'expansion', 'khatrirao')
+
+
+def directions(fn, a, b):
+  """
+  Apply a binary kernel to operands of which one carries the directions
+
+  Sparse kernels do not broadcast over leading axes,  so with a sparse operand
+  every direction is computed on its own.
+  """
+  if not issparse(a) and not issparse(b):
+    return fn(a, b)
+  if issparse(a):
+    return np.stack([np.asarray(fn(a, bk)) for bk in b])
+  return np.stack([np.asarray(fn(ak, b)) for ak in a])
+
+
+def structural(value):
+  """Value used for the sparsity pattern: one wherever it may be non-zero"""
+  if issparse(value):
+    return abs(value)
+  return np.ones(np.shape(value))
+
+
+def tangent(op, fn, params, values, value, tangents, pattern = False):
+  """
+  Tangent of the result of one instruction
+
+  Args:
+    op, fn, params: Operation, kernel and parameters of the instruction
+    values:         Values of the operands
+    value:          Value of the result
+    tangents:       Tangents of the operands, None if zero
+    pattern:        Structural tangent for the sparsity pattern
+
+  Returns:
+    Tangent of the result, None if zero
+  """
+  if all(t is None for t in tangents) or op == 'ones':
+    return None
+  if op in UNARY:
+    if UNARY[op] is None:
+      return None
+    if pattern:
+      return tangents[0]
+    return UNARY[op](values[0], value) * tangents[0]
+  if op in LINEAR:
+    return fn(tangents[0])
+  if op in ('add', 'subtract'):
+    da, db = tangents
+    if da is None:
+      da = np.zeros((len(db),) + np.shape(values[0]))
+    if db is None:
+      db = np.zeros((len(da),) + np.shape(values[1]))
+    if pattern and op == 'subtract':
+      db = -db                                          # No cancellation
+    return fn(da, db)
+  if op in BILINEAR:
+    a, b = values
+    if pattern:
+      a, b = structural(a), structural(b)
+    da, db = tangents
+    result = None
+    if da is not None:
+      result = directions(fn, da, b)
+    if db is not None:
+      term = directions(fn, a, db)
+      result = term if result is None else result + term
+    return result
+  raise myerrors.DerivativeError(op)
+
+
+def jvp(plan, seeds, pattern = False):
+  """
+  Evaluate a plan with the tangents of its results
+
+  Args:
+    plan:    Compiled plan
+    seeds:   Variable -> tangent,  array with the directions in the first axis
+             and the shape of the value of the variable.  Other variables have
+             a zero tangent.
+    pattern: Structural tangents for the sparsity pattern
+
+  Returns:
+    List with the tangent of each of the targets of the plan, None if zero
+  """
+  plan.execute()
+  slots = plan.slots
+  tangents = [None] * plan.nslots
+  for slot, var in plan.loads:
+    tangents[slot] = seeds.get(var)
+  for op, fn, inputs, output, node in plan.instructions:
+    if node.fn is None:                   # Opaque closure, no structure known
+      raise myerrors.DerivativeError(op)
+    tangents[output] = tangent(op, fn, node.params,
+                               [slots[i] for i in inputs], slots[output],
+                               [tangents[i] for i in inputs], pattern)
+  return [tangents[i] for i in plan.outputs]
+
+
+def colouring(pattern):
+  """
+  Greedy colouring of the columns of a sparsity pattern
+
+  Two columns with a non-zero in the same row get different colours.
+
+  Args:
+    pattern: Boolean array (rows, columns)
+
+  Returns:
+    Colour of each column, the colours are 0, 1, ...
+  """
+  pattern = np.asarray(pattern, dtype = bool)
+  colours = -np.ones(pattern.shape[1], dtype = np.intp)
+  rows = [np.flatnonzero(column) for column in pattern.T]
+  cols = [np.flatnonzero(row) for row in pattern]
+  for j in range(pattern.shape[1]):
+    used = set(colours[k] for i in rows[j] for k in cols[i] if colours[k] >= 0)
+    colour = 0
+    while colour in used:
+      colour += 1
+    colours[j] = colour
+  return colours
+
+
+class Jacobian(object):
+  """
+  Jacobian of variables with respect to other variables
+
+  The equations of the scheduler between the inputs and the outputs are
+  differentiated in evaluation order.  The values of the variables are flattened
+  in the order of the lists,  every variable in C order.  The model has to be
+  evaluated at the point of interest before the Jacobian is computed.
+
+  The sparsity pattern  is found  once  by structural tangents  and the columns
+  are coloured,  so that one evaluation of the Jacobian costs as many directions
+  as there are colours instead of one per input.
+
+  Args:
+    scheduler: Scheduler of the model
+    outputs:   Variables to differentiate
+    inputs:    Variables to differentiate with respect to
+  """
+  def __init__(self, scheduler, outputs, inputs):
+    self.scheduler = scheduler
+    self.outputs = list(outputs)
+    self.inputs = list(inputs)
+    required = scheduler.upstream(self.outputs)
+    varied = set(self.inputs)
+    self.chain = [var for var in scheduler.order if var in required
+                  and var not in varied
+                  and not varied.isdisjoint(scheduler.inputs[var])]
+    loops = [var.symbol for var in self.chain if var in scheduler.head]
+    if loops:
+      raise myerrors.DerivativeError('loop', loops)
+    self.pattern = None
+    self.colours = None
+
+  def shapes(self, variables):
+    return [np.shape(var.value) for var in variables]
+
+  def tangents(self, seed, pattern = False):
+    """
+    Directional derivatives of the outputs
+
+    Args:
+      seed: Directions in the inputs, array (number of inputs, directions)
+
+    Returns:
+      Derivatives of the outputs, array (number of outputs, directions)
+    """
+    count = seed.shape[1]
+    seeds = {}
+    start = 0
+    for var, shape in zip(self.inputs, self.shapes(self.inputs)):
+      size = int(np.prod(shape))
+      seeds[var] = seed[start:start + size].T.reshape((count,) + shape)
+      start += size
+    for var in self.chain:
+      seeds[var] = jvp(self.scheduler.plans[var], seeds, pattern)[0]
+    result = []
+    for var, shape in zip(self.outputs, self.shapes(self.outputs)):
+      size = int(np.prod(shape))
+      if seeds.get(var) is None:
+        result.append(np.zeros((size, count)))
+      else:
+        result.append(np.reshape(seeds[var], (count, size)).T)
+    return np.concatenate(result)
+
+  def sparsity(self):
+    """Boolean sparsity pattern (outputs, inputs), found once"""
+    if self.pattern is None:
+      n = sum(int(np.prod(shape)) for shape in self.shapes(self.inputs))
+      self.pattern = self.tangents(np.eye(n), pattern = True) != 0.
+      self.colours = colouring(self.pattern)
+    return self.pattern
+
+  def __call__(self, sparse = False):
+    """
+    Evaluate the Jacobian at the current values
+
+    Args:
+      sparse: Return a scipy.sparse CSR matrix instead of an array
+
+    Returns:
+      Jacobian (outputs, inputs)
+    """
+    pattern = self.sparsity()
+    seed = np.zeros((pattern.shape[1], int(self.colours.max()) + 1
+                     if len(self.colours) else 0))
+    seed[np.arange(pattern.shape[1]), self.colours] = 1.
+    compressed = self.tangents(seed)
+    rows, cols = np.nonzero(pattern)
+    data = compressed[rows, self.colours[cols]]
+    if sparse and sp is not None:
+      return sp.csr_matrix((data, (rows, cols)), shape = pattern.shape)
+    jac = np.zeros(pattern.shape)
+    jac[rows, cols] = data
+    return jac
+
+
+def loopJacobian(solver, x, r):
+  """
+  Jacobian of the residual of an algebraic loop, see solver.BlockSolver
+
+  The tangents of all the loop variables are computed in one batched pass
+  instead of one residual evaluation per unknown.
+  """
+  n = len(x)
+  seeds = {}
+  start = 0
+  for var, shape in zip(solver.block, solver.shapes):
+    size = int(np.prod(shape))
+    seeds[var] = np.eye(n)[start:start + size].T.reshape((n,) + shape)
+    start += size
+  rows = []
+  for var, shape in zip(solver.block, solver.shapes):
+    t = jvp(solver.plans[var], seeds)[0]
+    size = int(np.prod(shape))
+    rows.append(np.zeros((size, n)) if t is None
+                else np.reshape(t, (n, size)).T)
+  return np.eye(n) - np.concatenate(rows)
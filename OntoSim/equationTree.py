@@ -15,19 +15,40 @@
 
 .. notes::    (2017-03-09) second version of operator file
               (2017-03-30) added subclass of tree
+              (2017-09-20) slot based equations and tree variables
+              (2017-09-21) the tree is stored as a graph,  every variable is
+              expanded once and the paths are generated on request
+              (2017-09-22) given variables update the subtree incrementally
+              (2017-09-23) the dot graph is written from the graph,  not from
+              the paths
+              (2017-09-24) equation alternatives selected by structural analysis
 """
 
 import matplotlib.pyplot as plt                                    # Matplotlib
 # import networkx as nx                                              # Networkx
 from time import asctime, localtime, time                    # Library for time
+from collections import deque
+import OntoSim.structure as structure                    # Structural analysis
+
+DOTSTYLES = {                                # Node style of the variable types
+  'constant':   'fillcolor = Tomato',
+  'state':      'fillcolor = Navy, fontcolor = White',
+  'transport':  'fillcolor = Cyan',
+  'diffstate':  'fillcolor = LawnGreen',
+  'network':    'fillcolor = Gold',
+  'frame':      'fillcolor = Red',
+  'closure':    'fillcolor = AntiqueWhite',
+}
 
 class Equation(object):
   """Equation representation in the equation graph"""
+  __slots__ = ('symbol', 'alternative', 'ex', 'select')
+  type = 'equation'
+
   def __init__(self, symbol, alternative, exe):
     self.symbol = symbol
     self.alternative = alternative
     self.ex = exe
-    self.type = 'equation'
     self.select = True                                # Flag to select equation
 
   def __str__(self):
@@ -35,59 +56,135 @@ class Equation(object):
 
 class TreeVariable(object):
   """Representation of variable in tree"""
+  __slots__ = ('var', 'given')
+
   def __init__(self, var, given = False):
     self.var = var
-    self.symbol = var.symbol
-    self.type = var.type
-    self.equations = var.equations
     self.given = given                                 # Flag to check if given
 
+  @property
+  def symbol(self):
+    return self.var.symbol
+
+  @property
+  def type(self):
+    return self.var.type
+
+  @property
+  def equations(self):
+    return self.var.equations
+
 class EquationsTree(object):
-  """docstring for EquationsTree."""
+  """
+  Equation graph of a variable
+
+  The variables and equations reachable from the initial variable are stored
+  as a directed graph:  a variable points to its equation alternatives and an
+  equation to the variables it uses.  Every variable is expanded once, however
+  many paths lead to it.  State variables are not expanded.
+
+  The root-to-leaf paths of the original tree are enumerated lazily by paths(),
+  ``tree`` returns them as a list and should only be used for small trees.
+  """
   def __init__(self, treename, initialVar):
     self.treename = treename
     self.initialVar = initialVar
-    self.equations = {}
-    self.variables = {}
-    self.variables[self.initialVar.symbol] = self.initialVar
-    self.tree = self.buildTree([],[TreeVariable(self.initialVar)],self.initialVar)
+    self.equations = {}                             # Symbol -> Equation
+    self.variables = {}                             # Symbol -> TreeVariable
+    self.edges = {}                   # Symbol -> symbols of the successors
+    self.root = self.buildTree(self.initialVar)
     self.allElements = {**self.equations, **self.variables}
-    # print(self.allElements.keys())
-    # self.drawGraph()
 
-    # self.makeDotGraph()
-  def buildTree(self, tree, curpath, next):
-    """Tree builder"""
-    # equations = {}
-    # self.variables = {}
-    if next.equations:
-      for i,eq in enumerate(next.equations):
-        eqsymbol = 'eq'+str(i)+next.symbol
-        if eqsymbol not in self.equations.keys():
+  def treeVariable(self, var):
+    """The tree variable of a variable, made on first use"""
+    if var.symbol not in self.variables:
+      self.variables[var.symbol] = TreeVariable(var)
+    return self.variables[var.symbol]
+
+  def buildTree(self, initialVar):
+    """
+    Build the equation graph
+
+    Args:
+      initialVar: Variable at the root of the graph
+
+    Returns:
+      Tree variable of the root
+    """
+    root = self.treeVariable(initialVar)
+    stack = [initialVar]
+    while stack:
+      var = stack.pop()
+      if var.symbol in self.edges:                        # Already expanded
+        continue
+      self.edges[var.symbol] = []
+      if var.type == 'state' and var is not initialVar:
+        continue
+      for i,eq in enumerate(var.equations):
+        eqsymbol = 'eq'+str(i)+var.symbol
+        if eqsymbol not in self.equations:
           self.equations[eqsymbol] = Equation(eqsymbol, i, eq)
-        curpath.append(self.equations[eqsymbol])
-        # curpath.append(Equation(eqsymbol, i, eq))
-        # self.equations.append(eq)
-        for var in eq.instances:
-          # print('var.symbol = ', var.symbol)
-          if var in curpath or var.type == 'state':
-            if var.symbol not in self.variables.keys():
-              self.variables[var.symbol] = TreeVariable(var)
-            curpath.append(self.variables[var.symbol])
-            tree.append([var for var in curpath])
-            curpath.pop()
-          else:
-            if var.symbol not in self.variables.keys():
-              self.variables[var.symbol] = TreeVariable(var)
-            curpath.append(self.variables[var.symbol])
-            self.buildTree(tree,curpath,curpath[-1])
-        curpath.pop()
-      curpath.pop()
-    else:
-      tree.append([var for var in curpath])
-      curpath.pop()
-    # self.tree = tree
-    return tree
+        self.edges[var.symbol].append(eqsymbol)
+        successors = []
+        for inst in eq.instances:
+          self.treeVariable(inst)
+          if inst.symbol not in successors:
+            successors.append(inst.symbol)
+          if inst.symbol not in self.edges:
+            stack.append(inst)
+        self.edges[eqsymbol] = successors
+    return root
+
+  def paths(self, start = None):
+    """
+    Generate the root-to-leaf paths
+
+    A path ends in a variable without equations, in a state variable or in a
+    variable that is already on the path.
+
+    Args:
+      start: Tree variable to start from, defaults to the root
+
+    Yields:
+      List of alternating tree variables and equations
+    """
+    if start is None:
+      start = self.root
+    path = [start]
+    onPath = set([start.symbol])
+    successors = self.successors(start.symbol)
+    if not successors:
+      yield list(path)
+      return
+    stack = [iter(successors)]
+    while stack:
+      successor = next(stack[-1], None)
+      if successor is None:                      # Exhausted, step back
+        stack.pop()
+        onPath.discard(path.pop().symbol)
+        continue
+      element = self.allElements[successor]
+      path.append(element)
+      if element.type == 'equation':
+        stack.append(iter(self.successors(successor)))
+        onPath.add(successor)
+        continue
+      successors = self.successors(successor)
+      if successor in onPath or element.type == 'state' or not successors:
+        yield list(path)                                        # Leaf
+        path.pop()
+        continue
+      stack.append(iter(successors))
+      onPath.add(successor)
+
+  def successors(self, symbol):
+    """Symbols of the elements following an element in the paths"""
+    return self.edges[symbol]
+
+  @property
+  def tree(self):
+    """All the root-to-leaf paths as a list"""
+    return list(self.paths())
 
   def drawGraph(self):
     """
@@ -121,8 +218,34 @@ class EquationsTree(object):
     # plt.savefig("weighted_graph.png") # save as png
     plt.show() # display
 
-  def makeDotGraph(self):
-    filename = './DOT/' + self.treename + '.dot'
+  def elements(self):
+    """
+    Generate the symbols of the elements in the tree
+
+    Breadth first from the root, every element once.
+    """
+    seen = set([self.root.symbol])
+    queue = deque([self.root.symbol])
+    while queue:
+      symbol = queue.popleft()
+      yield symbol
+      for successor in self.successors(symbol):
+        if successor not in seen:
+          seen.add(successor)
+          queue.append(successor)
+
+  def makeDotGraph(self, filename = None):
+    """
+    Write the tree in the dot language
+
+    Every element and every edge of the graph is written once, in the order
+    they are reached from the root.
+
+    Args:
+      filename: Output file, defaults to ./DOT/<treename>.dot
+    """
+    if filename is None:
+      filename = './DOT/' + self.treename + '.dot'
     with open(filename,'w') as of:
       of.write('#'*79+'\n')
       of.write('#\t Purpose: Dot graph for equation tree.\n')
@@ -132,47 +255,19 @@ class EquationsTree(object):
       of.write('#'*79+'\n')
       of.write('graph G {\n')
 
-      # INITIATE NODES
-      alEls = []
-      for path in self.tree:
-        for el in path:
-          if el.symbol in alEls:
-            # print(el.symbol)
-            continue
-          shape = 'ellipse'
-          if el.type == 'equation':
-            of.write(el.symbol+' [style = filled, label = ' + str(el.alternative) +', shape = box, fillcolor = DeepPink];\n')
-            alEls.append(el.symbol)
-            continue
-          if el.given:
-            shape = 'doubleoctagon'
-          if el.type == 'constant':
-            of.write(el.symbol+' [style = filled, fillcolor = Tomato, shape = '+shape+'];\n')
-          elif el.type == 'state':
-            of.write(el.symbol+' [style = filled, fillcolor = Navy, fontcolor = White, shape = '+shape+'];\n')
-          elif el.type == 'transport':
-            of.write(el.symbol+' [style = filled, fillcolor = Cyan, shape = '+shape+'];\n')
-          elif el.type == 'diffstate':
-            of.write(el.symbol+' [style = filled, fillcolor = LawnGreen, shape = '+shape+'];\n')
-          elif el.type == 'network':
-            of.write(el.symbol+' [style = filled, fillcolor = Gold, shape = '+shape+'];\n')
-          elif el.type == 'frame':
-            of.write(el.symbol+' [style = filled, fillcolor = Red, shape = '+shape+'];\n')
-          elif el.type == 'closure':
-            of.write(el.symbol+' [style = filled, fillcolor = AntiqueWhite, shape = '+shape+'];\n')
-          else:
-            of.write(el.symbol+' [style = filled, fillcolor = White, shape = '+shape+'];\n')
-          alEls.append(el.symbol)
-
-      allPaths = []
-      for path in self.tree:
-        for a,b in zip(path[:-1], path[1:]):
-          if (a.symbol,b.symbol) in allPaths:
-            # print(a,b)
-            continue
-          else:
-            of.write(a.symbol+' -- '+b.symbol+';\n')
-            allPaths.append((a.symbol,b.symbol))
+      symbols = list(self.elements())
+      for symbol in symbols:                                        # NODES
+        el = self.allElements[symbol]
+        if el.type == 'equation':
+          of.write(symbol+' [style = filled, label = ' + str(el.alternative) +', shape = box, fillcolor = DeepPink];\n')
+          continue
+        shape = 'doubleoctagon' if el.given else 'ellipse'
+        style = DOTSTYLES.get(el.type, 'fillcolor = White')
+        of.write(symbol+' [style = filled, '+style+', shape = '+shape+'];\n')
+
+      for symbol in symbols:                                        # EDGES
+        for successor in self.successors(symbol):
+          of.write(symbol+' -- '+successor+';\n')
       of.write('}')
 
   def variableIndex(self):
@@ -189,80 +284,96 @@ class EquationsTree(object):
 class SubTree(EquationsTree):
   """
   Tree for a node or an arc
+
+  The pruned tree stops at constants, networks and given variables, and before
+  equations that are not selected.  It is kept as the set of active elements of
+  the equation graph,  the elements reachable from the root  along the pruned
+  edges.  Changing a given variable only updates the active elements below it.
+  elements() and makeDotGraph() read the active elements instead of walking the
+  graph again.  The pruned paths are generated by paths() and the DOT file is
+  only written when makeDotGraph() is called.
   """
   def __init__(self, treename, initialVar):
 
-    self.treename = treename
-    self.initialVar = initialVar
-    self.equations = {}
-    self.variables = {}
-    self.variables[self.initialVar.symbol] = self.initialVar
-    self.yggdrasil = self.buildTree([],[TreeVariable(self.initialVar)],self.initialVar)
-    # self.allElements = {}                  # Collection of all elements in tree
-    self.allElements = {**self.equations, **self.variables}
-    print(self.allElements.keys())
-    self.tree = [path for path in self.yggdrasil]
-
+    EquationsTree.__init__(self, treename, initialVar)
+    self.parents = {symbol: [] for symbol in self.edges}   # Reverse of edges
+    for symbol, successors in self.edges.items():
+      for successor in successors:
+        self.parents[successor].append(symbol)
+    self.position = {symbol: i for i, symbol in enumerate(self.edges)}
+    self.active = set()                 # Symbols of the elements in the tree
     self.buildGraphTree()
     # self.makeDotGraph()
 
-
-  def buildGraphTree(self, tree = None):
-    """make subtree"""
-    variables = []
-    equations = []
-    # alElements = {}
-    # print(self.allElements.keys())
-    thisTree = []
-    if not tree:
-      tree = self.tree
-    for path in tree:
-      thisPath = []
-      for el in path:
-        thisPath.append(el)
-        if el.type == 'equation':
-          # if el.symbol not in alElements.keys():
-            # self.allElements[el.symbol] = Equation(el.symbol, el.alternative, el.ex)
-          # thisPath.append(alElements[el.symbol])
-          if el.select == False:
-            thisPath.pop()
-            break
-          equations.append(self.allElements[el.symbol])
-          continue
-        else: # Variable of some sort
-          # if el.symbol not in self.allElements.keys():
-            # self.allElements[el.symbol] = TreeVariable(el.var, el.given)
-          # equations.append(self.allElements[el.symbol])
-          # vara = TreeVariable(el.var)
-          variables.append(self.allElements[el.symbol])
-          # thisPath.append(vara)
-        # thisPath.append(alElements[el.symbol])
-        if el.type == 'constant' or el.type == 'network' or el.given:
-          # Ensure that last element in path is constant or given.
-          break
-      if thisPath not in thisTree:
-        thisTree.append([var for var in thisPath])
-    self.tree = [path for path in thisTree]
-    # self.alElements = alElements
-    # return thisTree, variables, equations
+  def expands(self, element):
+    """True if the pruned tree continues after the element"""
+    if element.type == 'equation':
+      return element.select
+    return not (element.given or element.type == 'constant' or
+                element.type == 'network')
+
+  def successors(self, symbol):
+    """Symbols of the elements following an element in the pruned tree"""
+    if not self.expands(self.allElements[symbol]):
+      return []
+    return [successor for successor in self.edges[symbol]
+            if self.allElements[successor].type != 'equation'
+            or self.allElements[successor].select]
+
+  def elements(self):
+    """Symbols of the active elements in the order of the graph"""
+    return iter(sorted(self.active, key = self.position.__getitem__))
+
+  def activate(self, symbols):
+    """Add the elements and everything reachable from them to the tree"""
+    stack = list(symbols)
+    while stack:
+      symbol = stack.pop()
+      if symbol in self.active:
+        continue
+      self.active.add(symbol)
+      stack.extend(self.successors(symbol))
+
+  def buildGraphTree(self):
+    """Find the active elements from scratch"""
+    self.active = set()
+    self.activate([self.root.symbol])
 
   def setGivenVariableByName(self, symbol):
     """
     Select a variable to be given
 
+    The elements below the variable are dropped from the tree unless they are
+    still reached through another active element.
+
     Args:
       symbol:  Unique symbol of the given variable
 
     Returns:
       Updated equation tree for this element.
     """
-    self.allElements[symbol].given = True
-    self.buildGraphTree()
-    self.makeDotGraph()
+    element = self.allElements[symbol]
+    below = self.successors(symbol) if symbol in self.active else []
+    element.given = True
+    candidates = set()
+    stack = list(below)
+    while stack:                              # Everything reached through it
+      successor = stack.pop()
+      if successor in candidates or successor not in self.active:
+        continue
+      candidates.add(successor)
+      stack.extend(self.successors(successor))
+    self.active -= candidates
+    seeds = [candidate for candidate in candidates
+             if candidate == self.root.symbol
+             or any(parent in self.active and
+                    candidate in self.successors(parent)
+                    for parent in self.parents[candidate])]
+    self.activate(seeds)
 
   def unsetGivenVariableByName(self, symbol):
     """
-    Select a variable to be given
+    Select a variable to be not given
 
     Args:
       symbol:  Unique symbol of the given variable
@@ -271,8 +382,8 @@ class SubTree(EquationsTree):
       Updated equation tree for this element.
     """
     self.allElements[symbol].given = False
-    self.buildGraphTree(tree = self.yggdrasil)
-    self.makeDotGraph()
+    if symbol in self.active:
+      self.activate(self.successors(symbol))
 
   def selectEquationAlternative(self, var, alternative):
     """
@@ -285,4 +396,29 @@ class SubTree(EquationsTree):
     Return:
       sets the equation locally as selected
     """
-    pass
+    self.markSelected(var, alternative)
+    var.selector = alternative
+    self.buildGraphTree()
+
+  def markSelected(self, var, alternative):
+    """Flag the alternative as the only selected equation of the variable"""
+    for i in range(len(var.equations)):
+      self.allElements['eq'+str(i)+var.symbol].select = (i == alternative)
+
+  def selectAlternatives(self):
+    """
+    Select the equation alternatives by structural analysis
+
+    The given variables of the tree are known.  See structure.analyse.
+
+    Returns:
+      Structure with the evaluation order, the loops and the tear variables
+    """
+    variables = [el.var for el in self.variables.values()]
+    given = [el.var for el in self.variables.values() if el.given]
+    result = structure.analyse(variables, given)
+    for var, alternative in result.selection.items():
+      self.markSelected(var, alternative)
+    result.apply()
+    self.buildGraphTree()
+    return result
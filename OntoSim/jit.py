@@ -0,0 +1,312 @@
+"""
+..  module:: JIT
+    :platform: Unix, Windows
+    :synopsis: Numba compiled kernel of the equations of a model.
+
+.. moduleauthor:: Arne Tobias Elve <arne.t.elve@ntnu.no>
+
+.. date:: 2017-09-29
+
+.. contents:: - LoopGenerator: loop source of the compiled plans
+              - JitModel: evaluate a model with one compiled kernel
+
+.. notes::    (2017-09-29) Most equations of a node are small,  so the time is
+              spent in the overhead of the NumPy calls.  All the values of the
+              model are placed in one flat float64 work array and every
+              instruction of the plans is written as explicit loops over it.
+              The loops are compiled by numba into a single kernel.  The source
+              is written to a cache directory under the sha256 digest of its
+              content, so the compiled kernel is cached on disk by numba and
+              found again in the next session.  Without numba the model is
+              evaluated by the scheduler.
+"""
+
+import hashlib
+import importlib.util
+import os
+import tempfile
+
+import numpy as np                                     # NUMPY numerical python
+from OntoSim.codegen import Generator
+import OntoSim.operatorImplementation as implementation
+import OntoSim.myerrors as myerrors                      # My error definitions
+
+try:
+  import numba
+except ImportError:                              # NumPy evaluation only
+  numba = None
+
+UNARY = {                              # Scalar source of the unary operators
+  'abs':  'abs(%s)',
+  'exp':  'np.exp(%s)',
+  'inv':  '1. / %s',
+  'sign': 'np.sign(%s)',
+  'cos':  'np.cos(%s)',
+  'sin':  'np.sin(%s)',
+  'sqrt': 'np.sqrt(%s)',
+  'ln':   'np.log(%s)',
+}
+ELEMENTWISE = {'add': '%s + %s', 'subtract': '%s - %s', 'multiply': '%s * %s'}
+
+
+class LoopGenerator(Generator):
+  """
+  Loop source of the equations of a scheduler
+
+  The module defines  ``kernel(work)``  evaluating all the equations  on the
+  flat work array.  ``regions`` gives the offset and the shape of the value of
+  every variable in the work array.  The values have to be dense matrices and
+  the model is evaluated once to find the shapes.
+
+  Args:
+    scheduler: Scheduler of the model, without algebraic loops
+    name:      Name of the model in the module documentation
+  """
+  def __init__(self, scheduler, name = 'model'):
+    Generator.__init__(self, scheduler, name)
+    self.regions = {}                     # Variable -> (offset, shape) in work
+    self.size = 0                                 # Size of the work array
+    self.slots = {}                     # (plan, slot) -> (offset, shape)
+    scheduler.evaluateAll()
+    for var in scheduler.order:
+      plan = scheduler.plans[var]
+      for slot, leaf in plan.loads:
+        self.slots[id(plan), slot] = self.region(leaf, plan.slots[slot])
+      self.region(var, var.value)
+      for op, fn, inputs, output, node in plan.instructions:
+        if output == plan.outputs[0]:
+          self.slots[id(plan), output] = self.regions[var]
+        else:
+          self.slots[id(plan), output] = self.allocate(plan.slots[output])
+
+  def shape(self, value):
+    if implementation.issparse(value) or np.ndim(value) != 2:
+      raise myerrors.CodegenError('value of shape %s' % (np.shape(value),))
+    return np.shape(value)
+
+  def allocate(self, value):
+    """Place a value in the work array"""
+    shape = self.shape(value)
+    offset = self.size
+    self.size += shape[0] * shape[1]
+    return offset, shape
+
+  def region(self, var, value):
+    if var not in self.regions:
+      self.regions[var] = self.allocate(value)
+    return self.regions[var]
+
+  def at(self, operand, row, col):
+    """Element of an operand, broadcasting dimensions of size one"""
+    offset, (rows, cols) = operand
+    index = [str(offset)]
+    if ' ' in row:
+      row = '(%s)' % row
+    if rows > 1:
+      index.append('%s * %i' % (row, cols) if cols > 1 else row)
+    if cols > 1:
+      index.append(col)
+    return 'work[%s]' % ' + '.join(index)
+
+  def loops(self, out, expression):
+    """Element wise loops over the result"""
+    offset, (rows, cols) = out
+    return ['for i in range(%i):' % rows,
+            '  for j in range(%i):' % cols,
+            '    %s = %s' % (self.at(out, 'i', 'j'), expression)]
+
+  def statements(self, op, params, args, out):
+    """
+    Loops of one instruction
+
+    Args:
+      op, params: Operation and parameters of the instruction
+      args:       Offset and shape of the operands
+      out:        Offset and shape of the result
+
+    Returns:
+      List of lines
+    """
+    if op in UNARY:
+      return self.loops(out, UNARY[op] % self.at(args[0], 'i', 'j'))
+    if op == 'transpose':
+      return self.loops(out, self.at(args[0], 'j', 'i'))
+    if op == 'ones':
+      return self.loops(out, '1.')
+    if op in ELEMENTWISE:
+      a, b = args
+      b = self.at(b, 'j', 'i') if params[0] else self.at(b, 'i', 'j')
+      return self.loops(out, ELEMENTWISE[op] % (self.at(a, 'i', 'j'), b))
+    if op in ('contraction', 'expansion', 'rowreduction'):
+      return self.contraction(params[0], args, out)
+    if op == 'blockreduction':
+      a, b = args
+      offsets = np.concatenate([[0], np.cumsum(params[0])]).astype(np.intp)
+      name = self.constant('OFFSETS', offsets)
+      offset, (rows, cols) = out
+      return ['for i in range(%i):' % rows,
+              '  for j in range(%i):' % cols,
+              '    s = 0.',
+              '    for r in range(%s[i], %s[i + 1]):' % (name, name),
+              '      s += %s * %s' % (self.at(a, 'r', 'j'), self.at(b, 'r', 'j')),
+              '    %s = s' % self.at(out, 'i', 'j')]
+    if op == 'khatrirao':
+      sizea, sizeb, flip = params
+      if flip:
+        sizeb = sizeb[::-1]
+      layout = implementation.krLayout(sizea, sizeb)
+      if layout is None:                              # Blocks do not pair up
+        raise myerrors.CodegenError('ragged khatrirao')
+      rowa, cola, rowb, colb = [self.constant('KR', np.ravel(index))
+                                for index in layout]
+      a, b = args
+      b = self.at(b, colb + '[j]', rowb + '[i]') if flip else \
+          self.at(b, rowb + '[i]', colb + '[j]')
+      return self.loops(out, '%s * %s' % (self.at(a, rowa + '[i]',
+                                                   cola + '[j]'), b))
+    if op == 'select':
+      axis, selection = params
+      if axis is None:
+        return []
+      if isinstance(selection, slice):
+        index = '%i + %%s' % selection.start
+      else:
+        index = self.constant('SELECT', selection) + '[%s]'
+      if axis == 0:
+        return self.loops(out, self.at(args[0], index % 'i', 'j'))
+      return self.loops(out, self.at(args[0], 'i', index % 'j'))
+    raise myerrors.CodegenError(op)
+
+  def contraction(self, spec, args, out):
+    """Loops of a two operand einsum, the other letters are summed"""
+    sub1, sub2, output = implementation._layout(spec)
+    sizes = {}
+    for sub, (offset, shape) in zip((sub1, sub2), args):
+      for letter, size in zip(sub, shape):
+        sizes[letter] = max(sizes.get(letter, 1), size)
+    summed = [letter for letter in sizes if letter not in output]
+    lines = []
+    indent = ''
+    for letter in output:
+      lines.append('%sfor l%s in range(%i):' % (indent, letter, sizes[letter]))
+      indent += '  '
+    lines.append(indent + 's = 0.')
+    inner = indent
+    for letter in summed:
+      lines.append('%sfor l%s in range(%i):' % (inner, letter, sizes[letter]))
+      inner += '  '
+    a, b = [self.at(arg, 'l' + sub[0], 'l' + sub[1])
+            for sub, arg in zip((sub1, sub2), args)]
+    lines.append('%ss += %s * %s' % (inner, a, b))
+    position = ['l' + letter for letter in output] + ['0']
+    lines.append('%s%s = s' % (indent, self.at(out, position[0], position[1])))
+    return lines
+
+  def body(self):
+    """Lines of the kernel"""
+    lines = []
+    for var in self.scheduler.order:
+      plan = self.scheduler.plans[var]
+      lines.append('# %s' % var.symbol)
+      for op, fn, inputs, output, node in plan.instructions:
+        if node.fn is None:                # Opaque closure, no source known
+          raise myerrors.CodegenError(op, [var.symbol])
+        lines.extend(self.statements(op, node.params,
+                                     [self.slots[id(plan), i] for i in inputs],
+                                     self.slots[id(plan), output]))
+      result = self.slots[id(plan), plan.outputs[0]]
+      if result != self.regions[var]:                   # Output is an input
+        lines.extend(self.loops(self.regions[var],
+                                self.at(result, 'i', 'j')))
+      lines.append('')
+    return lines
+
+  def source(self):
+    """Source of the module"""
+    body = self.body()
+    lines = ['"""',
+             'Loop kernel of the model %s' % self.name,
+             '',
+             'Generated by OntoSim.jit.  Do not edit.',
+             '"""',
+             '',
+             'import numpy as np',
+             'try:',
+             '  from numba import njit',
+             'except ImportError:                        # Plain Python loops',
+             '  njit = lambda **options: lambda function: function',
+             '']
+    lines.extend(self.definitions)
+    lines.extend(['',
+                  '',
+                  '@njit(cache = True)',
+                  'def kernel(work):',
+                  '  """Evaluate the equations in order on the work array"""'])
+    lines.extend(('  ' + line).rstrip() for line in body)
+    return '\n'.join(lines) + '\n'
+
+
+class JitModel(object):
+  """
+  Evaluate a model with one compiled kernel
+
+  The inputs are copied into the work array, the kernel is called and the
+  values of the variables with equations are set to views of the work array.
+  These are overwritten by the next evaluation, as with buffered plans.
+
+  Args:
+    scheduler: Scheduler of the model
+    cachedir:  Directory of the generated source and the numba cache
+    name:      Name of the model
+    jit:       None to compile with numba if it is installed and otherwise
+               evaluate with the scheduler, True to require numba, False to run
+               the loops in plain Python (slow, for checking)
+  """
+  def __init__(self, scheduler, cachedir = None, name = 'model', jit = None):
+    if jit and numba is None:
+      raise ImportError('The jit backend requires numba')
+    self.scheduler = scheduler
+    self.kernel = None
+    if jit is None and numba is None:                     # NumPy fallback
+      return
+    generator = LoopGenerator(scheduler, name)
+    source = generator.source()
+    self.regions = generator.regions
+    self.work = np.zeros(generator.size)
+    computed = set(scheduler.order)
+    self.inputs = [(var, region) for var, region in self.regions.items()
+                   if var not in computed]
+    self.outputs = [(var, self.regions[var]) for var in scheduler.order]
+    if cachedir is None:
+      cachedir = os.path.join(tempfile.gettempdir(), 'ontosim-jit')
+    os.makedirs(cachedir, exist_ok = True)
+    filename = os.path.join(cachedir, '%s_%s.py' %
+                            (name, hashlib.sha256(source.encode()).hexdigest()))
+    if not os.path.exists(filename):          # Atomic, other processes may race
+      handle, temporary = tempfile.mkstemp(suffix = '.tmp', dir = cachedir)
+      try:
+        with os.fdopen(handle, 'w') as of:
+          of.write(source)
+        os.replace(temporary, filename)
+      except BaseException:
+        os.remove(temporary)
+        raise
+    spec = importlib.util.spec_from_file_location(
+      'ontosim_jit_' + os.path.basename(filename)[:-3], filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    self.kernel = module.kernel
+    if jit is False:                         # Python function behind numba
+      self.kernel = getattr(module.kernel, 'py_func', module.kernel)
+
+  def evaluateAll(self):
+    """Update the value of every variable with an equation"""
+    if self.kernel is None:
+      self.scheduler.evaluateAll()
+      return
+    work = self.work
+    for var, (offset, shape) in self.inputs:
+      work[offset:offset + shape[0] * shape[1]] = np.ravel(var.value)
+    self.kernel(work)
+    for var, (offset, shape) in self.outputs:
+      var.value = work[offset:offset + shape[0] * shape[1]].reshape(shape)
@@ -0,0 +1,175 @@
+"""
+..  module:: Layout
+    :platform: Unix, Windows
+    :synopsis: Remove transposes from compiled plans.
+
+.. moduleauthor:: Arne Tobias Elve <arne.t.elve@ntnu.no>
+
+.. date:: 2017-10-01
+
+.. contents:: - optimise: layout pass over the instructions of a plan
+
+.. notes::    (2017-10-01) The operators transpose an operand when the order of
+              the index sets differs and makeExecuteable transposes a result
+              to the index order of its variable.  Transposes are strided
+              views,  so the following ufuncs walk memory with a large stride.
+              The layout pass cancels pairs of transposes, absorbs transposes
+              into the subscripts of contractions and expansions, computes a
+              transposed contraction as the contraction of the swapped
+              operands, and replaces a large operand that several instructions
+              use transposed by one contiguous transposed copy.
+"""
+
+import numpy as np                                     # NUMPY numerical python
+from OntoSim.objects import Executable, indexShape
+from OntoSim.operatorImplementation import transpose, contractionKernel
+from OntoSim.operatorImplementation import expansion, dense, _layout
+
+ELEMENTWISE = ('add', 'subtract', 'multiply')
+CONTIGUOUS = 4096            # Minimum number of elements of a shared copy
+
+
+def contiguousTranspose(val, out=None):
+  """Transpose of the last two axes as a contiguous array"""
+  return np.ascontiguousarray(transpose(val))
+
+
+def elementwise(op, flip):
+  """Kernel of an element wise operator, transposing the second operand"""
+  ufunc = getattr(np, op)
+  if flip:
+    return lambda a, b, out=None: ufunc(dense(a), dense(transpose(b)), out=out)
+  return lambda a, b, out=None: ufunc(dense(a), dense(b), out=out)
+
+
+def einsumKernel(op, spec):
+  """Kernel of a contraction or an expansion with the given subscripts"""
+  if op == 'contraction':
+    return contractionKernel(spec)
+  return lambda a, b, out=None: expansion(spec, a, b, out=out)
+
+
+def rewritten(node, op, params, fn, index = None):
+  """Node of an instruction with new parameters and kernel"""
+  return Executable(None, node.index if index is None else index,
+                    node.instances, op = op, params = params, fn = fn,
+                    inplace = node.inplace)
+
+
+def optimise(plan):
+  """
+  Layout pass over the instructions of a plan
+
+  Rewrites the instructions in place,  before the plan is executed for the
+  first time.  The results of the plan do not change.
+
+  Args:
+    plan: Plan, see compiler
+
+  Returns:
+    Number of transposes removed
+  """
+  instructions = []
+  producer = {}                 # Slot -> instruction computing it (rewritten)
+  alias = {}                        # Removed slot -> slot with the same value
+  uses = {}                                   # Slot -> number of consumers
+  for op, fn, inputs, output, node in plan.instructions:
+    for i in inputs:
+      uses[i] = uses.get(i, 0) + 1
+  for i in plan.outputs:
+    uses[i] = uses.get(i, 0) + 1
+
+  def transposed(slot):
+    """Slot of the value that the slot is the transpose of, or None"""
+    source = producer.get(slot)
+    if source is not None and source[0] == 'transpose' and \
+       source[1] is transpose:
+      return source[2][0]
+    return None
+
+  removed = 0
+  for op, fn, inputs, output, node in plan.instructions:
+    inputs = tuple(alias.get(i, i) for i in inputs)
+    if op == 'transpose' and fn is transpose:
+      inner = transposed(inputs[0])
+      if inner is not None:                             # T(T(x)) is x
+        alias[output] = inner
+        removed += 2
+        continue
+      source = producer.get(inputs[0])
+      if source is not None and source[0] == 'contraction' and \
+         uses.get(inputs[0]) == 1:          # T(A B) is the product B' A'
+        sub1, sub2, result = _layout(source[4].params[0])
+        swap = {'i': 'j', 'j': 'i', 'r': 'r'}
+        spec = '%s,%s -> %s' % (''.join(swap[l] for l in sub2),
+                                ''.join(swap[l] for l in sub1), result)
+        fn = contractionKernel(spec)
+        node = rewritten(source[4], 'contraction', (spec,), fn, node.index)
+        instructions.remove(source)
+        op, inputs = 'contraction', source[2][::-1]
+        removed += 1
+    elif op in ('contraction', 'expansion'):
+      subs = list(_layout(node.params[0]))
+      inputs = list(inputs)
+      absorbed = False
+      for k in (0, 1):
+        inner = transposed(inputs[k])
+        if inner is not None and len(subs[k]) == 2:   # Absorb in subscripts
+          subs[k] = subs[k][::-1]
+          inputs[k] = inner
+          absorbed = True
+          removed += 1
+      inputs = tuple(inputs)
+      if absorbed:
+        spec = '%s,%s -> %s' % tuple(subs)
+        fn = einsumKernel(op, spec)
+        node = rewritten(node, op, (spec,), fn)
+    elif op in ELEMENTWISE:
+      inner = transposed(inputs[1])
+      if inner is not None:                          # Toggle the flip
+        flip = not node.params[0]
+        inputs = (inputs[0], inner)
+        fn = elementwise(op, flip)
+        node = rewritten(node, op, (flip,), fn)
+        removed += 1
+    instruction = (op, fn, inputs, output, node)
+    instructions.append(instruction)
+    producer[output] = instruction
+  outputs = [alias.get(i, i) for i in plan.outputs]
+
+  live = set(outputs)                                  # Drop dead instructions
+  kept = []
+  for instruction in reversed(instructions):
+    if instruction[3] in live:
+      kept.append(instruction)
+      live.update(instruction[2])
+  instructions = kept[::-1]
+
+  flipped = {}                 # Slot -> instructions using it transposed
+  for k, (op, fn, inputs, output, node) in enumerate(instructions):
+    if op in ELEMENTWISE and node.params[0]:
+      flipped.setdefault(inputs[1], []).append(k)
+  nodes = dict((slot, var) for slot, var in plan.loads)
+  nodes.update((ins[3], ins[4]) for ins in instructions)
+  for slot in sorted(flipped, key = lambda slot: -len(flipped[slot])):
+    consumers = flipped[slot]
+    shape = indexShape(nodes[slot].index)
+    if len(consumers) < 2 or shape[0] * shape[1] < CONTIGUOUS:
+      continue
+    copy = plan.newSlot()                    # One contiguous transposed copy
+    node = Executable(None, list(reversed(nodes[slot].index)),
+                      nodes[slot].instances, op = 'transpose',
+                      fn = contiguousTranspose)
+    for k in consumers:
+      op, fn, inputs, output, consumer = instructions[k]
+      instructions[k] = (op, elementwise(op, False), (inputs[0], copy), output,
+                         rewritten(consumer, op, (False,),
+                                   elementwise(op, False)))
+    first = min(consumers)
+    instructions.insert(first, ('transpose', contiguousTranspose, (slot,),
+                                copy, node))
+    flipped = dict((s, [k + (k >= first) for k in ks])
+                   for s, ks in flipped.items())
+  plan.instructions = instructions
+  plan.outputs = outputs
+  return removed
@@ -8,8 +8,16 @@
 .. date:: 2017-03-07
 
 .. contents:: - SetError
+              - CycleError
+              - ConvergenceError
+              - DerivativeError
+              - CodegenError
 
 .. notes::    (2017-03-07) second version of operator file
+              (2017-09-08) added the cycle error for the scheduler
+              (2017-09-25) added the convergence error of the loop solver
+              (2017-09-26) added the error for missing derivative rules
+              (2017-09-28) added the error of the code generator
 """
 
 class SetError(Exception):
@@ -23,3 +31,43 @@ class SetError(Exception):
           msg = "An error occurred in combination with set %s" % superset
     super(SetError, self).__init__(msg)
     self.set = set
+
+class CycleError(Exception):
+  """The equations depend on each other in a loop"""
+  def __init__(self, symbols, msg=None):
+    if msg is None:
+      msg = "Algebraic loop between the variables %s" % ', '.join(symbols)
+    super(CycleError, self).__init__(msg)
+    self.symbols = symbols
+
+class ConvergenceError(Exception):
+  """The Newton iteration of an algebraic loop did not converge"""
+  def __init__(self, symbols, msg=None):
+    if msg is None:
+      msg = "No convergence of the loop between the variables %s" % ', '.join(symbols)
+    super(ConvergenceError, self).__init__(msg)
+    self.symbols = symbols
+
+class DerivativeError(Exception):
+  """No derivative rule for an operation"""
+  def __init__(self, op, symbols = None, msg=None):
+    if msg is None:
+      if symbols:
+        msg = "No derivative through the %s of the variables %s" % (op, ', '.join(symbols))
+      else:
+        msg = "No derivative rule for the operation %s" % op
+    super(DerivativeError, self).__init__(msg)
+    self.op = op
+    self.symbols = symbols
+
+class CodegenError(Exception):
+  """No source can be generated for an operation"""
+  def __init__(self, op, symbols = None, msg=None):
+    if msg is None:
+      if symbols:
+        msg = "No source for the %s of the variables %s" % (op, ', '.join(symbols))
+      else:
+        msg = "No source for the operation %s" % op
+    super(CodegenError, self).__init__(msg)
+    self.op = op
+    self.symbols = symbols
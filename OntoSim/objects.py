@@ -5,8 +5,10 @@ Contact:  arne.t.elve@ntnu.no
 Since:    2016-11-24
 Update:   2017-03-09
 Contents: Variables()                             - Keep track of all variables
+          Model()                     - Variables and index sets of one model
           Variable()                          - Keep track of a single variable
           Executable()                                   - A temporary variable
+          indexShape()                       - Shape of value over index sets
           IndexSet()                                    - A Index set framework
 
 
@@ -15,8 +17,21 @@ Comments: (2017-02-09) added  the  variables  class keeping track  of all the
           (2017-02-27) added sequential list of the equations.
           (2017-03-03) removed the node and arc object.  They  were obsolete.
           (2017-03-09)
+          (2017-09-04) executables  describe  their operation,  operands and
+          kernel so that the graph can be compiled.
+          (2017-09-05) executables may own a preallocated result buffer.
+          (2017-09-11) variables keep a version counter of their value.
+          (2017-09-18) index sets are immutable and hashable.
+          (2017-09-19) the collections  are owned by a model instead of being
+          shared class attributes.
+          (2017-09-20) variables and executables are slot based records.
+          (2017-10-02) the result buffer of an executable is claimed under a
+          lock,  plans of one level run in threads.
 """
 import numpy as np
+import threading
+import zlib
+from OntoSim.operatorImplementation import transpose   # Keeps batch axes
 
 class Variables(object):
   """
@@ -25,31 +40,16 @@ class Variables(object):
   This class is the collection of the variables. List of all types of variables
   and all equations sorted after type in sequence.
   """
-  transports = []
-  diffstates = []
-  equations = []
-  constants = []
-  variables = []
-  networks = []
-  closures = []
-  dynamics = []
-  symbols = []
-  states = []
-  frames = []
-  rest = []
-
-  seqtransports = []
-  seqdiffstates = []
-  seqequations = []
-  seqconstants = []
-  seqvariables = []
-  seqnetworks = []
-  seqclosures = []
-  seqdynamics = []
-  seqsymbols = []
-  seqstates = []
-  seqframes = []
-  seqrest = []
+  __slots__ = ('transports', 'diffstates', 'equations', 'constants',
+               'variables', 'networks', 'closures', 'dynamics', 'symbols',
+               'states', 'frames', 'rest',
+               'seqtransports', 'seqdiffstates', 'seqequations', 'seqconstants',
+               'seqvariables', 'seqnetworks', 'seqclosures', 'seqdynamics',
+               'seqsymbols', 'seqstates', 'seqframes', 'seqrest')
+
+  def __init__(self):
+    for name in Variables.__slots__:
+      setattr(self, name, [])
 
   def addVar(self, var):
     """
@@ -108,31 +108,123 @@ class Variables(object):
     else:
       self.seqrest.append(var)
 
-class Variable(Variables):
-  """A variable"""
+class Model(Variables):
+  """
+  Container of one model
+
+  The model owns the collection of its variables and its index sets.  Variables
+  and index sets  are registered  in the active model:  the innermost model used
+  in a with statement, otherwise the default model.  A model that is no longer
+  referenced  is freed  together with  everything  registered  in it,  so many
+  models can be built, evaluated and dropped in one process.
+
+    with Model('plant') as plant:
+      N = IndexSet('N', ...)
+      x = Variable('x', ...)
+  """
+  __slots__ = ('name', 'indexingSets', 'units', '__weakref__')
+  stack = []                                      # Models in with statements
+  default = None                  # Model used outside of any with statement
+
+  def __init__(self, name = 'model'):
+    Variables.__init__(self)
+    self.name = name
+    self.indexingSets = []                      # All indexing sets in sequence
+    self.units = {}                  # Shared tuples of the units of variables
+
+  @classmethod
+  def active(cls):
+    """The model in which new variables and index sets are registered"""
+    if cls.stack:
+      return cls.stack[-1]
+    return cls.default
+
+  def __enter__(self):
+    Model.stack.append(self)
+    return self
+
+  def __exit__(self, *args):
+    Model.stack.remove(self)
+
+  def clear(self):
+    """Drop all the variables and index sets of the model"""
+    for name in Variables.__slots__:
+      getattr(self, name).clear()
+    self.indexingSets.clear()
+    self.units.clear()
+
+  def __len__(self):
+    return len(self.variables)
+
+  def __str__(self):
+    return self.name
+
+Model.default = Model('default')
+
+
+class Variable(object):
+  """
+  A variable
+
+  Every assignment of the value increments the version of the variable.  This
+  is used to find the equations that have to be re-evaluated.  Changing the
+  value in place does not count as assignment, call touch() afterwards.
+
+  The variable is registered in the given model, by default the active model.
+  Variables are slot based records.  The units are shared between variables of
+  the model with the same units and the alternatives are kept in tuples.
+  """
+  __slots__ = ('model', 'documentation', 'symbol', 'index', 'units',
+               'selector', 'version', '_value', 'type', 'ex', 'equations',
+               '__weakref__')
   variable = True       # Flag to separate variables from intermediate variable
-  def __init__(self, symbol, documentation, type, units, index):
+
+  def __init__(self, symbol, documentation, type, units, index, model = None):
+    self.model = model if model is not None else Model.active()
     self.documentation = documentation
     self.symbol = symbol
     self.index = index
-    self.units = units
+    units = tuple(units)
+    self.units = self.model.units.setdefault(units, units)
     self.selector = 0
-    self.value = None
-    self.get = lambda: self.value
+    self.version = 0                     # Incremented on every assignment
+    self._value = None
     self.type = type
-    self.ex = []
-    self.instances = [self]           # Adds the variable to the instances list
-    self.equations = []
+    self.ex = ()                          # Closures of the alternatives
+    self.equations = ()                        # Equations of the alternatives
 
-    self.addVar(self)
+    self.model.addVar(self)
 
   def makeExecuteable(self, exe):
-    if self.index == exe.index:
-      self.ex.append(exe.ex)
-    else:
-      self.ex.append(lambda : np.transpose(exe.ex()))
-    self.addEquation(self)                  # Add equation to list of equations
-    self.equations.append(exe)
+    if self.index != exe.index:            # Wrap in transpose to match indices
+      inner = exe
+      exe = Executable(lambda: transpose(inner.ex()), self.index,
+                       inner.instances, op = 'transpose', args = (inner,),
+                       fn = transpose)
+    self.ex += (exe.ex,)
+    self.model.addEquation(self)            # Add equation to list of equations
+    self.equations += (exe,)
+
+  @property
+  def instances(self):
+    """The variable as the list of instances of an expression"""
+    return [self]
+
+  def get(self):
+    return self._value
+
+  @property
+  def value(self):
+    return self._value
+
+  @value.setter
+  def value(self, value):
+    self._value = value
+    self.version += 1
+
+  def touch(self):
+    """Mark the value as changed after modifying it in place"""
+    self.version += 1
 
   def updateValue(self):
     self.value = self.ex[self.selector]()
@@ -140,37 +232,161 @@ class Variable(Variables):
   def __str__(self):
     return self.symbol
 
+
+_claims = threading.Lock()             # Guards the claim of result buffers
+
+
 class Executable(object):
-  """Intermidiate variables"""
+  """
+  Intermidiate variables
+
+  Besides the closure ``ex`` an executable  carries a structural description of
+  itself:  the operation  name ``op``,  the operands ``args``  (variables or
+  other executables), the static  parameters ``params`` and  the kernel ``fn``
+  computing the value from the operand values.  The closure is kept for direct
+  evaluation, the structure is used by the compiler to flatten the graph.
+
+  Kernels flagged  ``inplace`` accept an ``out`` argument.  The executable can
+  then own a result buffer, sized from the blocking of its index sets, that the
+  kernel writes into instead of allocating a new array on every evaluation.
+  """
+  __slots__ = ('index', 'ex', 'get', 'instances', 'op', 'args', 'params', 'fn',
+               'inplace', 'buffer', '__weakref__')
   variable = False
 
-  def __init__(self, ex, index, instances):
+  def __init__(self, ex, index, instances, op = None, args = (), params = (),
+               fn = None, inplace = False):
     self.index = index
     self.ex = ex
     self.get = ex
     self.instances = instances
+    self.op = op                             # Operation name, None if opaque
+    self.args = tuple(args)                 # Operands in order of the kernel
+    self.params = tuple(params)                # Static operation parameters
+    self.fn = fn                          # Kernel taking the operand values
+    self.inplace = inplace                     # Kernel accepts out= argument
+    self.buffer = None                            # Preallocated result buffer
+
+  @property
+  def shape(self):
+    """Shape of the value given by the blocking of the index sets"""
+    return indexShape(self.index)
+
+  def allocate(self, shape = None):
+    """
+    Claim the preallocated result buffer
+
+    The check and the claim are atomic, so that  of two plans sharing the
+    executable  and  warming up  in different threads  only one  gets the
+    buffer.  The buffer is free again once it is reset to None.
+
+    Args:
+      shape: Shape of the buffer, defaults to the shape given by the index sets
+
+    Returns:
+      The buffer owned by this executable, None if it is claimed already
+    """
+    if shape is None:
+      shape = self.shape
+    with _claims:
+      if self.buffer is not None:
+        return None
+      self.buffer = np.empty(shape)
+      return self.buffer
 
   def __str__(self):
     return 'Termporary variable with the index sets: '+ str([ind.symbol for ind in self.index])
 
 
+def frozenArray(values):
+  """Read-only integer array"""
+  array = np.array(values, dtype = np.intp).reshape(-1)
+  array.setflags(write = False)
+  return array
+
+
+def indexShape(index):
+  """
+  Shape of a value over the given index sets
+
+  Single index sets are represented as column vectors.
+
+  Args:
+    index: List of index sets
+
+  Returns:
+    Tuple with the number of rows (and columns)
+  """
+  shape = tuple(int(np.sum(ind.blocking)) for ind in index)
+  if len(shape) == 1:
+    shape += (1,)
+  return shape
+
+
 class IndexSet(object):
-  """Each index set connected to the variable"""
-  indexingSets = []                             # All indexing sets in sequence
+  """
+  Each index set connected to the variable
+
+  The index set is frozen after construction.  The blocking and the mapping are
+  read-only integer arrays  and the sets a tuple.  The running offsets of the
+  blocks, the size and the block of every row are computed once.  Two index sets
+  are equal if they have the same symbol, superset, sets, mapping and blocking,
+  and the hash is derived from these, so index sets can be used as cache keys.
+  """
   def __init__(self,  symbol,                                   # UNIQUE SYMBOL
                       mapping = [],               # MAPPING OVER TO TO SUPERSET
                       superset = None,                 # PART OF WITCH SUPERSET
                       sets = [],                    # COMBINATION OF WHICH SETS
                       blocking = [],                         # BLOCK DEFINITION
+                      model = None,                  # OWNER, DEFAULT ACTIVE
               ):
-    self.blocking = blocking
+    self.model = model if model is not None else Model.active()
+    self.blocking = frozenArray(blocking)
     self.superset = superset
     self.symbol = symbol
-    self.mapping = mapping
-    self.sets = sets
-    if superset == None:
+    self.mapping = frozenArray(mapping)
+    self.sets = tuple(sets)
+    if superset is None:
       self.superset = self
-    self.indexingSets.append(self)
+    offsets = np.zeros(len(self.blocking) + 1, dtype = np.intp)
+    np.cumsum(self.blocking, out = offsets[1:])
+    self.offsets = frozenArray(offsets)    # Start of each block and the end
+    self.size = int(offsets[-1])                       # Total number of rows
+    self.blockOfRow = frozenArray(np.repeat(np.arange(len(self.blocking)),
+                                            self.blocking))
+    self.key = (symbol, self.superset.symbol,
+                tuple(ind.symbol for ind in self.sets),
+                tuple(self.mapping.tolist()), tuple(self.blocking.tolist()))
+    self.hash = zlib.crc32(repr(self.key).encode())    # Same in every process
+    self.selections = {}              # Subset -> rows selected, see select
+    self.frozen = True
+    self.model.indexingSets.append(self)
+
+  @property
+  def indexingSets(self):
+    """All indexing sets of the model in sequence"""
+    return self.model.indexingSets
+
+  def __setattr__(self, name, value):
+    if getattr(self, 'frozen', False):
+      raise AttributeError('Index set %s is immutable' % self.symbol)
+    object.__setattr__(self, name, value)
+
+  def __eq__(self, other):
+    if self is other:
+      return True
+    if not isinstance(other, IndexSet):
+      return NotImplemented
+    return self.key == other.key
+
+  def __ne__(self, other):
+    equal = self.__eq__(other)
+    if equal is NotImplemented:
+      return equal
+    return not equal
+
+  def __hash__(self):
+    return self.hash
 
   def printSet(self):
     print('symbol = ', self.symbol)
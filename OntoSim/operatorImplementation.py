@@ -1,17 +1,269 @@
-
 import numpy as np
+from functools import lru_cache
+import OntoSim.myerrors as myerrors                      # My error definitions
+try:                                   # Sparse backend is optional
+  import scipy.sparse as sp
+except ImportError:
+  sp = None
 ###############################################################################
 ###############################################################################
 
-def blockReduction(val1,size,val2):
-  counter = 0
-  value = []
-  for l in size:
-    valll1 = val1[counter:counter+l]
-    valll2 = val2[counter:counter+l]
-    value.append(np.einsum('ij,ij -> j',valll1 ,valll2))
-    counter += l
-  return np.array(value)
+def issparse(val):
+  """Check if the value is a scipy.sparse matrix"""
+  return sp is not None and sp.issparse(val)
+
+def dense(val):
+  """
+  Dense array of a value.  The element wise kernels, einsum and the gathers of
+  the Khatri-Rao product do not accept scipy.sparse operands.
+  """
+  if issparse(val):
+    return val.toarray()
+  return val
+
+def transpose(val):
+  """
+  Transpose of a value.  Only the last two axes are swapped, so that a leading
+  batch axis is kept in place.
+  """
+  if issparse(val) or np.ndim(val) < 2:
+    return np.transpose(val)
+  return np.swapaxes(val, -1, -2)
+
+def _layout(spec):
+  """Split einsum subscripts 'ab,cd -> e' into ('ab', 'cd', 'e')"""
+  inputs, output = spec.replace(' ', '').split('->')
+  sub1, sub2 = inputs.split(',')
+  return sub1, sub2, output
+
+@lru_cache(maxsize=None)
+def batchSpec(spec):
+  """
+  Einsum subscripts broadcasting over leading batch axes
+
+  'ri,rj -> ij' becomes '...ri,...rj->...ij'
+  """
+  sub1, sub2, output = _layout(spec)
+  return '...%s,...%s->...%s' % (sub1, sub2, output)
+
+def sparseContraction(spec,val1,val2,out=None):
+  """
+  Matrix  contraction  'ir,rj -> ij' and its transposed variants, dispatched to
+  sparse matrix multiplication.  Sparse times sparse stays sparse.
+  """
+  sub1, sub2, _ = _layout(spec)
+  if sub1[0] == 'r':
+    val1 = val1.T
+  if sub2[1] == 'r':
+    val2 = val2.T
+  value = val1 @ val2
+  if out is None:
+    return value
+  out[...] = value.toarray() if issparse(value) else value
+  return out
+
+def sparseRowReduction(spec,val1,val2,out=None):
+  """Row wise reduction 'ri,ri -> i' and variants with a sparse operand"""
+  sub1, sub2, _ = _layout(spec)
+  if sub1[0] != 'r':
+    val1 = val1.T
+  if sub2[0] != 'r':
+    val2 = val2.T
+  if issparse(val1):
+    prod = val1.multiply(val2)
+  else:
+    prod = val2.multiply(val1)
+  value = np.asarray(prod.sum(axis=0)).T                       # Column vector
+  if out is None:
+    return value
+  out[...] = value
+  return out
+
+def contraction(spec,val1,val2,out=None):
+  """Matrix contraction with einsum, or sparse matmul for sparse operands"""
+  if issparse(val1) or issparse(val2):
+    return sparseContraction(spec,val1,val2,out)
+  return np.einsum(batchSpec(spec),val1,val2,out=out)
+
+def contractionKernel(spec):
+  """
+  Matrix product kernel of contraction subscripts
+
+  The transposes of 'ir,rj -> ij' and its variants are resolved once and the
+  product is computed by matmul (BLAS),  broadcasting  over leading batch axes.
+  Sparse operands are dispatched to sparseContraction.
+  """
+  sub1, sub2, _ = _layout(spec)
+  transa = sub1[0] == 'r'
+  transb = sub2[1] == 'r'
+  def fn(val1, val2, out=None):
+    if issparse(val1) or issparse(val2):
+      return sparseContraction(spec,val1,val2,out)
+    return np.matmul(transpose(val1) if transa else val1,
+                     transpose(val2) if transb else val2, out=out)
+  return fn
+
+def vectorReductionKernel(spec, first):
+  """
+  Row wise reduction with a column vector as matrix vector product
+
+  'ri,ri -> i' of a matrix and a vector over r is the product of the transposed
+  matrix and the vector, which gives the column vector of the result directly.
+
+  Args:
+    spec:  Subscripts of the row reduction
+    first: True if the first operand is the vector
+  """
+  sub1, sub2, _ = _layout(spec)
+  trans = (sub2 if first else sub1)[0] == 'r'         # Reduced over the rows
+  def fn(val1, val2, out=None):
+    if issparse(val1) or issparse(val2):
+      return sparseRowReduction(spec,val1,val2,out)
+    mat, vec = (val2, val1) if first else (val1, val2)
+    return np.matmul(transpose(mat) if trans else mat, vec, out=out)
+  return fn
+
+def expansion(spec,val1,val2,out=None):
+  """Expand product by einsum, broadcasting over leading batch axes"""
+  return np.einsum(batchSpec(spec),dense(val1),dense(val2),out=out)
+
+@lru_cache(maxsize=4096)
+def _selection(blocking, mapping):
+  blocking = np.array(blocking, dtype=np.intp)
+  keep = np.zeros(len(blocking), dtype=bool)
+  mapping = np.array(mapping, dtype=np.intp)
+  keep[mapping[(mapping >= 0) & (mapping < len(blocking))]] = True
+  sizes = blocking[keep]
+  starts = (np.cumsum(blocking) - blocking)[keep]
+  total = int(sizes.sum())
+  if total == 0:
+    return slice(0, 0)
+  # Row k of the selection is row (k - first row of its block) of that block
+  shift = np.repeat(starts - (np.cumsum(sizes) - sizes), sizes)
+  index = shift + np.arange(total)
+  if index[-1] - index[0] == total - 1:              # Contiguous, use a view
+    return slice(int(index[0]), int(index[0]) + total)
+  index.setflags(write=False)                        # Shared through the cache
+  return index
+
+def selection(indexSet, subset):
+  """
+  Rows selected by a subset
+
+  The blocks of the index set  that are in the mapping of the subset are selected
+  in order.  Computed once for every pair of index sets, stored with the index
+  set and shared between all the select operators using them.
+
+  Args:
+    indexSet: Index set of the selected dimension, defines the blocking
+    subset:   Index set selected, its mapping refers to the blocks
+
+  Returns:
+    Slice if the selected rows are contiguous, otherwise an index array
+
+  Raises:
+    SetError: the mapping of the subset refers to blocks  that the index set
+              does not have
+  """
+  selections = indexSet.selections
+  if subset not in selections:
+    blocking, mapping = indexSet.key[4], subset.key[3]
+    if mapping and not 0 <= min(mapping) <= max(mapping) < len(blocking):
+      raise myerrors.SetError(indexSet, subset, msg = 'Mapping of %s outside '
+                              'the %i blocks of %s' %
+                              (subset, len(blocking), indexSet))
+    selections[subset] = _selection(blocking, mapping)
+  return selections[subset]
+
+def take(val,selection,axis,out=None):
+  """
+  Select rows (axis -2) or columns (axis -1), slicing sparse matrices.  Leading
+  batch axes are kept.  A slice selection returns a view.  Raises IndexError if
+  the value has fewer rows or columns than selected.
+  """
+  if isinstance(selection, slice) and not issparse(val):
+    val = np.asarray(val)
+    if selection.stop > val.shape[axis]:
+      raise IndexError('selection %s out of bounds for axis of size %i' %
+                       (selection, val.shape[axis]))
+    if axis == -2:
+      return val[..., selection, :]
+    return val[..., selection]
+  if issparse(val):
+    if axis == -2:
+      return val.tocsr()[selection]
+    return val.tocsc()[:,selection]
+  return np.take(val,selection,axis=axis,out=out)
+
+@lru_cache(maxsize=4096)
+def _blockSegments(size):
+  size = np.array(size, dtype=np.intp)
+  total = int(size.sum())
+  starts = np.zeros(len(size), dtype=np.intp)
+  np.cumsum(size[:-1], out=starts[1:])
+  full = np.flatnonzero(size > 0)
+  # reduceat sums from one start to the next,  so only the starts of the
+  # non-empty blocks are used and the empty blocks stay zero
+  return starts[full], full, len(size), total
+
+def blockSegments(size):
+  """
+  Precompute the segments of a blocking
+
+  Args:
+    size: Sizes of the row blocks
+
+  Returns:
+    Tuple with the start offsets of the non-empty blocks, the non-empty blocks,
+    the number of blocks and the total number of rows
+  """
+  return _blockSegments(tuple(int(l) for l in size))
+
+def blockReduction(val1,size,val2,out=None,segments=None):
+  """
+  Block wise  scalar product.  Every block  of rows of the  element wise product
+  is summed in a single segment reduction.  The rows are the second last axis,
+  so leading batch axes are kept.
+
+  Args:
+    val1, val2: Values with the blocked rows
+    size:       Sizes of the row blocks
+    out:        Optional buffer for the result
+    segments:   Optional precomputed output of blockSegments(size)
+  """
+  if segments is None:
+    segments = blockSegments(size)
+  starts, full, count, total = segments
+  prod = np.multiply(val1, val2)
+  if len(full) == count:                              # No empty blocks
+    return np.add.reduceat(prod, starts, axis=-2, out=out)
+  shape = np.shape(prod)[:-2] + (count,) + np.shape(prod)[-1:]
+  if out is None:
+    out = np.zeros(shape)
+  else:
+    out.fill(0.)
+  if total:
+    out[..., full, :] = np.add.reduceat(prod, starts, axis=-2)
+  return out
+
+def rowReduction(spec,val1,val2,out=None):
+  """
+  Row wise reduction  returning a column vector.  With out  the result is written
+  into the column of the given buffer.  Broadcasts over leading batch axes.
+  """
+  if issparse(val1) or issparse(val2):
+    return sparseRowReduction(spec,val1,val2,out)
+  if out is None:
+    return np.einsum(batchSpec(spec),val1,val2)[..., np.newaxis]
+  np.einsum(batchSpec(spec),val1,val2,out=out[..., 0])
+  return out
+
+def ones(val,out=None):
+  """Array of ones with the shape of the value"""
+  if out is None:
+    return np.ones(np.shape(val))
+  out.fill(1.)
+  return out
 
 ###############################################################################
 ###############################################################################
@@ -32,16 +284,71 @@ def mkblocks(mat,size):
     currow += nspecies
   return matrices
 ###############################################################################
-def kr(mata, sizea, matb, sizeb):
+def _krAxis(sizea, sizeb):
+  """Gather indices of one axis of the block Kronecker product"""
+  sizea = np.array(sizea, dtype=np.intp)
+  sizeb = np.array(sizeb, dtype=np.intp)
+  size = sizea * sizeb                          # Size of the product blocks
+  starta = np.cumsum(sizea) - sizea
+  startb = np.cumsum(sizeb) - sizeb
+  start = np.cumsum(size) - size
+  local = np.arange(size.sum()) - np.repeat(start, size)
+  blockb = np.repeat(sizeb, size)
+  return (np.repeat(starta, size) + local // blockb,
+          np.repeat(startb, size) + local % blockb)
+
+@lru_cache(maxsize=4096)
+def _krLayout(sizea, sizeb):
+  if len(sizea[0]) != len(sizeb[0]) or len(sizea[1]) != len(sizeb[1]):
+    return None                                   # Blocks do not pair up
+  rowa, rowb = _krAxis(sizea[0], sizeb[0])
+  cola, colb = _krAxis(sizea[1], sizeb[1])
+  return rowa[:, np.newaxis], cola, rowb[:, np.newaxis], colb
+
+def krLayout(sizea, sizeb):
   """
-  mata and matb are the matrices that are multiplied. The sizes of these
-  matrices are the block matrices. The blocks are defined as a list. Example:
-  F_{NS,AS} -> size(F_{NS,AS}) = (1,1,2,2) x (1,1,2)
+  Precompute the gather indices of the block Kronecker product
+
+  Element  (i*rb+k, j*cb+l)  of  the product block is  A[i,j]*B[k,l], so the
+  complete product is a  gather from  each of the matrices followed  by a single
+  element wise product.
+
+  Args:
+    sizea, sizeb: Row and column block sizes of the two matrices
+
+  Returns:
+    Row and column indices into A and B, or None if the blocks do not pair up
   """
+  key = lambda size: tuple(tuple(int(l) for l in s) for s in size)
+  return _krLayout(key(sizea), key(sizeb))
+
+def krBlocks(mata, sizea, matb, sizeb):
+  """Block by block  Kronecker product, used when the blocks do not pair up"""
   matsA, matsB = [mkblocks(mat,size) for (mat,size) in zip([mata,matb],[sizea,sizeb])]
-  matrices = np.array([np.kron(A,B) for (A, B) in zip(matsA, matsB)])
+  matrices = [np.kron(A,B) for (A, B) in zip(matsA, matsB)]
   size = (len(sizea[0]),len(sizea[1]))
   mat = np.concatenate([np.concatenate(matrices[node*size[1]:node*size[1]+size[1]], axis = 1) for node in range(size[0])],axis = 0)
   return mat
-
 ###############################################################################
+def kr(mata, sizea, matb, sizeb, out=None, layout=None):
+  """
+  mata and matb are the matrices that are multiplied. The sizes of these
+  matrices are the block matrices. The blocks are defined as a list. Example:
+  F_{NS,AS} -> size(F_{NS,AS}) = (1,1,2,2) x (1,1,2)
+  If out is given the result is written into it.  The gather indices are taken
+  from layout if given, otherwise from krLayout(sizea, sizeb).  The blocks are
+  the last two axes, leading batch axes are kept.
+  """
+  if layout is None:
+    layout = krLayout(sizea, sizeb)
+  if layout is None:
+    mat = krBlocks(dense(mata), sizea, dense(matb), sizeb)
+    if out is not None:
+      out[...] = mat
+      return out
+    return mat
+  rowa, cola, rowb, colb = layout
+  mata = np.asarray(dense(mata))
+  matb = np.asarray(dense(matb))
+  return np.multiply(mata[..., rowa, cola], matb[..., rowb, colb], out=out)
+
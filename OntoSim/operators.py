@@ -11,7 +11,8 @@
               - Subtract
               - Reduce product
               - Expand product
-              - Khatri-Rao product
+              - Khatri-Rao product::
+                - khatriRaoPlan
               - Power
               - Unitary functions::
                 - sqrt
@@ -24,12 +25,19 @@
 
 .. notes::    (2017-03-03) second version of operator file
               (2017-03-06) implemented unitary functions
+              (2017-09-14) values may carry leading batch axes, e.g. one for
+              each scenario.  Transposes swap the last two axes only and the
+              einsum subscripts broadcast over the leading axes.
+              (2017-09-30) reduce products resolve their kernel on construction.
+              (2017-10-02) the Khatri-Rao product is planned once per pair of
+              index sets, see khatriRaoPlan.
 """
 
 import numpy as np                                     # NUMPY numerical python
+from functools import lru_cache
 from OntoSim.objects import *   # Import variable, tempvariable and collections
 from OntoSim.operatorImplementation import *   # Self made additional operators
-import OntoSim.myerrors                                  # My error definitions
+import OntoSim.myerrors as myerrors                      # My error definitions
 
 # --------------------------------------------------------------------------- #
 # BINARY OPERATORS                                                            #
@@ -48,11 +56,14 @@ def add(var1, var2):
     Executable object  containing  expression   and index adding  the variables
   """
   instances = var1.instances+var2.instances
-  if var1.index[0] == var2.index[0]:
-    ex = lambda: np.add(var1.get(), var2.get())
+  flip = var1.index[0] != var2.index[0]
+  if not flip:
+    fn = lambda a, b, out=None: np.add(dense(a), dense(b), out=out)
   else:
-    ex = lambda: np.add(var1.get(), np.transpose(var2.get()))
-  return Executable(ex, var1.index, instances)
+    fn = lambda a, b, out=None: np.add(dense(a), dense(transpose(b)), out=out)
+  ex = lambda: fn(var1.get(), var2.get())
+  return Executable(ex, var1.index, instances, op = 'add', args = (var1, var2),
+                    params = (flip,), fn = fn, inplace = True)
 # --------------------------------------------------------------------------- #
 
 # --------------------------------------------------------------------------- #
@@ -68,11 +79,15 @@ def subtract(var1, var2):
     Executable object  containing expression  and index subtract  the variables
   """
   instances = var1.instances+var2.instances
-  if var1.index[0] == var2.index[0]:                              # check shape
-    ex = lambda: np.subtract(var1.get(), var2.get())
+  flip = var1.index[0] != var2.index[0]                           # check shape
+  if not flip:
+    fn = lambda a, b, out=None: np.subtract(dense(a), dense(b), out=out)
   else:
-    ex = lambda: np.subtract(var1.get(), np.transpose(var2.get()))
-  return Executable(ex, var1.index, instances)
+    fn = lambda a, b, out=None: np.subtract(dense(a), dense(transpose(b)), out=out)
+  ex = lambda: fn(var1.get(), var2.get())
+  return Executable(ex, var1.index, instances, op = 'subtract',
+                    args = (var1, var2), params = (flip,), fn = fn,
+                    inplace = True)
 # --------------------------------------------------------------------------- #
 
 # --------------------------------------------------------------------------- #
@@ -86,6 +101,9 @@ def reduceproduct(var1, redSet, var2):
   indexing, with the reduction dimension explicitly shown in contrast  to being
   implied in standard paper linear algebra notation.
   red3 provides a block by block operation -- a blockwise scalar product.
+  Sparse operands (e.g. incidence matrices) are contracted with sparse matrix
+  multiplication.  The kernel is chosen once:  contractions and reductions with
+  a vector are matrix products, reductions of two matrices use einsum.
 
   Args:
     var1:   First variable
@@ -99,44 +117,59 @@ def reduceproduct(var1, redSet, var2):
 
   index1 = var1.index
   index2 = var2.index
-  trsp = np.transpose                       # Make functions fit within 79 chrs
-  es = np.einsum                            # Make functions fit within 79 chrs
 
   if redSet not in index1 or redSet not in index2:
-    ex = lambda: blockReduction(var1.get(), index1[0].blocking, var2.get())
+    blocking = index1[0].blocking
+    segments = blockSegments(blocking)             # Precomputed block offsets
+    fn = lambda a, b, out=None: blockReduction(a, blocking, b, out=out,
+                                               segments=segments)
+    ex = lambda: fn(var1.get(), var2.get())
     index = [index1[0].sets[0]]
-    return Executable(ex, index, instances)
+    return Executable(ex, index, instances, op = 'blockreduction',
+                      args = (var1, var2), params = (tuple(blocking),), fn = fn,
+                      inplace = True)
 
   elif set(index1) == set(index2) or len(index1) == 1 or len(index2) == 1:
     """Check if index sets are same set or the same,  or completely reduced."""
+    op = 'rowreduction'
     if index1[0] == redSet:
       if index2[0] == redSet:
-        ex = lambda: trsp(es('ri,ri -> i', var1.get(), var2.get())[np.newaxis])
+        spec = 'ri,ri -> i'
       else:
-        ex = lambda: trsp(es('ri,ir -> i', var1.get(), var2.get())[np.newaxis])
+        spec = 'ri,ir -> i'
     else:
       if index2[0] == redSet:
-        ex = lambda: trsp(es('ir,ri -> i', var1.get(), var2.get())[np.newaxis])
+        spec = 'ir,ri -> i'
       else:
-        ex = lambda: trsp(es('ir,ir -> i', var1.get(), var2.get())[np.newaxis])
+        spec = 'ir,ir -> i'
+    if len(index2) == 1:                  # Matrix (or vector) times vector
+      fn = vectorReductionKernel(spec, False)
+    elif len(index1) == 1:
+      fn = vectorReductionKernel(spec, True)
+    else:
+      fn = lambda a, b, out=None: rowReduction(spec, a, b, out=out)
 
   else:
     """Two matrices with different sets"""
+    op = 'contraction'
     if index1[0] == redSet:
       if index2[0] == redSet:
-        ex = lambda: np.einsum('ri,rj -> ij',var1.get(),var2.get())
+        spec = 'ri,rj -> ij'
       else:
-        ex = lambda: np.einsum('ri,jr -> ij',var1.get(),var2.get())
+        spec = 'ri,jr -> ij'
     else:
       if index2[0] == redSet:
-        ex = lambda: np.einsum('ir,rj -> ij',var1.get(),var2.get())
+        spec = 'ir,rj -> ij'
       else:
-        ex = lambda: np.einsum('ir,jr -> ij',var1.get(),var2.get())
+        spec = 'ir,jr -> ij'
+    fn = contractionKernel(spec)
 
+  ex = lambda: fn(var1.get(), var2.get())
   setindex = filter(lambda ind: ind != redSet, var1.index+var2.index)
   index = []
   [index.append(ind) for ind in setindex if ind not in index]
-  return Executable(ex, index, instances)
+  return Executable(ex, index, instances, op = op, args = (var1, var2),
+                    params = (spec,), fn = fn, inplace = True)
 
 # --------------------------------------------------------------------------- #
 
@@ -161,7 +194,8 @@ def expandproduct(var1, var2):
   instances = var1.instances+var2.instances
   # PATTERN 1 or 2
   if var1.index == var2.index or var1.index == [] or var2.index == []:
-    ex = lambda: np.multiply(var1.get(),var2.get())
+    op, params = 'multiply', (False,)
+    fn = lambda a, b, out=None: np.multiply(dense(a), dense(b), out=out)
     if var1.index == []:                              # Which index do I select
       index = var2.index
     else:
@@ -169,30 +203,152 @@ def expandproduct(var1, var2):
 
   elif var1.index == reversed(var2.index):                     # Transpose last
     index = var1.index                                     # No change in index
-    ex = lambda: np.multiply(var1.get(),np.transpose(var2.get()))
+    op, params = 'multiply', (True,)
+    fn = lambda a, b, out=None: np.multiply(dense(a), dense(transpose(b)), out=out)
 
   # PATTERN 3 and 4
   else:
     """If pattern 3 or 4"""
     if var1.index[0] == var2.index[0]:
       """Share first dimension"""
-      ex = lambda: np.array(var1.get())*np.array(var2.get())
+      op, params = 'multiply', (False,)
+      fn = lambda a, b, out=None: np.multiply(dense(a), dense(b), out=out)
       if len(var1.index) == 1:
         index = var2.index
       else:
         index = var1.index
     else:
+      op = 'expansion'
       if len(var1.index) > 1:
         index = var1.index
-        ex = lambda: np.einsum('ij,jk -> ij',var1.get(),var2.get())
+        spec = 'ij,jk -> ij'
       else:
         index = var2.index
-        ex = lambda: np.einsum('ij,hi -> hi',var1.get(),var2.get())
+        spec = 'ij,hi -> hi'
+      params = (spec,)
+      fn = lambda a, b, out=None: expansion(spec, a, b, out=out)
 
-  return Executable(ex, index, instances)
+  ex = lambda: fn(var1.get(), var2.get())
+  return Executable(ex, index, instances, op = op, args = (var1, var2),
+                    params = params, fn = fn, inplace = True)
 # --------------------------------------------------------------------------- #
 
 # --------------------------------------------------------------------------- #
+def planKey(indexSet):
+  """Plain key of an index set and the sets it combines, see khatriRaoPlan"""
+  return indexSet.key, tuple(ind.key for ind in indexSet.sets)
+
+@lru_cache(maxsize=4096)
+def _khatriRaoPlan(keys1, keys2):
+  """
+  Khatri-Rao plan on the plain keys of the index sets, see khatriRaoPlan
+
+  The keys do not refer to the index sets, so the cache keeps no model alive.
+  The result index is given as (operand, position) of the index sets.
+  """
+  within = lambda inner, outer: inner[0] in outer[1]   # inner in outer.sets
+  blocking = lambda keys: list(keys[0][4])
+  flip = False                           # Flag for transposing second variable
+  index = [(1, 0), (1, 1)][:len(keys2)]       # Index of the second variable
+
+  if len(keys1) == 2 and len(keys2) == 2:                     # Pattern 1 and 2
+    for i in [0, 1]:
+      for j in [0, 1]:
+        if within(keys1[i], keys2[j]):
+          if i != j:
+            flip = True                            # Flipping the last variable
+        elif within(keys2[j], keys1[i]):
+          index[j] = (0, i)
+          if i != j:
+            flip = True
+    sizea = [blocking(keys) for keys in keys1]
+    sizeb = [blocking(keys) for keys in keys2]  # Rows and columns of var2
+    if flip:
+      index = index[::-1]                            # Order of var1
+
+  elif len(keys1) == 1 and len(keys2) == 2:                   # Pattern 3, 4
+    # The vector is paired with the matched axis of the matrix,  the other axis
+    # is a single block
+    if within(keys1[0], keys2[0]):
+      pass
+    elif within(keys2[0], keys1[0]):
+      index[0] = (0, 0)
+    elif within(keys1[0], keys2[1]):
+      flip = True
+    elif within(keys2[1], keys1[0]):
+      index[1] = (0, 0)
+      flip = True
+    sizea = [blocking(keys1[0]), [1]]
+    sizeb = [blocking(keys) for keys in keys2]
+    if flip:                                # Matrix transposed, the rows match
+      sizeb[0] = [sum(sizeb[0])]
+      index = index[::-1]
+    else:
+      sizeb[1] = [sum(sizeb[1])]
+
+  elif len(keys1) == 2 and len(keys2) == 1:
+    index = [(0, 0), (0, 1)]
+    if within(keys2[0], keys1[0]):
+      pass
+    elif within(keys1[0], keys2[0]):
+      index[0] = (1, 0)
+    elif within(keys2[0], keys1[1]):
+      flip = True
+    elif within(keys1[1], keys2[0]):
+      index[1] = (1, 0)
+      flip = True
+    sizea = [blocking(keys) for keys in keys1]
+    sizeb = [blocking(keys2[0]), [1]]
+    if flip:                                 # Vector transposed to a row
+      sizea[0] = [sum(sizea[0])]
+    else:
+      sizea[1] = [sum(sizea[1])]
+
+  elif len(keys1) == 1 and len(keys2) == 1:                   # Pattern 5 and 6
+    if not within(keys1[0], keys2[0]):
+      index = [(0, 0)]
+    sizea = [blocking(keys1[0]), [1]]
+    sizeb = [blocking(keys2[0]), [1]]
+  else:
+    raise myerrors.SetError(keys1[0][0][0], msg = 'No Khatri-Rao pattern '
+                            'for the index sets %s and %s' %
+                            ([keys[0][0] for keys in keys1],
+                             [keys[0][0] for keys in keys2]))
+  sizea = tuple(map(tuple, sizea))
+  sizeb = tuple(map(tuple, sizeb))
+  if flip:
+    layout = krLayout(sizea, sizeb[::-1])            # Precomputed gather indices
+    fn = lambda a, b, out=None: kr(a, sizea, transpose(b), sizeb[::-1],
+                                   out=out, layout=layout)
+  else:
+    layout = krLayout(sizea, sizeb)                  # Precomputed gather indices
+    fn = lambda a, b, out=None: kr(a, sizea, b, sizeb, out=out, layout=layout)
+  return tuple(index), (sizea, sizeb, flip), fn
+
+def khatriRaoPlan(index1, index2):
+  """
+  Index logic of the Khatri-Rao product,  planned once per pattern
+
+  The same pattern appears in the equations of every node of a flowsheet,  so
+  the result index,  the block sizes and the gather layout are memoised on the
+  keys of the index sets of the operands.  The second operand is transposed
+  (flip) when its index sets match those of the first in reverse order.  A
+  vector is paired with the matching axis of the matrix and the other axis is
+  taken as a single block.
+
+  Args:
+    index1: Tuple with the index sets of the first variable
+    index2: Tuple with the index sets of the second variable
+
+  Returns:
+    Tuple with the result index (the index sets of the operands),  the
+    parameters (sizea, sizeb, flip) and the kernel
+  """
+  positions, params, fn = _khatriRaoPlan(tuple(map(planKey, index1)),
+                                         tuple(map(planKey, index2)))
+  operands = (index1, index2)
+  return [operands[k][i] for k, i in positions], params, fn
+
 def khatriRaoProduct(var1, var2):
   """
   Khatri-Rao product, the block-by-block Kronecker product
@@ -219,88 +375,12 @@ def khatriRaoProduct(var1, var2):
     Executable  object containing expres. and  index.  Block  Kronecker  multi.
   """
 
-  flip = False                           # Flag for transposing second variable
-  index = var2.index        # Index usually set to the last set for some reason
-  # TODO make sure the product is correct! Appears to be wrong!
-
   instances = var1.instances+var2.instances
-  # DETERMINE THE SIZES OF THE BLOCKING>>>
-  sizea = [settet.blocking for settet in var1.index]
-  sizeb = [settet.blocking for settet in var2.index]
-
-  if len(var1.index) == 2 and len(var2.index) == 2:           # Pattern 1 and 2
-    for i in [0, 1]:
-      for j in [0, 1]:
-        if var1.index[i] in var2.index[j].sets:
-          # index[i] = var2.index[j] OBSOLETE
-          if i != j:
-            flip = True                            # Flipping the last variable
-        elif var2.index[j] in var1.index[i].sets:
-          index[i] = var1.index[j]
-          if i != j:
-            flip = True
-
-          # continue
-  elif len(var1.index) == 1 and len(var2.index) == 2: # Pattern 3, 4
-    print('TEST THIS')
-    # index = var2.index
-    # for j in [0, 1]:
-    if var1.index[0] in var2.index[0].sets:
-      # index = var2.index
-      pass
-    elif  var2.index[0] in var1.index[0].sets:
-      index[0] = var1.index[0]
-    elif var1.index[0] in var2.index[1].sets:
-      flip = True
-      # index[1] = var2.index
-    elif  var2.index[1] in var1.index[0].sets:
-      index[1] = var1.index[0]
-      flip = True
-
-  elif len(var1.index) == 2 and len(var2.index) == 1:
-    index = var1.index
-    if var2.index[0] in var1.index[0].sets:
-      # index = var1.index
-      pass
-    elif  var1.index[0] in var2.index[0].sets:
-      index[0] = var2.index[0]
-    elif var2.index[0] in var1.index[1].sets:
-      flip = True
-      # index[1] = var1.index
-    elif  var1.index[1] in var2.index[0].sets:
-      index[1] = var2.index[0]
-      flip = True
-
-  elif len(var1.index) == 1 and len(var2.index) == 1: # Pattern 5 and 6
-    # index = var2.index
-    if var1.index[0] in var2.index[0].sets:
-      index = var2.index
-    else:
-      index = var1.index
-  else:
-    print('NOT CAPTURED ANY ALTERNATIVES')
-  # print([ind.symbol for ind in index])
-  # Making matrix out of single vectors:
-  # TODO FIX USE TUPLES
-  if len(sizea) == 1 and len(sizeb) == 1:
-    sizea.append([1])
-    sizeb.append([1])
-  elif len(sizea) == 1 and len(sizeb) != 1:
-    sizea.append([1])
-    print('HERE')
-    # THIS DOES NOT WORK for the current case
-    sizeb[1] = list([sum(sizeb[1])])
-  elif len(sizeb) == 1 and len(sizea) != 1:
-    sizeb.append((1,))
-    sizea[1] = list([sum(sizea[1])])
-  if flip:
-    print('WE ARE FLIPPIN!')
-    index = reversed(index)
-    ex = lambda: kr(var1.get(),sizea, np.transpose(var2.get()), sizeb[::-1])
-  else:
-    ex = lambda: kr(var1.get(),sizea, var2.get(), sizeb)
-
-  return Executable(ex, index, instances)
+  index, params, fn = khatriRaoPlan(tuple(var1.index), tuple(var2.index))
+  ex = lambda: fn(var1.get(), var2.get())
+  return Executable(ex, index, instances, op = 'khatrirao',
+                    args = (var1, var2), params = params, fn = fn,
+                    inplace = True)
 
 # --------------------------------------------------------------------------- #
 # --------------------------------------------------------------------------- #
@@ -321,9 +401,11 @@ def sett(var):
     Executable object containing expression and index to make the set variable.
   """
   instances = [inst for inst in var.instances]
-  ex = lambda: np.ones(np.shape(var.get()))
+  fn = lambda a, out=None: ones(a, out=out)
+  ex = lambda: fn(var.get())
   index = var.index
-  return Executable(ex, index, instances)
+  return Executable(ex, index, instances, op = 'ones', args = (var,), fn = fn,
+                    inplace = True)
 
 # --------------------------------------------------------------------------- #
 
@@ -332,7 +414,9 @@ def select(var, superset, subset):
   Select a certain sub set of the superset.
 
   Selects the rows and columns of the variable  according to the the mapping of
-  the subset with respect to the superset.
+  the subset with respect to the superset.  The selection is a cached index
+  array, or a slice when the selected rows are contiguous.  In that case the
+  result is a view of the variable and no data is copied.
 
   Args:
     var:      The variable
@@ -349,39 +433,34 @@ def select(var, superset, subset):
     index = [ind for ind in var.index]
     for i,ind in enumerate(var.index):
       if superset in ind.sets:
-        sets = list(map(lambda x:x if x!= superset else subset, ind.sets))
+        sets = tuple(map(lambda x:x if x!= superset else subset, ind.sets))
         index[i] = list(filter(lambda x: x.sets == sets, ind.indexingSets))[0]
 
   # If subset is empty
-  if subset.mapping == []:
-    ex = lambda: []                                 # No occurrence of this set
+  if len(subset.mapping) == 0:
+    axis, selectionSet = None, ()
+    fn = lambda a: []                               # No occurrence of this set
 
   # If first index is the superset
   elif var.index[0].superset == superset:
-    selectionSet = []
-    counter = 0
-    for i,curlen in enumerate(var.index[0].blocking):
-      if i in subset.mapping:
-        selectionSet += range(counter,counter+curlen)
-      counter += curlen
-    ex = lambda: np.array(var.get())[selectionSet]
+    axis = 0
+    selectionSet = selection(var.index[0], subset)
+    fn = lambda a, out=None: take(a, selectionSet, -2, out=out)
 
   # If matrix and second dimension is selected mapping
   elif var.index[1].superset == superset:
-    selectionSet = []
-    counter = 0
-    for i,curlen in enumerate(var.index[1].blocking):
-      if i in subset.mapping:
-        selectionSet += range(counter,counter+curlen)
-      counter += curlen
-    ex = lambda: np.array(var.get())[:,np.array(selectionSet)]
+    axis = 1
+    selectionSet = selection(var.index[1], subset)
+    fn = lambda a, out=None: take(a, selectionSet, -1, out=out)
 
   else:                                              # No alternatives captured
     raise myerrors.SetError(superset, subset)
-    ex = lambda: 0
 
+  ex = lambda: fn(var.get())
   instances = [inst for inst in var.instances]
-  return Executable(ex, index, instances)
+  inplace = axis is not None and not isinstance(selectionSet, slice)
+  return Executable(ex, index, instances, op = 'select', args = (var,),
+                    params = (axis, selectionSet), fn = fn, inplace = inplace)
 
 
 # --------------------------------------------------------------------------- #
@@ -401,9 +480,11 @@ def abs(var):
   Returns:
     Executable object with expression and index sets
   """
-  ex = lambda: np.fabs(var.get())
+  fn = lambda a, out=None: np.fabs(dense(a), out=out)
+  ex = lambda: fn(var.get())
   instances = [inst for inst in var.instances]
-  return Executable(ex, var.index, instances)
+  return Executable(ex, var.index, instances, op = 'abs', args = (var,),
+                    fn = fn, inplace = True)
 
 
 # --------------------------------------------------------------------------- #
@@ -420,9 +501,11 @@ def exp(var):
   Returns:
     Executable object with expression and index sets
   """
-  ex = lambda: np.exp(var.get())
+  fn = lambda a, out=None: np.exp(dense(a), out=out)
+  ex = lambda: fn(var.get())
   instances = [inst for inst in var.instances]
-  return Executable(ex, var.index, instances)
+  return Executable(ex, var.index, instances, op = 'exp', args = (var,),
+                    fn = fn, inplace = True)
 
 # --------------------------------------------------------------------------- #
 
@@ -438,9 +521,11 @@ def inv(var):
   Returns:
     Executable object with expression and index sets
   """
-  ex = lambda: 1. / np.array(var.get())
+  fn = lambda a, out=None: np.divide(1., dense(a), out=out)
+  ex = lambda: fn(var.get())
   instances = [inst for inst in var.instances]
-  return Executable(ex, var.index, instances)
+  return Executable(ex, var.index, instances, op = 'inv', args = (var,),
+                    fn = fn, inplace = True)
 
   # print('inv index = ',var.index) return Executable(ex, var.index)
 
@@ -458,9 +543,11 @@ def sign(var):
   Returns:
     Executable object with expression and index sets
   """
-  ex = lambda: np.sign(var.get())
+  fn = lambda a, out=None: np.sign(dense(a), out=out)
+  ex = lambda: fn(var.get())
   instances = [inst for inst in var.instances]
-  return Executable(ex, var.index, instances)
+  return Executable(ex, var.index, instances, op = 'sign', args = (var,),
+                    fn = fn, inplace = True)
 
 
 # --------------------------------------------------------------------------- #
@@ -477,9 +564,11 @@ def cos(var):
   Returns:
     Executable object with expression and index sets
   """
-  ex = lambda: np.cos(var.get())
+  fn = lambda a, out=None: np.cos(dense(a), out=out)
+  ex = lambda: fn(var.get())
   instances = [inst for inst in var.instances]
-  return Executable(ex, var.index, instances)
+  return Executable(ex, var.index, instances, op = 'cos', args = (var,),
+                    fn = fn, inplace = True)
 
 
 # --------------------------------------------------------------------------- #
@@ -496,9 +585,11 @@ def sin(var):
   Returns:
     Executable object with expression and index sets
   """
-  ex = lambda: np.sin(var.get())
+  fn = lambda a, out=None: np.sin(dense(a), out=out)
+  ex = lambda: fn(var.get())
   instances = [inst for inst in var.instances]
-  return Executable(ex, var.index, instances)
+  return Executable(ex, var.index, instances, op = 'sin', args = (var,),
+                    fn = fn, inplace = True)
 
 
 # --------------------------------------------------------------------------- #
@@ -515,9 +606,11 @@ def sqrt(var):
   Returns:
     Executable object with expression and index sets
   """
-  ex = lambda: np.sqrt(var.get())
+  fn = lambda a, out=None: np.sqrt(dense(a), out=out)
+  ex = lambda: fn(var.get())
   instances = [inst for inst in var.instances]
-  return Executable(ex, var.index, instances)
+  return Executable(ex, var.index, instances, op = 'sqrt', args = (var,),
+                    fn = fn, inplace = True)
 
 
 # --------------------------------------------------------------------------- #
@@ -534,9 +627,11 @@ def ln(var):
   Returns:
     Executable object with expression and index sets
   """
-  ex = lambda: np.log(var.get())
+  fn = lambda a, out=None: np.log(dense(a), out=out)
+  ex = lambda: fn(var.get())
   instances = [inst for inst in var.instances]
-  return Executable(ex, var.index, instances)
+  return Executable(ex, var.index, instances, op = 'ln', args = (var,),
+                    fn = fn, inplace = True)
 
 
 # --------------------------------------------------------------------------- #
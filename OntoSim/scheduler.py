@@ -0,0 +1,321 @@
+"""
+..  module:: Scheduler
+    :platform: Unix, Windows
+    :synopsis: Dependency ordered evaluation of all the variables.
+
+.. moduleauthor:: Arne Tobias Elve <arne.t.elve@ntnu.no>
+
+.. date:: 2017-09-08
+
+.. contents:: - Scheduler: evaluate the variables with equations in order
+              - LevelExecutor: evaluate independent equations in threads
+
+.. notes::    (2017-09-08) The  sequence  lists of the Variables collection are
+              in order of  appearance.  The scheduler  builds the dependency
+              graph  of the variables  from the compiled equations,  sorts it
+              topologically once and evaluates the whole model in one call.
+              (2017-09-11) incremental update of the equations with changed
+              inputs only.
+              (2017-09-12) equations  are grouped in levels  of independent
+              equations that can be evaluated in parallel threads.
+              (2017-09-25) algebraic loops are solved by Newton iteration.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from OntoSim.objects import Model
+from OntoSim.compiler import compileVariable
+from OntoSim.structure import components
+from OntoSim.solver import BlockSolver
+import OntoSim.myerrors as myerrors                      # My error definitions
+
+
+class Scheduler(object):
+  """
+  Evaluation scheduler for a collection of variables
+
+  By default the  variables of the active model are scheduled.  Every variable
+  with at least one equation is compiled  using its selector.  A
+  variable depends on the variables with equations that appear in its selected
+  equation.  Variables without equations (constants, states, ...) are inputs.
+  After changing  a selector  the scheduler has  to be rebuilt.
+
+  Variables that depend on each other form an algebraic loop.  The loop is
+  evaluated as one by a BlockSolver,  which is called for the first variable of
+  the loop in the evaluation order (the head).  The other variables of the loop
+  follow the head and have the same inputs.  With ``loops = False`` a loop
+  raises a CycleError instead.
+
+  The scheduler records the versions of the inputs  of every equation when it
+  is evaluated.  update() only re-evaluates the equations for which one of the
+  inputs has been assigned since,  which propagates  through the model  in the
+  evaluation order.
+  """
+  def __init__(self, variables = None, buffered = False, loops = True,
+               jacobian = None):
+    if variables is None:
+      variables = Model.active().variables
+    self.variables = list(variables)
+    self.buffered = buffered                  # Plans evaluate into buffers
+    self.loops = loops                           # Solve the algebraic loops
+    self.jacobian = jacobian                 # Jacobian of the loop residuals
+    self.build()
+
+  def build(self):
+    """Compile the equations and sort them topologically"""
+    self.plans = {}                                         # Variable -> Plan
+    self.dependencies = {}          # Variable -> variables it is computed from
+    equations = [var for var in self.variables if var.equations]
+    for var in equations:
+      self.plans[var] = compileVariable(var, buffered = self.buffered)
+    for var in equations:
+      deps = []
+      for slot, leaf in self.plans[var].loads:
+        if leaf in self.plans and leaf not in deps:
+          deps.append(leaf)
+      self.dependencies[var] = deps
+    blocks = self.sort(equations)
+    self.order = [var for block in blocks for var in block]
+    self.solvers = {}                               # Head of loop -> solver
+    self.head = {}                          # Variable in loop -> head of loop
+    self.inputs = {}             # Variable -> all variables it is computed from
+    for block in blocks:
+      inputs = set()
+      for var in block:
+        inputs.update(leaf for slot, leaf in self.plans[var].loads)
+        for dep in self.dependencies[var]:
+          if dep not in block:
+            inputs.update(self.inputs[dep])
+      for var in block:
+        self.inputs[var] = inputs
+      if len(block) > 1 or block[0] in self.dependencies[block[0]]:
+        self.solvers[block[0]] = BlockSolver(block, self.plans, self.jacobian)
+        for var in block:
+          self.head[var] = block[0]
+    self.seen = {}                # Variable -> versions of inputs when updated
+    self.levels = self.level()
+
+  def sort(self, equations):
+    """
+    Topological sort (Kahn) in order of registration
+
+    The variables of an algebraic loop are sorted as one block.
+
+    Args:
+      equations: Variables with equations
+
+    Returns:
+      List of blocks of variables in a valid evaluation order
+    """
+    position = dict((var, i) for i, var in enumerate(equations))
+    blocks = [sorted(block, key = position.get) for block in
+              components(equations, lambda var: self.dependencies[var])]
+    blocks.sort(key = lambda block: position[block[0]])
+    loops = [block for block in blocks if len(block) > 1
+             or block[0] in self.dependencies[block[0]]]
+    if loops and not self.loops:
+      raise myerrors.CycleError([var.symbol for block in loops
+                                 for var in block])
+    blockOf = dict((var, i) for i, block in enumerate(blocks) for var in block)
+    dependents = dict((i, []) for i in range(len(blocks)))
+    missing = {}                                  # Number of unsorted inputs
+    for var in equations:
+      for dep in self.dependencies[var]:
+        if blockOf[dep] != blockOf[var]:
+          dependents[blockOf[dep]].append(blockOf[var])
+    for i in range(len(blocks)):
+      missing[i] = 0
+    for i in dependents:
+      for dependent in dependents[i]:
+        missing[dependent] += 1
+    ready = [i for i in range(len(blocks)) if missing[i] == 0]
+    order = []
+    while ready:
+      i = ready.pop(0)
+      order.append(blocks[i])
+      for dependent in dependents[i]:
+        missing[dependent] -= 1
+        if missing[dependent] == 0:
+          ready.append(dependent)
+    return order
+
+  def level(self):
+    """
+    Group the equations in levels
+
+    The level of an equation is one more than the highest level of the equations
+    it depends on.  Equations in the same level are independent of each other.
+
+    Returns:
+      List of levels, each a list of variables in evaluation order
+    """
+    levels = []
+    depth = {}
+    for var in self.order:
+      head = self.head.get(var, var)
+      if head is not var:                          # Evaluated with the head
+        depth[var] = depth[head]
+        continue
+      block = self.solvers[var].block if var in self.solvers else [var]
+      depth[var] = 1 + max([depth[dep] for member in block
+                            for dep in self.dependencies[member]
+                            if dep not in block] or [-1])
+      if depth[var] == len(levels):
+        levels.append([])
+      levels[depth[var]].append(var)
+    return levels
+
+  def upstream(self, subset):
+    """
+    All the variables with equations that the subset depends on
+
+    Args:
+      subset: Variables
+
+    Returns:
+      Set of the variables in the subset and their transitive dependencies
+    """
+    required = set()
+    stack = [var for var in subset if var in self.plans]
+    while stack:
+      var = stack.pop()
+      if var in required:
+        continue
+      required.add(var)
+      stack.extend(self.dependencies[var])
+    return required
+
+  def versions(self, var):
+    """Versions of the direct inputs of the equation of the variable"""
+    if var in self.head:                     # Inputs from outside of the loop
+      block = self.solvers[self.head[var]].block
+      return tuple(leaf.version for member in block
+                   for slot, leaf in self.plans[member].loads
+                   if leaf not in block)
+    return tuple(leaf.version for slot, leaf in self.plans[var].loads)
+
+  def updateVariable(self, var):
+    """Evaluate the equation of a variable and record the input versions"""
+    if var in self.head:
+      solver = self.solvers[self.head[var]]
+      solver()
+      versions = self.versions(var)
+      for member in solver.block:
+        self.seen[member] = versions
+      return
+    var.value = self.plans[var].execute()[0]
+    self.seen[var] = self.versions(var)
+
+  def affected(self, changed):
+    """
+    Variables with equations that are affected by a change
+
+    Args:
+      changed: Variables that have been changed
+
+    Returns:
+      List of the affected variables in evaluation order
+    """
+    changed = set(changed)
+    return [var for var in self.order
+            if var in changed or not changed.isdisjoint(self.inputs[var])]
+
+  def update(self):
+    """
+    Re-evaluate only the equations with changed inputs
+
+    Returns:
+      Number of equations evaluated
+    """
+    count = 0
+    for var in self.order:
+      if self.seen.get(var) != self.versions(var):
+        self.updateVariable(var)
+        count += 1
+    return count
+
+  def evaluateAll(self):
+    """Update the value of every variable with an equation in order"""
+    for var in self.order:
+      if self.head.get(var, var) is var:
+        self.updateVariable(var)
+
+  def evaluate(self, subset):
+    """
+    Update the values of the subset and of everything it depends on
+
+    Args:
+      subset: Variables to update
+    """
+    required = self.upstream(subset)
+    for var in self.order:
+      if var in required and self.head.get(var, var) is var:
+        self.updateVariable(var)
+
+  def release(self):
+    """Drop the result buffers of the plans, e.g. when the shapes change"""
+    for plan in self.plans.values():
+      plan.release()
+
+  def __len__(self):
+    return len(self.order)
+
+
+class LevelExecutor(object):
+  """
+  Evaluate the levels of a scheduler in a thread pool
+
+  The equations of a level are independent, so they are dispatched to a pool of
+  threads and the level is completed before the next one starts.  NumPy releases
+  the GIL in the large ufunc and einsum calls, so large models evaluate on many
+  cores.  With a single worker, or for levels with a single equation,  the
+  equations are evaluated serially in the same order as by the scheduler.  The
+  result does not depend on the number of workers.
+  """
+  def __init__(self, scheduler, workers = None):
+    self.scheduler = scheduler
+    self.workers = workers                   # None: ThreadPoolExecutor default
+    self.pool = None
+    if workers is None or workers > 1:
+      self.pool = ThreadPoolExecutor(workers)
+
+  def run(self, variables):
+    """Evaluate a list of independent variables"""
+    update = self.scheduler.updateVariable
+    if self.pool is None or len(variables) < 2:
+      for var in variables:
+        update(var)
+    else:
+      list(self.pool.map(update, variables))     # Propagates the exceptions
+
+  def evaluateAll(self):
+    """Update the value of every variable with an equation, level by level"""
+    for level in self.scheduler.levels:
+      self.run(level)
+
+  def update(self):
+    """
+    Re-evaluate only the equations with changed inputs, level by level
+
+    Returns:
+      Number of equations evaluated
+    """
+    count = 0
+    seen = self.scheduler.seen
+    versions = self.scheduler.versions
+    for level in self.scheduler.levels:
+      dirty = [var for var in level if seen.get(var) != versions(var)]
+      self.run(dirty)
+      count += len(dirty)
+    return count
+
+  def close(self):
+    """Shut down the thread pool"""
+    if self.pool is not None:
+      self.pool.shutdown()
+      self.pool = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
@@ -0,0 +1,155 @@
+"""
+..  module:: Simulation
+    :platform: Unix, Windows
+    :synopsis: Time integration of the differential states of a model.
+
+.. moduleauthor:: Arne Tobias Elve <arne.t.elve@ntnu.no>
+
+.. date:: 2017-09-27
+
+.. contents:: - Simulation: stiff integration of the diffstate variables
+
+.. notes::    (2017-09-27) The differential states are stacked in one vector
+              and the value of every state variable is a view into it,  so
+              the right hand side only copies the vector once per call.  The
+              rates are evaluated with the equations of the scheduler  that
+              they depend on, in evaluation order.  Only the equations
+              depending on the states or the time are evaluated in every
+              call, the others once per run.  The Jacobian comes from
+              the forward derivatives,  otherwise the integrator uses finite
+              differences with the sparsity given by the dependencies.
+"""
+
+import numpy as np                                     # NUMPY numerical python
+from OntoSim.scheduler import Scheduler
+from OntoSim.derivatives import Jacobian
+import OntoSim.myerrors as myerrors                      # My error definitions
+
+try:
+  from scipy.integrate import solve_ivp
+  import scipy.sparse as sp
+except ImportError:                       # Integration requires scipy
+  solve_ivp = None
+
+
+class Simulation(object):
+  """
+  Integration of the differential states
+
+  The rates map every differential state to the variable holding its time
+  derivative.  The states must have a value when the simulation is created.
+
+    simulation = Simulation({n: dndt, T: dTdt}, scheduler)
+    result = simulation.run((0., 100.))
+
+  Args:
+    rates:     Dictionary (or pairs) state variable -> rate variable
+    scheduler: Scheduler of the model,  defaults to one for the active model
+    method:    Integration method of solve_ivp, 'BDF' or 'Radau' for stiff
+               models
+    jacobian:  True for the forward derivatives,  False for finite differences
+               with the sparsity of the dependencies
+    time:      Optional variable given the time of every evaluation
+  """
+  def __init__(self, rates, scheduler = None, method = 'BDF', jacobian = True,
+               time = None):
+    if scheduler is None:
+      scheduler = Scheduler()
+    self.scheduler = scheduler
+    rates = dict(rates)
+    self.states = list(rates.keys())
+    self.rates = [rates[var] for var in self.states]
+    self.method = method
+    self.time = time
+    self.slices = []                        # Part of the vector of each state
+    start = 0
+    for var in self.states:
+      size = np.size(var.value)
+      self.slices.append(slice(start, start + size))
+      start += size
+    self.y = np.empty(start)                          # Values of all states
+    for var, part in zip(self.states, self.slices):
+      shape = np.shape(var.value)
+      self.y[part] = np.ravel(var.value)
+      var.value = self.y[part].reshape(shape)                     # View of y
+    self.dy = np.empty(start)
+    upstream = scheduler.upstream(self.rates)
+    required = [var for var in scheduler.order if var in upstream and
+                var not in rates and scheduler.head.get(var, var) is var]
+    varied = set(self.states + ([time] if time is not None else []))
+    self.sequence = [var for var in required   # Depend on the states or time
+                     if not varied.isdisjoint(scheduler.inputs[var])]
+    self.constant = [var for var in required if var not in self.sequence]
+    self.refresh()
+    self.jacobian = None
+    if jacobian:
+      try:
+        self.jacobian = Jacobian(scheduler, self.rates, self.states)
+        self.setState(self.y.copy())
+        self.jacobian.sparsity()
+      except myerrors.DerivativeError:            # Opaque equations or loops
+        self.jacobian = None
+    self.evaluations = 0                   # Number of right hand side calls
+
+  def refresh(self):
+    """Evaluate the equations that do not depend on the states if changed"""
+    scheduler = self.scheduler
+    for var in self.constant:
+      if scheduler.seen.get(var) != scheduler.versions(var):
+        scheduler.updateVariable(var)
+
+  def setState(self, y, t = None):
+    """Copy the state vector into the states and evaluate the rates"""
+    self.y[:] = y
+    for var in self.states:
+      var.touch()
+    if self.time is not None and t is not None:
+      self.time.value = t
+    for var in self.sequence:
+      self.scheduler.updateVariable(var)
+
+  def rhs(self, t, y):
+    """Time derivative of the state vector"""
+    self.setState(y, t)
+    for var, part in zip(self.rates, self.slices):
+      self.dy[part] = np.ravel(var.value)
+    self.evaluations += 1
+    return self.dy.copy()
+
+  def jac(self, t, y):
+    """Jacobian of the right hand side by forward derivatives"""
+    self.setState(y, t)
+    return self.jacobian(sparse = True)
+
+  def sparsity(self):
+    """Sparsity of the Jacobian given by which states each rate depends on"""
+    pattern = np.zeros((len(self.y), len(self.y)), dtype = bool)
+    for rate, rows in zip(self.rates, self.slices):
+      inputs = self.scheduler.inputs.get(rate, set())
+      for state, cols in zip(self.states, self.slices):
+        if state is rate or state in inputs:
+          pattern[rows, cols] = True
+    return pattern
+
+  def run(self, span, **options):
+    """
+    Integrate the states over the time span
+
+    Args:
+      span:    Tuple with the initial and final time
+      options: Further options of scipy.integrate.solve_ivp, e.g. t_eval, rtol
+
+    Returns:
+      Result of solve_ivp.  The states are left at the final time.
+    """
+    if solve_ivp is None:
+      raise ImportError('The simulation requires scipy.integrate')
+    self.refresh()                       # Parameters changed since the last run
+    if self.jacobian is not None:
+      options.setdefault('jac', self.jac)
+    elif self.method in ('BDF', 'Radau', 'LSODA'):
+      options.setdefault('jac_sparsity', sp.csr_matrix(self.sparsity()))
+    result = solve_ivp(self.rhs, span, self.y.copy(), method = self.method,
+                       **options)
+    self.setState(result.y[:, -1], result.t[-1])
+    return result
@@ -0,0 +1,164 @@
+"""
+..  module:: Solver
+    :platform: Unix, Windows
+    :synopsis: Newton solver for the algebraic loops of a model.
+
+.. moduleauthor:: Arne Tobias Elve <arne.t.elve@ntnu.no>
+
+.. date:: 2017-09-25
+
+.. contents:: - BlockSolver: Newton iteration of one algebraic loop
+              - finiteDifferences
+              - factorise
+
+.. notes::    (2017-09-25) The variables of an algebraic loop are solved
+              simultaneously.  The values of the variables are stacked in one
+              vector x  and the residual  r(x) = x - f(x)  is driven to zero,
+              where f evaluates the selected equations of the loop.  The
+              Jacobian comes from finite differences  or from a function given
+              to the solver.  Its factorisation is reused over the iterations
+              and over later solves  (chord Newton)  as long as the residual
+              decreases fast enough,  otherwise it is refreshed.
+"""
+
+import numpy as np                                     # NUMPY numerical python
+from OntoSim.objects import indexShape
+import OntoSim.myerrors as myerrors                      # My error definitions
+
+try:
+  import scipy.linalg
+  import scipy.sparse
+  import scipy.sparse.linalg
+except ImportError:                          # Dense solves with numpy only
+  scipy = None
+
+SPARSE = 200                  # Minimum size of a sparse factorised Jacobian
+
+
+def finiteDifferences(solver, x, r):
+  """
+  Jacobian of the residual by forward differences
+
+  Args:
+    solver: BlockSolver
+    x:      Stacked values of the loop variables
+    r:      Residual at x
+
+  Returns:
+    Dense Jacobian, one residual evaluation per column
+  """
+  J = np.empty((len(x), len(x)))
+  for j in range(len(x)):
+    h = 1e-7 * max(1., abs(x[j]))
+    xp = x.copy()
+    xp[j] += h
+    J[:, j] = (solver.residual(xp) - r) / h
+  solver.residual(x)                                # Restore the loop values
+  return J
+
+
+def factorise(J):
+  """
+  Factorise the Jacobian
+
+  Large Jacobians with few non-zeros are factorised sparse (SuperLU), others
+  dense (LAPACK).  Without scipy the system is solved anew every time.
+
+  Returns:
+    Function solving J dx = r
+  """
+  if scipy is None:
+    return lambda r: np.linalg.solve(J, r)
+  if len(J) >= SPARSE and np.count_nonzero(J) < 0.1 * J.size:
+    return scipy.sparse.linalg.splu(scipy.sparse.csc_matrix(J)).solve
+  lu = scipy.linalg.lu_factor(J)
+  return lambda r: scipy.linalg.lu_solve(lu, r)
+
+
+class BlockSolver(object):
+  """
+  Newton iteration of one algebraic loop
+
+  Args:
+    block:    Variables of the loop
+    plans:    Variable -> compiled plan of its selected equation
+    jacobian: Function (solver, x, r) giving the Jacobian of the residual,
+              defaults to finite differences
+    tol:      Tolerance of the residual relative to the size of x
+    maxiter:  Maximum number of iterations
+  """
+  def __init__(self, block, plans, jacobian = None, tol = 1e-10, maxiter = 50):
+    self.block = list(block)
+    self.plans = plans
+    self.jacobian = jacobian if jacobian is not None else finiteDifferences
+    self.tol = tol
+    self.maxiter = maxiter
+    self.factorised = None              # Solves with the factorised Jacobian
+    self.iterations = 0                          # Counters over all the solves
+    self.factorisations = 0
+
+  def pack(self):
+    """Stack the current values of the loop variables"""
+    values = []
+    self.shapes = []
+    for var in self.block:
+      value = var.value
+      if value is None:
+        value = np.zeros(indexShape(var.index))
+      value = np.asarray(value, dtype = float)
+      self.shapes.append(value.shape)
+      values.append(value.ravel())
+    return np.concatenate(values)
+
+  def unpack(self, x):
+    """Assign the stacked values to the loop variables"""
+    start = 0
+    for var, shape in zip(self.block, self.shapes):
+      size = int(np.prod(shape))
+      var.value = x[start:start + size].reshape(shape)
+      start += size
+
+  def residual(self, x):
+    """Residual x - f(x) of the loop equations"""
+    self.unpack(x)
+    f = [np.ravel(self.plans[var].execute()[0]) for var in self.block]
+    return x - np.concatenate(f)
+
+  def refactorise(self, x, r):
+    self.factorised = factorise(self.jacobian(self, x, r))
+    self.factorisations += 1
+
+  def converged(self, x, r):
+    return np.linalg.norm(r) <= self.tol * (1. + np.linalg.norm(x))
+
+  def __call__(self):
+    """
+    Solve the loop starting from the current values
+
+    Returns:
+      Number of Newton iterations
+    """
+    x = self.pack()
+    r = self.residual(x)
+    fresh = False
+    for iteration in range(self.maxiter):
+      if self.converged(x, r):
+        self.iterations += iteration
+        return iteration
+      if self.factorised is None:
+        self.refactorise(x, r)
+        fresh = True
+      xn = x - self.factorised(r)
+      rn = self.residual(xn)
+      if not np.all(np.isfinite(rn)) or \
+         np.linalg.norm(rn) > 0.5 * np.linalg.norm(r):
+        if not fresh:                    # Old Jacobian, refresh and try again
+          self.residual(x)
+          self.factorised = None
+          continue
+      fresh = False
+      x, r = xn, rn
+    if self.converged(x, r):
+      self.iterations += self.maxiter
+      return self.maxiter
+    raise myerrors.ConvergenceError([var.symbol for var in self.block])
@@ -0,0 +1,202 @@
+"""
+..  module:: Structure
+    :platform: Unix, Windows
+    :synopsis: Structural analysis of the equation system.
+
+.. moduleauthor:: Arne Tobias Elve <arne.t.elve@ntnu.no>
+
+.. date:: 2017-09-24
+
+.. contents:: - Structure: selected alternatives, evaluation blocks and tears
+              - analyse
+              - inputsOf
+              - components
+
+.. notes::    (2017-09-24) Every  equation alternative  of a variable  is already
+              solved for that variable, so assigning the unknowns to equations
+              reduces to choosing one alternative per variable.  The choice is
+              made  by causality  propagation:  an alternative  is taken  as soon
+              as all its inputs are known.  When no alternative is ready the
+              remaining variables  depend on each other:  the variable  that
+              most waiting alternatives need is torn (guessed) and the
+              propagation continues.  The dependency graph of the selected
+              alternatives is then split in strongly connected components
+              (Tarjan), which gives the block triangular evaluation order.
+              Blocks with more than one variable, or a variable using itself,
+              are algebraic loops.
+"""
+
+from collections import deque
+
+
+def inputsOf(exe):
+  """
+  Variables used by an equation
+
+  Args:
+    exe: Executable of an equation alternative
+
+  Returns:
+    List of the variables, every variable once
+  """
+  inputs = []
+  for var in exe.instances:
+    if var not in inputs:
+      inputs.append(var)
+  return inputs
+
+
+def components(nodes, successors):
+  """
+  Strongly connected components (Tarjan)
+
+  Iterative, so that long chains do not hit the recursion limit.  A component
+  is returned after all the components it depends on.
+
+  Args:
+    nodes:      Nodes of the graph
+    successors: Function giving the nodes a node depends on
+
+  Returns:
+    List of the components, each a list of nodes
+  """
+  index = {}
+  lowlink = {}
+  stack = []
+  onStack = set()
+  result = []
+  for root in nodes:
+    if root in index:
+      continue
+    work = [(root, iter(successors(root)))]
+    index[root] = lowlink[root] = len(index)
+    stack.append(root)
+    onStack.add(root)
+    while work:
+      node, children = work[-1]
+      child = next(children, None)
+      if child is not None:
+        if child not in index:
+          index[child] = lowlink[child] = len(index)
+          stack.append(child)
+          onStack.add(child)
+          work.append((child, iter(successors(child))))
+        elif child in onStack:
+          lowlink[node] = min(lowlink[node], index[child])
+        continue
+      work.pop()
+      if work:
+        parent = work[-1][0]
+        lowlink[parent] = min(lowlink[parent], lowlink[node])
+      if lowlink[node] == index[node]:                     # Root of component
+        component = []
+        while True:
+          member = stack.pop()
+          onStack.discard(member)
+          component.append(member)
+          if member is node:
+            break
+        result.append(component[::-1])
+  return result
+
+
+class Structure(object):
+  """
+  Result of the structural analysis
+
+  Attributes:
+    selection: Variable -> selected alternative
+    blocks:    Evaluation order,  list of blocks of variables.  A block depends
+               only on the blocks before it.
+    loops:     Blocks that are algebraic loops
+    tears:     Variables that were guessed to break the loops
+  """
+  def __init__(self, selection, blocks, tears):
+    self.selection = selection
+    self.blocks = blocks
+    self.tears = tears
+    self.loops = [block for block in blocks if len(block) > 1 or
+                  block[0] in inputsOf(block[0].equations[selection[block[0]]])]
+
+  @property
+  def order(self):
+    """The variables in evaluation order"""
+    return [var for block in self.blocks for var in block]
+
+  def apply(self):
+    """Set the selector of every variable to the selected alternative"""
+    for var, alternative in self.selection.items():
+      var.selector = alternative
+
+  def __str__(self):
+    lines = []
+    for block in self.blocks:
+      symbols = ' '.join('%s[%i]' % (var.symbol, self.selection[var])
+                         for var in block)
+      lines.append(('loop  ' if block in self.loops else '      ') + symbols)
+    return '\n'.join(lines)
+
+
+def analyse(variables, given = ()):
+  """
+  Select the equation alternatives and find the evaluation order
+
+  Variables without equations and the given variables are known.  Of the ready
+  alternatives of a variable the current selector is preferred, otherwise the
+  first one.
+
+  Args:
+    variables: Variables of the model
+    given:     Variables that are given although they have equations
+
+  Returns:
+    Structure of the selected equation system
+  """
+  given = set(given)
+  unknowns = [var for var in variables if var.equations and var not in given]
+  pending = set(unknowns)
+  missing = {}           # (var, alternative) -> number of unknown inputs
+  waiting = {}              # Variable -> alternatives waiting for its value
+  for var in unknowns:
+    for i, exe in enumerate(var.equations):
+      inputs = [inp for inp in inputsOf(exe) if inp in pending]
+      missing[var, i] = len(inputs)
+      for inp in inputs:
+        waiting.setdefault(inp, []).append((var, i))
+
+  selection = {}
+  tears = []
+  ready = deque(key for key in missing if missing[key] == 0)
+
+  def known(var):
+    pending.discard(var)
+    for key in waiting.get(var, ()):
+      missing[key] -= 1
+      if missing[key] == 0:
+        ready.append(key)
+
+  while pending:
+    while ready:
+      var, i = ready.popleft()
+      if var not in pending:
+        continue
+      if var.selector != i and missing.get((var, var.selector)) == 0:
+        i = var.selector
+      selection[var] = i
+      known(var)
+    if not pending:
+      break
+    tear = max((var for var in unknowns if var in pending),     # Greedy tear
+               key = lambda var: sum(1 for key in waiting.get(var, ())
+                                     if key[0] in pending))
+    alternatives = range(len(tear.equations))
+    selection[tear] = min(alternatives, key = lambda i: (missing[tear, i],
+                                                         i != tear.selector))
+    tears.append(tear)
+    known(tear)
+
+  def successors(var):
+    return [inp for inp in inputsOf(var.equations[selection[var]])
+            if inp in selection]
+
+  return Structure(selection, components(unknowns, successors), tears)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+What:    Benchmark of the equation tree construction and the dot export.
+Author:  Arne Tobias Elve
+Since:   2017-09-23
+Why:     The dot export of plant models took minutes.  The synthetic model is a
+         ladder where every variable uses both variables of the layer below,
+         so the number of root-to-leaf paths is 2**layers while the graph has
+         only 2*layers variables.
+
+Usage:   python benchmarks/dot_export.py [layers]
+"""
+
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+from OntoSim.objects import IndexSet, Model, Variable
+from OntoSim import operators as op
+from OntoSim.equationTree import EquationsTree, SubTree
+
+
+def ladder(layers):
+  """Top variable of the ladder"""
+  N = IndexSet('N', mapping = [0, 1], blocking = [1, 1])
+  units = [0, 1, 0, 0, 0, 0, 0, 0]
+  v = Variable('v0', 'documentation', 'constant', units, [N])
+  w = Variable('w0', 'documentation', 'state', units, [N])
+  for i in range(1, layers + 1):
+    vi = Variable('v%i' % i, 'documentation', 'closure', units, [N])
+    wi = Variable('w%i' % i, 'documentation', 'closure', units, [N])
+    vi.makeExecuteable(op.add(v, w))
+    wi.makeExecuteable(op.subtract(v, w))
+    v, w = vi, wi
+  return v
+
+
+def timed(name, f):
+  start = perf_counter()
+  result = f()
+  print('%-24s %10.3f s' % (name, perf_counter() - start))
+  return result
+
+
+def main(layers = 5000):
+  with Model('benchmark'):
+    top = ladder(layers)
+    print('%i variables' % (2 * layers + 1))
+    tree = timed('EquationsTree', lambda: EquationsTree('ladder', top))
+    subtree = timed('SubTree', lambda: SubTree('ladder', top))
+    middle = 'v%i' % (layers // 2)
+    timed('setGivenVariableByName', lambda: subtree.setGivenVariableByName(middle))
+    timed('unsetGivenVariableByName',
+          lambda: subtree.unsetGivenVariableByName(middle))
+    with tempfile.TemporaryDirectory() as directory:
+      filename = os.path.join(directory, 'ladder.dot')
+      timed('makeDotGraph', lambda: tree.makeDotGraph(filename))
+      timed('makeDotGraph (subtree)', lambda: subtree.makeDotGraph(filename))
+
+
+if __name__ == '__main__':
+  main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+What:    Memory benchmark of the model records.
+Author:  Arne Tobias Elve
+Since:   2017-09-20
+Why:     Variables, executables, tree variables and equations are created in
+         very large numbers for ontology generated models.  This compares the
+         memory of the slot based records with the dict based records they
+         replaced (the definitions before the records got slots).
+
+Usage:   python benchmarks/records_memory.py [count]
+"""
+
+import sys
+import tracemalloc
+
+from OntoSim.objects import Executable, IndexSet, Model, Variable
+from OntoSim.equationTree import Equation, TreeVariable
+
+
+class DictVariable(object):
+  """Dict based variable as it was before the slots"""
+  variable = True
+  def __init__(self, symbol, documentation, type, units, index, model = None):
+    self.model = model if model is not None else Model.active()
+    self.documentation = documentation
+    self.symbol = symbol
+    self.index = index
+    self.units = units
+    self.selector = 0
+    self.version = 0
+    self._value = None
+    self.get = lambda: self._value
+    self.type = type
+    self.ex = []
+    self.instances = [self]
+    self.equations = []
+    self.model.addVar(self)
+
+
+class DictExecutable(object):
+  """Dict based executable as it was before the slots"""
+  variable = False
+  def __init__(self, ex, index, instances, op = None, args = (), params = (),
+               fn = None, inplace = False):
+    self.index = index
+    self.ex = ex
+    self.get = ex
+    self.instances = instances
+    self.op = op
+    self.args = tuple(args)
+    self.params = tuple(params)
+    self.fn = fn
+    self.inplace = inplace
+    self.buffer = None
+
+
+class DictTreeVariable(object):
+  """Dict based tree variable as it was before the slots"""
+  def __init__(self, var, given = False):
+    self.var = var
+    self.symbol = var.symbol
+    self.type = var.type
+    self.equations = var.equations
+    self.given = given
+
+
+class DictEquation(object):
+  """Dict based equation as it was before the slots"""
+  def __init__(self, symbol, alternative, exe):
+    self.symbol = symbol
+    self.alternative = alternative
+    self.ex = exe
+    self.type = 'equation'
+    self.select = True
+
+
+def measure(build, count):
+  """Bytes allocated per record while building count records"""
+  tracemalloc.start()
+  before = tracemalloc.get_traced_memory()[0]
+  records = build(count)
+  after = tracemalloc.get_traced_memory()[0]
+  tracemalloc.stop()
+  del records
+  return (after - before) / float(count)
+
+
+def main(count = 100000):
+  with Model('benchmark') as model:
+    N = IndexSet('N', mapping = [0, 1], blocking = [1, 1])
+    units = [0, 1, 0, 0, 0, 0, 0, 0]
+
+    def variables(cls):
+      return lambda n: [cls('x%i' % i, 'documentation', 'state', list(units),
+                            [N]) for i in range(n)]           # Parsed units
+
+    def executables(cls):
+      f = lambda: None
+      return lambda n: [cls(f, [N], [], op = 'add') for i in range(n)]
+
+    x = Variable('x', 'documentation', 'state', units, [N])
+
+    def treeVariables(cls):
+      return lambda n: [cls(x) for i in range(n)]
+
+    def equations(cls):
+      return lambda n: [cls('eq0x', 0, None) for i in range(n)]
+
+    cases = [('Variable', variables(Variable), variables(DictVariable)),
+             ('Executable', executables(Executable),
+              executables(DictExecutable)),
+             ('TreeVariable', treeVariables(TreeVariable),
+              treeVariables(DictTreeVariable)),
+             ('Equation', equations(Equation), equations(DictEquation))]
+    print('%-14s %12s %12s %8s' % ('record', 'dict [B]', 'slots [B]', 'saved'))
+    for name, slots, dicts in cases:
+      withDict = measure(dicts, count)
+      model.clear()
+      withSlots = measure(slots, count)
+      model.clear()
+      print('%-14s %12.0f %12.0f %7.0f%%' % (name, withDict, withSlots,
+                                          100. * (1. - withSlots / withDict)))
+
+
+if __name__ == '__main__':
+  main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+models
+----------------------------------
+
+Small models shared by the tests.
+"""
+
+import numpy as np
+
+from OntoSim.objects import IndexSet, Variable
+from OntoSim import operators as op
+
+
+def makeSets():
+  """Nodes N, arcs A, species S and their combinations NS and AS"""
+  N = IndexSet('N', mapping = [0, 1, 2], blocking = [1, 1, 1])
+  A = IndexSet('A', mapping = [0, 1], blocking = [1, 1])
+  S = IndexSet('S', mapping = [0, 1], blocking = [1, 1])
+  NS = IndexSet('NS', mapping = [0, 1, 2], blocking = [2, 2, 2],
+                sets = [N, S], superset = N)
+  AS = IndexSet('AS', mapping = [0, 1], blocking = [2, 2],
+                sets = [A, S], superset = A)
+  return N, A, S, NS, AS
+
+
+def makeNetwork(seed):
+  """
+  Network model using every kind of operator
+
+  The tests add their own equations on top of the network.
+
+  Args:
+    seed: Seed of the random values of the states
+
+  Returns:
+    Dictionary symbol -> index set and dictionary symbol -> variable, in the
+    order of definition
+  """
+  N, A, S, NS, AS = makeSets()
+  Nv = IndexSet('Nv', mapping = [0, 2], blocking = [1, 1], superset = N)
+  Nw = IndexSet('Nw', mapping = [1, 2], blocking = [1, 1], superset = N)
+  F = Variable('F', 'testvariable', 'network', [1]*8, [N, A])
+  x = Variable('x', 'testvariable', 'state', [1]*8, [N])
+  y = Variable('y', 'testvariable', 'state', [1]*8, [NS])
+  z = Variable('z', 'testvariable', 'state', [1]*8, [NS, AS])
+  a = Variable('a', 'testvariable', 'closure', [1]*8, [A])
+  b = Variable('b', 'testvariable', 'closure', [1]*8, [N])
+  c = Variable('c', 'testvariable', 'closure', [1]*8, [N, A])
+  d = Variable('d', 'testvariable', 'closure', [1]*8, [NS, AS])
+  e = Variable('e', 'testvariable', 'closure', [1]*8, [Nv])
+  a.makeExecuteable(op.exp(op.reduceproduct(F, N, x)))
+  b.makeExecuteable(op.reduceproduct(y, S, op.sin(y)))
+  c.makeExecuteable(op.expandproduct(op.subtract(b, x), F))
+  d.makeExecuteable(op.khatriRaoProduct(c, z))
+  e.makeExecuteable(op.select(op.sqrt(op.inv(x)), N, Nv))
+  rng = np.random.RandomState(seed)
+  F.value = np.array([[-1., 0.], [1., -1.], [0., 1.]])
+  x.value = rng.rand(3, 1) + 0.5
+  y.value = rng.rand(6, 1)
+  z.value = rng.rand(6, 4)
+  sets = dict((ind.symbol, ind) for ind in (N, A, S, NS, AS, Nv, Nw))
+  variables = dict((var.symbol, var) for var in (F, x, y, z, a, b, c, d, e))
+  return sets, variables
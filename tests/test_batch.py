@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_batch
+----------------------------------
+
+Tests for `OntoSim.batch` module.
+"""
+
+import numpy as np
+
+from OntoSim.objects import IndexSet, Variable
+from OntoSim import operators as op
+from OntoSim.scheduler import Scheduler
+from OntoSim.batch import BatchRunner
+
+
+def test_scenarios_are_independent_of_the_workers():
+  N = IndexSet('N', mapping = [0, 1], blocking = [1, 1])
+  k = Variable('k', 'testvariable', 'constant', [1]*8, [N])
+  c = Variable('c', 'testvariable', 'constant', [1]*8, [N])
+  r = Variable('r', 'testvariable', 'closure', [1]*8, [N])
+  r.makeExecuteable(op.expandproduct(k, c))
+  k.value = np.array([[1.], [2.]])
+  c.value = np.array([[3.], [4.]])
+  scheduler = Scheduler([k, c, r])
+  scenarios = [{'k': np.array([[float(i)], [0.]])} for i in range(5)]
+  scenarios.append({c: np.array([[1.], [1.]])})
+  for processes in [1, 2]:
+    result = BatchRunner(scheduler, [r], processes = processes).run(scenarios)
+    assert result['r'].shape == (6, 2, 1)
+    assert np.allclose(result['r'][:5, 0, 0], 3. * np.arange(5))
+    assert np.allclose(result['r'][5], [[1.], [2.]])
+  assert np.allclose(k.value, [[1.], [2.]])                 # Inputs restored
+
+
+def test_serial_run_restores_the_outputs():
+  N = IndexSet('N', mapping = [0, 1], blocking = [1, 1])
+  k = Variable('k', 'testvariable', 'constant', [1]*8, [N])
+  r = Variable('r', 'testvariable', 'closure', [1]*8, [N])
+  r.makeExecuteable(op.exp(k))
+  k.value = np.array([[1.], [2.]])
+  scheduler = Scheduler([k, r])
+  scheduler.evaluateAll()
+  scenarios = [{'k': np.array([[0.], [float(i)]])} for i in range(3)]
+  result = BatchRunner(scheduler, [r], processes = 1).run(scenarios)
+  assert np.allclose(result['r'][2], np.exp([[0.], [2.]]))
+  assert np.allclose(r.value, np.exp(k.value))             # Not the last one
+  assert scheduler.update() == 0
+
+
+def test_vectorized_scenarios_match_serial():
+  N = IndexSet('N', mapping = [0, 1, 2], blocking = [1, 1, 1])
+  A = IndexSet('A', mapping = [0, 1], blocking = [1, 1])
+  F = Variable('F', 'testvariable', 'network', [1]*8, [N, A])
+  x = Variable('x', 'testvariable', 'state', [1]*8, [N])
+  q = Variable('q', 'testvariable', 'transport', [1]*8, [A])
+  s = Variable('s', 'testvariable', 'closure', [1]*8, [N])
+  q.makeExecuteable(op.reduceproduct(F, N, op.exp(x)))
+  s.makeExecuteable(op.reduceproduct(F, A, q))
+  F.value = np.array([[-1., 0.], [1., -1.], [0., 1.]])
+  x.value = np.zeros((3, 1))
+  scheduler = Scheduler([F, x, q, s], buffered = True)
+  scenarios = [{'x': np.random.rand(3, 1)} for i in range(4)]
+  runner = BatchRunner(scheduler, [s, F], processes = 1)
+  serial = runner.run(scenarios)
+  vectorized = runner.runVectorized(scenarios)
+  assert vectorized['s'].shape == (4, 3, 1)
+  assert vectorized['F'].shape == (4, 3, 2)
+  assert np.allclose(serial['s'], vectorized['s'])
+  assert s.value.shape == (3, 1)                    # Evaluated without batch
+  expected = s.value.copy()
+  x.value = np.zeros((3, 1))
+  scheduler.evaluateAll()
+  assert s.value.shape == (3, 1) and np.allclose(s.value, expected)
+  assert all(b is None or b.ndim == 2 for plan in scheduler.plans.values()
+             for b in plan.buffers)
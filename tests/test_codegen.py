@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_codegen
+----------------------------------
+
+Tests for `OntoSim.codegen` module.
+"""
+
+import numpy as np
+import pytest
+
+from OntoSim.objects import IndexSet, Model, Variable
+from OntoSim import operators as op
+from OntoSim.scheduler import Scheduler
+from OntoSim.codegen import generateModule, loadModule
+from OntoSim.myerrors import CodegenError
+from tests.models import makeNetwork
+
+
+def makeModel():
+  sets, var = makeNetwork(7)
+  f = Variable('f', 'testvariable', 'closure', [1]*8, [sets['Nw']])
+  f.makeExecuteable(op.select(op.add(var['b'], op.sett(var['x'])),
+                              sets['N'], sets['Nw']))
+  return Scheduler(list(var.values()) + [f])
+
+
+def test_generated_module_matches_scheduler(tmp_path):
+  with Model('codegen'):
+    scheduler = makeModel()
+  filename = str(tmp_path / 'model.py')
+  source = generateModule(scheduler, filename, name = 'test')
+  assert open(filename).read() == source
+  assert 'OntoSim' not in source.split('"""')[2]         # Standalone module
+  module = loadModule(source)
+  assert module.INPUTS == ('F', 'x', 'y', 'z')
+  values = dict((var.symbol, var.value) for var in scheduler.variables
+                if var.symbol in module.INPUTS)
+  module.evaluate(values)
+  scheduler.evaluateAll()
+  for var in scheduler.order:
+    assert np.allclose(values[var.symbol], var.value)
+
+
+def test_block_reduction_with_empty_blocks():
+  with Model('codegen'):
+    N = IndexSet('N', mapping = [0, 1, 2], blocking = [1, 1, 1])
+    S = IndexSet('S', mapping = [0, 1], blocking = [1, 1])
+    NS = IndexSet('NS', mapping = [0, 1, 2], blocking = [1, 2, 0],
+                  sets = [N, S], superset = N)
+    y = Variable('y', 'testvariable', 'state', [1]*8, [NS])
+    b = Variable('b', 'testvariable', 'closure', [1]*8, [N])
+    b.makeExecuteable(op.reduceproduct(y, S, y))
+    y.value = np.array([[1.], [2.], [3.]])
+    scheduler = Scheduler([y, b])
+  module = loadModule(generateModule(scheduler))
+  values = module.evaluate({'y': y.value})
+  scheduler.evaluateAll()
+  assert np.allclose(values['b'], [[1.], [13.], [0.]])
+  assert np.allclose(b.value, values['b'])
+
+
+def test_opaque_equations_are_reported():
+  with Model('codegen'):
+    N = IndexSet('N', mapping = [0], blocking = [1])
+    x = Variable('x', 'testvariable', 'state', [1]*8, [N])
+    y = Variable('y', 'testvariable', 'closure', [1]*8, [N])
+    y.makeExecuteable(op.Executable(lambda: x.value, [N], [x]))
+  with pytest.raises(CodegenError):
+    generateModule(Scheduler([x, y]))
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_compiler
+----------------------------------
+
+Tests for `OntoSim.compiler` module.
+"""
+
+import numpy as np
+
+from OntoSim.objects import IndexSet, Variable
+from OntoSim import operators as op
+from OntoSim import compiler
+
+
+def makeVariables():
+  N = IndexSet('N', mapping = [0, 1, 2], blocking = [1, 1, 1])
+  A = IndexSet('A', mapping = [0, 1], blocking = [1, 1])
+  x = Variable('x', 'testvariable', 'constant', [1]*8, [N])
+  y = Variable('y', 'testvariable', 'constant', [1]*8, [N])
+  F = Variable('F', 'testvariable', 'constant', [1]*8, [N, A])
+  x.value = np.array([[1.], [2.], [3.]])
+  y.value = np.array([[4.], [5.], [6.]])
+  F.value = np.array([[-1., 0.], [1., -1.], [0., 1.]])
+  return N, A, x, y, F
+
+
+def test_plan_matches_closures():
+  N, A, x, y, F = makeVariables()
+  s = op.add(x, y)
+  exe = op.expandproduct(op.exp(op.subtract(s, y)), op.sqrt(s))
+  plan = compiler.compileExecutable(exe)
+  assert np.allclose(plan.execute()[0], exe.ex())
+  red = op.reduceproduct(F, N, x)
+  assert np.allclose(compiler.compileExecutable(red).execute()[0], red.ex())
+
+
+def test_common_subexpressions_are_merged():
+  N, A, x, y, F = makeVariables()
+  exe = op.add(op.exp(x), op.exp(x))              # Two structurally equal nodes
+  plan = compiler.compileExecutable(exe)
+  assert [ins[0] for ins in plan.instructions] == ['exp', 'add']
+  assert np.allclose(plan.execute()[0], 2 * np.exp(x.value))
+
+
+def test_compile_variable_reads_current_values():
+  N, A, x, y, F = makeVariables()
+  z = Variable('z', 'testvariable', 'state', [1]*8, [N])
+  z.makeExecuteable(op.add(x, y))
+  plan = compiler.compileVariable(z)
+  assert np.allclose(plan.execute()[0], [[5.], [7.], [9.]])
+  x.value = np.array([[0.], [0.], [0.]])
+  assert np.allclose(plan.execute()[0], y.value)
+
+
+def test_buffered_plan_reuses_buffers():
+  N, A, x, y, F = makeVariables()
+  exe = op.inv(op.add(op.reduceproduct(F, N, x), op.sqrt(op.exp(op.ln(
+        op.reduceproduct(F, N, y))))))
+  plan = compiler.compileExecutable(exe, buffered = True)
+  first = plan.execute()[0].copy()
+  assert np.allclose(first, exe.ex())
+  buffers = [b for b in plan.buffers if b is not None]
+  assert len(buffers) == len(plan)
+  assert all(b.shape == (2, 1) for b in buffers)
+  second = plan.execute()[0]
+  assert any(second is b for b in buffers)
+  assert np.allclose(second, first)
+
+
+def test_shared_executable_buffer_is_claimed_once():
+  from concurrent.futures import ThreadPoolExecutor
+  N, A, x, y, F = makeVariables()
+  shared = op.exp(op.add(x, y))
+  assert shared.allocate() is not None and shared.allocate() is None
+  shared.buffer = None
+  plans = [compiler.compileExecutable(op.sqrt(shared), buffered = True),
+           compiler.compileExecutable(op.ln(shared), buffered = True)]
+  with ThreadPoolExecutor(2) as pool:
+    list(pool.map(lambda plan: plan.execute(), plans))
+  first, second = [plan.buffers[ins[3]] for plan in plans
+                    for ins in plan.instructions if ins[4] is shared]
+  assert first is not second
+  assert sum(shared in plan.owned for plan in plans) == 1
+  results = [plan.execute()[0].copy() for plan in plans]
+  assert np.allclose(results[0], np.sqrt(shared.ex()))
+  assert np.allclose(results[1], np.log(shared.ex()))
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_derivatives
+----------------------------------
+
+Tests for `OntoSim.derivatives` module.
+"""
+
+import numpy as np
+
+from OntoSim.objects import IndexSet, Model, Variable
+from OntoSim import operators as op
+from OntoSim.scheduler import Scheduler
+from OntoSim.derivatives import Jacobian, colouring, loopJacobian
+from tests.models import makeNetwork
+
+
+def makeModel():
+  sets, var = makeNetwork(5)
+  outputs = [var['a'], var['d'], var['e']]
+  return Scheduler(list(var.values())), outputs, [var['x'], var['y'], var['z']]
+
+
+def flat(variables):
+  return np.concatenate([np.ravel(var.value) for var in variables])
+
+
+def test_jacobian_matches_finite_differences():
+  with Model('derivatives'):
+    scheduler, outputs, inputs = makeModel()
+  scheduler.evaluateAll()
+  jacobian = Jacobian(scheduler, outputs, inputs)
+  jac = jacobian()
+  base = flat(outputs)
+  reference = np.zeros_like(jac)
+  column = 0
+  for var in inputs:
+    value = var.value
+    for i in range(value.size):
+      h = 1e-7
+      perturbed = value.copy()
+      perturbed.flat[i] += h
+      var.value = perturbed
+      scheduler.evaluateAll()
+      reference[:, column] = (flat(outputs) - base) / h
+      column += 1
+    var.value = value
+  assert np.allclose(jac, reference, atol = 1e-5)
+  assert np.all(jacobian.pattern[reference != 0.])
+  assert int(jacobian.colours.max()) + 1 < jac.shape[1]
+  scheduler.evaluateAll()
+  assert np.allclose(jacobian(sparse = True).toarray(), jac)
+
+
+def test_colouring_separates_columns_sharing_rows():
+  pattern = np.array([[1, 1, 0, 0],
+                      [0, 0, 1, 1],
+                      [1, 0, 1, 0]], dtype = bool)
+  colours = colouring(pattern)
+  assert list(colours) == [0, 1, 1, 0]
+
+
+def test_loop_jacobian_solves_loops():
+  with Model('derivatives'):
+    N = IndexSet('N', mapping = [0, 1], blocking = [1, 1])
+    k = Variable('k', 'testvariable', 'constant', [1]*8, [N])
+    x = Variable('x', 'testvariable', 'closure', [1]*8, [N])
+    y = Variable('y', 'testvariable', 'closure', [1]*8, [N])
+    x.makeExecuteable(op.add(k, y))
+    y.makeExecuteable(op.sqrt(x))
+  k.value = np.array([[2.], [6.]])
+  x.value = np.array([[1.], [1.]])
+  scheduler = Scheduler([k, x, y], jacobian = loopJacobian)
+  scheduler.evaluateAll()
+  assert np.allclose(x.value, [[4.], [9.]])
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_equationTree
+----------------------------------
+
+Tests for `OntoSim.equationTree` module.
+"""
+
+from itertools import islice
+
+from OntoSim.objects import IndexSet, Model, Variable
+from OntoSim import operators as op
+from OntoSim.equationTree import EquationsTree, SubTree
+
+
+def makeLadder(layers):
+  """Every layer uses both variables of the layer below: 2**layers paths"""
+  N = IndexSet('N', mapping = [0, 1], blocking = [1, 1])
+  v = Variable('v0', 'testvariable', 'constant', [1]*8, [N])
+  w = Variable('w0', 'testvariable', 'state', [1]*8, [N])
+  for i in range(1, layers + 1):
+    vi = Variable('v%i' % i, 'testvariable', 'closure', [1]*8, [N])
+    wi = Variable('w%i' % i, 'testvariable', 'closure', [1]*8, [N])
+    vi.makeExecuteable(op.add(v, w))
+    wi.makeExecuteable(op.subtract(v, w))
+    v, w = vi, wi
+  return v
+
+
+def test_paths_of_small_tree():
+  with Model('tree'):
+    top = makeLadder(2)
+    tree = EquationsTree('ladder', top)
+  paths = [[el.symbol for el in path] for path in tree.tree]
+  assert len(paths) == 4
+  assert paths[0] == ['v2', 'eq0v2', 'v1', 'eq0v1', 'v0']
+  assert paths[-1] == ['v2', 'eq0v2', 'w1', 'eq0w1', 'w0']
+  assert set(tree.variables) == {'v0', 'w0', 'v1', 'w1', 'v2'}
+  assert tree.edges['eq0v2'] == ['v1', 'w1']
+
+
+def test_every_variable_is_expanded_once():
+  with Model('tree'):
+    top = makeLadder(60)                                        # 2**60 paths
+    tree = EquationsTree('ladder', top)
+  assert len(tree.variables) == 2*60 + 1
+  assert len(tree.equations) == 2*60 - 1
+  first = next(tree.paths())
+  assert len(first) == 2*60 + 1
+  assert len(list(islice(tree.paths(), 100))) == 100
+
+
+def test_cycle_ends_path():
+  with Model('tree'):
+    N = IndexSet('N', mapping = [0], blocking = [1])
+    a = Variable('a', 'testvariable', 'closure', [1]*8, [N])
+    b = Variable('b', 'testvariable', 'closure', [1]*8, [N])
+    a.makeExecuteable(op.add(b, b))
+    b.makeExecuteable(op.add(a, a))
+    tree = SubTree('cycle', a)
+  assert [[el.symbol for el in path] for path in tree.tree] == \
+         [['a', 'eq0a', 'b', 'eq0b', 'a']]
+
+
+def test_given_variables_update_subtree():
+  with Model('tree'):
+    top = makeLadder(3)
+    tree = SubTree('ladder', top)
+  everything = set(tree.allElements)
+  assert tree.active == everything
+  tree.setGivenVariableByName('w2')
+  assert tree.active == everything - {'eq0w2'}           # Rest through v2
+  tree.setGivenVariableByName('v2')
+  assert tree.active == {'v3', 'eq0v3', 'v2', 'w2'}
+  elements = list(tree.elements())                 # Read from the active set
+  assert elements[:2] == ['v3', 'eq0v3'] and set(elements) == tree.active
+  tree.unsetGivenVariableByName('w2')
+  expected = set(tree.active)
+  tree.buildGraphTree()
+  assert tree.active == expected
+  assert 'v0' in expected and 'eq0v2' not in expected
+  assert len(tree.tree) == 1 + 4
+  tree.unsetGivenVariableByName('v2')
+  assert tree.active == everything
+
+
+def test_dot_graph_writes_every_element_once(tmp_path):
+  with Model('tree'):
+    top = makeLadder(3)
+    tree = SubTree('ladder', top)
+  tree.setGivenVariableByName('w2')
+  filename = str(tmp_path / 'ladder.dot')
+  tree.makeDotGraph(filename)
+  lines = open(filename).read().splitlines()
+  nodes = [line.split()[0] for line in lines if '[' in line]
+  edges = [line for line in lines if ' -- ' in line]
+  assert sorted(nodes) == sorted(tree.active)
+  assert len(edges) == len(set(edges)) == 12
+  assert 'w2 [style = filled, fillcolor = AntiqueWhite, shape = doubleoctagon];' in lines
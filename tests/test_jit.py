@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_jit
+----------------------------------
+
+Tests for `OntoSim.jit` module.
+"""
+
+import hashlib
+
+import numpy as np
+import pytest
+
+from OntoSim.objects import Model, Variable
+from OntoSim import operators as op
+from OntoSim.scheduler import Scheduler
+from OntoSim.jit import JitModel, numba
+from tests.models import makeNetwork
+
+
+def makeModel():
+  sets, var = makeNetwork(11)
+  f = Variable('f', 'testvariable', 'closure', [1]*8, [sets['Nw'], sets['A']])
+  g = Variable('g', 'testvariable', 'closure', [1]*8, [sets['N']])
+  f.makeExecuteable(op.select(op.add(var['c'], op.sett(var['F'])),
+                              sets['N'], sets['Nw']))
+  g.makeExecuteable(op.reduceproduct(var['F'], sets['A'], var['a']))
+  return Scheduler(list(var.values()) + [f, g]), var['x']
+
+
+def test_loop_kernel_matches_scheduler(tmp_path):
+  with Model('jit'):
+    scheduler, x = makeModel()
+  model = JitModel(scheduler, cachedir = str(tmp_path), jit = False)
+  files = list(tmp_path.glob('*.py*'))                  # No temporary left
+  assert len(files) == 1 and not hasattr(model.kernel, 'py_func')
+  source = files[0].read_text()
+  assert files[0].name == 'model_%s.py' % \
+         hashlib.sha256(source.encode()).hexdigest()
+  x.value = x.value + 1.
+  model.evaluateAll()
+  results = [var.value.copy() for var in scheduler.order]
+  scheduler.evaluateAll()
+  for var, result in zip(scheduler.order, results):
+    assert np.allclose(result, var.value), var.symbol
+
+
+def test_numpy_fallback_without_numba(tmp_path):
+  with Model('jit'):
+    scheduler, x = makeModel()
+  model = JitModel(scheduler, cachedir = str(tmp_path))
+  assert (model.kernel is None) == (numba is None)
+  model.evaluateAll()
+  assert scheduler.order[0].value is not None
+
+
+def test_numba_kernel_matches_scheduler(tmp_path):
+  pytest.importorskip('numba')
+  with Model('jit'):
+    scheduler, x = makeModel()
+  model = JitModel(scheduler, cachedir = str(tmp_path), jit = True)
+  assert model.kernel is not None
+  x.value = x.value * 2.
+  model.evaluateAll()
+  results = [var.value.copy() for var in scheduler.order]
+  scheduler.evaluateAll()
+  for var, result in zip(scheduler.order, results):
+    assert np.allclose(result, var.value), var.symbol
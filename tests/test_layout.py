@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_layout
+----------------------------------
+
+Tests for `OntoSim.layout` module.
+"""
+
+import numpy as np
+
+from OntoSim.objects import IndexSet, Variable, Executable
+from OntoSim.operatorImplementation import transpose
+from OntoSim import operators as op
+from OntoSim import compiler
+from OntoSim import layout
+
+
+def T(exe):
+  """Transposed executable, as wrapped by makeExecuteable"""
+  return Executable(lambda: transpose(exe.get()), list(reversed(exe.index)),
+                    exe.instances, op = 'transpose', args = (exe,),
+                    fn = transpose)
+
+
+def makeVariables(n = 3):
+  N = IndexSet('N', mapping = list(range(n)), blocking = [1] * n)
+  A = IndexSet('A', mapping = list(range(n)), blocking = [1] * n)
+  M = IndexSet('M', mapping = [0, 1, 2, 3], blocking = [1] * 4)
+  F = Variable('F', 'testvariable', 'constant', [1]*8, [N, A])
+  G = Variable('G', 'testvariable', 'constant', [1]*8, [A, N])
+  H = Variable('H', 'testvariable', 'constant', [1]*8, [A, M])
+  rng = np.random.RandomState(0)
+  F.value = rng.rand(n, n)
+  G.value = rng.rand(n, n)
+  H.value = rng.rand(n, 4)
+  return N, A, M, F, G, H
+
+
+def ops(plan):
+  return [ins[0] for ins in plan.instructions]
+
+
+def test_double_transpose_cancels():
+  N, A, M, F, G, H = makeVariables()
+  exe = op.add(T(T(F)), F)
+  plan = compiler.compileExecutable(exe)
+  assert ops(plan) == ['add'] and plan.removed == 2
+  assert np.allclose(plan.execute()[0], 2 * F.value)
+
+
+def test_transpose_is_absorbed_by_contraction():
+  N, A, M, F, G, H = makeVariables()
+  exe = op.reduceproduct(T(G), A, H)
+  plan = compiler.compileExecutable(exe)
+  assert ops(plan) == ['contraction']
+  assert np.allclose(plan.execute()[0], exe.ex())
+
+
+def test_transposed_contraction_swaps_operands():
+  N, A, M, F, G, H = makeVariables()
+  z = Variable('z', 'testvariable', 'state', [1]*8, [M, N])
+  z.makeExecuteable(op.reduceproduct(F, A, H))
+  plan = compiler.compileVariable(z)
+  value = plan.execute()[0]
+  assert ops(plan) == ['contraction']
+  assert value.flags.c_contiguous
+  assert np.allclose(value, np.dot(F.value, H.value).T)
+  assert compiler.compileVariable(z, layout = False).removed == 0
+
+
+def test_one_shared_contiguous_copy():
+  N, A, M, F, G, H = makeVariables(100)
+  exe = op.expandproduct(op.add(F, G), op.subtract(F, G))
+  plan = compiler.compileExecutable(exe)
+  copies = [ins for ins in plan.instructions if ins[1] is
+            layout.contiguousTranspose]
+  assert len(copies) == 1
+  assert not any(ins[4].params[0] for ins in plan.instructions
+                 if ins[0] in layout.ELEMENTWISE)
+  assert np.allclose(plan.execute()[0], exe.ex())
+  N, A, M, F, G, H = makeVariables()
+  small = op.expandproduct(op.add(F, G), op.subtract(F, G))
+  assert 'transpose' not in ops(compiler.compileExecutable(small))
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_objects
+----------------------------------
+
+Tests for `OntoSim.objects` module.
+"""
+
+import pytest
+
+from OntoSim.objects import IndexSet
+
+
+def test_index_set_is_frozen_and_hashable():
+  N = IndexSet('N', mapping = [0, 1, 2], blocking = [1, 1, 1])
+  S = IndexSet('S', mapping = [0, 1], blocking = [1, 1])
+  NS = IndexSet('NS', mapping = [0, 1, 2], blocking = [2, 0, 3],
+                sets = [N, S], superset = N)
+  assert NS.size == 5
+  assert list(NS.offsets) == [0, 2, 2, 5]
+  assert list(NS.blockOfRow) == [0, 0, 2, 2, 2]
+  with pytest.raises(AttributeError):
+    NS.blocking = [1, 1, 1]
+  with pytest.raises(ValueError):
+    NS.blocking[0] = 3
+  same = IndexSet('NS', mapping = [0, 1, 2], blocking = [2, 0, 3],
+                  sets = [N, S], superset = N)
+  assert same == NS and hash(same) == hash(NS)
+  assert NS != N
+  assert {NS: 1}[same] == 1
+
+
+def test_models_do_not_share_registries():
+  import gc
+  import weakref
+  from OntoSim.objects import Model, Variable
+  from OntoSim import operators as op
+  with Model('first') as first:
+    N = IndexSet('N', mapping = [0, 1], blocking = [1, 1])
+    Nv = IndexSet('Nv', mapping = [1], blocking = [1], superset = N)
+    x = Variable('x', 'testvariable', 'state', [1]*8, [N])
+    y = Variable('y', 'testvariable', 'closure', [1]*8, [Nv])
+    y.makeExecuteable(op.select(x, N, Nv))
+  with Model('second') as second:
+    M = IndexSet('N', mapping = [0, 1], blocking = [1, 1])
+    z = Variable('z', 'testvariable', 'state', [1]*8, [M])
+  assert first.variables == [x, y] and first.seqvariables == [y]
+  assert first.indexingSets == [N, Nv] and second.indexingSets == [M]
+  assert second.variables == [z] and Model.active() is Model.default
+  assert x not in Model.default.variables
+  reference = weakref.ref(first)
+  del first, N, Nv, x, y
+  gc.collect()
+  assert reference() is None
+
+
+def test_units_are_shared_within_a_model():
+  from OntoSim.objects import Model, Variable
+  with Model('first') as first:
+    N = IndexSet('N', mapping = [0], blocking = [1])
+    x = Variable('x', 'testvariable', 'state', [0, 1, 0], [N])
+    y = Variable('y', 'testvariable', 'state', [0, 1, 0], [N])
+  with Model('second') as second:
+    Variable('z', 'testvariable', 'state', [0, 0, 1], [N])
+  assert x.units is y.units and x.units == (0, 1, 0)
+  assert list(first.units) == [(0, 1, 0)] and list(second.units) == [(0, 0, 1)]
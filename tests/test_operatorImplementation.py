@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_operatorImplementation
+----------------------------------
+
+Tests for `OntoSim.operatorImplementation` module.
+"""
+
+import numpy as np
+import pytest
+
+from OntoSim.operatorImplementation import blockReduction, kr, krBlocks
+from OntoSim.operatorImplementation import contraction, rowReduction, take
+from OntoSim.operatorImplementation import selection, contractionKernel
+from OntoSim.operatorImplementation import vectorReductionKernel
+from OntoSim.objects import IndexSet
+from OntoSim.myerrors import SetError
+
+
+@pytest.mark.parametrize('size', [[2, 0, 3, 1, 0], [3, 0], [1, 2, 0],
+                                  [0, 2], [0, 0], [2, 1]])
+def test_block_reduction_matches_per_block_einsum(size):
+  rng = np.random.RandomState(0)
+  val1 = rng.rand(sum(size), 4)
+  val2 = rng.rand(sum(size), 4)
+  expected = []
+  counter = 0
+  for l in size:
+    expected.append(np.einsum('ij,ij -> j', val1[counter:counter+l],
+                                            val2[counter:counter+l]))
+    counter += l
+  assert np.allclose(blockReduction(val1, size, val2), expected)
+  out = np.empty((len(size), 4))
+  assert blockReduction(val1, size, val2, out=out) is out
+  assert np.allclose(out, expected)
+
+
+def test_block_reduction_with_trailing_empty_block():
+  a = np.array([[1., 2.], [3., 4.], [5., 6.]])
+  assert np.allclose(blockReduction(a, [3, 0], np.ones((3, 2))),
+                     [[9., 12.], [0., 0.]])
+  assert np.allclose(blockReduction(a, [1, 2, 0], np.ones((3, 2))),
+                     [[1., 2.], [8., 10.], [0., 0.]])
+
+
+def test_khatri_rao_matches_block_kronecker():
+  rng = np.random.RandomState(1)
+  sizea = [[1, 2, 1], [2, 1]]
+  sizeb = [[2, 0, 3], [1, 2]]
+  mata = rng.rand(4, 3)
+  matb = rng.rand(5, 3)
+  expected = krBlocks(mata, sizea, matb, sizeb)
+  assert np.allclose(kr(mata, sizea, matb, sizeb), expected)
+  out = np.empty(expected.shape)
+  assert kr(mata, sizea, matb, sizeb, out=out) is out
+  assert np.allclose(out, expected)
+
+
+def test_sparse_operands_match_dense():
+  sparse = pytest.importorskip('scipy.sparse')
+  rng = np.random.RandomState(2)
+  F = np.array([[-1., 0., 1.], [1., -1., 0.], [0., 1., -1.], [0., 0., 0.]])
+  Fs = sparse.csr_matrix(F)
+  x = rng.rand(4, 2)
+  q = rng.rand(3, 1)
+  for spec in ['ri,rj -> ij', 'ir,rj -> ij']:
+    other = x if spec[0] == 'r' else q
+    assert np.allclose(contraction(spec, Fs, other),
+                       np.einsum(spec, F, other))
+  assert np.allclose(rowReduction('ir,ri -> i', Fs, q),
+                     rowReduction('ir,ri -> i', F, q))
+  assert np.allclose(take(Fs, [0, 2], -2).toarray(), F[[0, 2]])
+  assert np.allclose(take(Fs, [1], -1).toarray(), F[:, [1]])
+
+
+def test_selection_matches_block_loop():
+  blocking = [2, 0, 3, 1, 2]
+  N = IndexSet('N', mapping = range(5), blocking = blocking)
+  for mapping in [[0, 2, 4], [4, 1], [2, 3], [], [0, 1, 2, 3, 4]]:
+    expected = []
+    counter = 0
+    for i, curlen in enumerate(blocking):
+      if i in mapping:
+        expected += range(counter, counter+curlen)
+      counter += curlen
+    rows = np.arange(sum(blocking))
+    selected = selection(N, IndexSet('Nv', mapping = mapping, superset = N))
+    assert list(rows[selected]) == expected
+  Nw = IndexSet('Nw', mapping = [2, 3], superset = N)
+  assert isinstance(selection(N, Nw), slice)
+
+
+def test_selection_out_of_bounds_raises():
+  N = IndexSet('N', mapping = range(3), blocking = [1, 1, 1])
+  with pytest.raises(SetError):
+    selection(N, IndexSet('Nv', mapping = [0, 5], superset = N))
+  F = np.arange(6.).reshape(3, 2)
+  with pytest.raises(IndexError):
+    take(F, np.array([0, 5]), -2)
+  with pytest.raises(IndexError):
+    take(F, np.array([0, 2]), -1, out = np.empty((3, 2)))
+  with pytest.raises(IndexError):
+    take(F, slice(1, 4), -2)
+
+
+@pytest.mark.parametrize('spec', ['ri,rj -> ij', 'ri,jr -> ij',
+                                  'ir,rj -> ij', 'ir,jr -> ij'])
+def test_contraction_kernel_matches_einsum(spec):
+  rng = np.random.RandomState(2)
+  sub1, sub2 = spec.split(' ')[0].split(',')
+  sizes = {'r': 5, 'i': 3, 'j': 4}
+  a = rng.rand(2, *[sizes[l] for l in sub1])
+  b = rng.rand(2, *[sizes[l] for l in sub2])
+  fn = contractionKernel(spec)
+  out = np.empty((2, 3, 4))
+  assert np.allclose(fn(a, b), contraction(spec, a, b))
+  assert fn(a, b, out = out) is out
+  assert np.allclose(out, contraction(spec, a, b))
+
+
+@pytest.mark.parametrize('spec', ['ri,ri -> i', 'ir,ri -> i', 'ri,ir -> i'])
+def test_vector_reduction_kernel_matches_einsum(spec):
+  rng = np.random.RandomState(4)
+  sub1, sub2 = spec.split(' ')[0].split(',')
+  mat = rng.rand(*[{'r': 5, 'i': 3}[l] for l in sub1])
+  vec = rng.rand(5, 1)
+  if sub2 == 'ri':
+    assert np.allclose(vectorReductionKernel(spec, False)(mat, vec),
+                       rowReduction(spec, mat, vec))
+  mat = rng.rand(*[{'r': 5, 'i': 3}[l] for l in sub2])
+  if sub1 == 'ri':
+    assert np.allclose(vectorReductionKernel(spec, True)(vec, mat),
+                       rowReduction(spec, vec, mat))
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_operators
+----------------------------------
+
+Tests for `OntoSim.operators` module.
+"""
+
+import numpy as np
+
+from OntoSim.objects import IndexSet, Variable
+from OntoSim import operators as op
+from tests.models import makeSets
+
+
+def test_operators_broadcast_over_a_batch_axis():
+  N, A, S, NS, AS = makeSets()
+  Nv = IndexSet('Nv', mapping = [0, 2], blocking = [1, 1], superset = N)
+  F = Variable('F', 'testvariable', 'network', [1]*8, [N, A])
+  G = Variable('G', 'testvariable', 'network', [1]*8, [A, N])
+  x = Variable('x', 'testvariable', 'state', [1]*8, [N])
+  y = Variable('y', 'testvariable', 'state', [1]*8, [NS])
+  z = Variable('z', 'testvariable', 'state', [1]*8, [NS, AS])
+  rng = np.random.RandomState(3)
+  values = {F: rng.rand(4, 3, 2), G: rng.rand(4, 2, 3), x: rng.rand(4, 3, 1),
+            y: rng.rand(4, 6, 1), z: rng.rand(4, 6, 4)}
+  exes = [op.add(F, G), op.reduceproduct(F, N, x), op.reduceproduct(F, N, G),
+          op.reduceproduct(y, S, y), op.expandproduct(x, F),
+          op.khatriRaoProduct(F, z), op.select(F, N, Nv),
+          op.select(G, N, Nv), op.sqrt(op.inv(x))]
+  for var, value in values.items():
+    var.value = value
+  batched = [np.array(exe.ex()) for exe in exes]
+  for k in range(4):
+    for var, value in values.items():
+      var.value = value[k]
+    for exe, result in zip(exes, batched):
+      assert np.allclose(result[k], exe.ex())
+
+
+def test_khatri_rao_is_planned_once(capsys):
+  N, A, S, NS, AS = makeSets()
+  F = Variable('F', 'testvariable', 'network', [1]*8, [N, A])
+  G = Variable('G', 'testvariable', 'network', [1]*8, [A, N])
+  z = Variable('z', 'testvariable', 'state', [1]*8, [NS, AS])
+  H = Variable('H', 'testvariable', 'network', [1]*8, [NS, A])
+  y = Variable('y', 'testvariable', 'state', [1]*8, [N, AS])
+  F.value = np.arange(6.).reshape(3, 2)
+  G.value = F.value.T.copy()
+  z.value = np.arange(24.).reshape(6, 4)
+  op._khatriRaoPlan.cache_clear()
+  first = op.khatriRaoProduct(F, z)
+  second = op.khatriRaoProduct(F, z)
+  assert op._khatriRaoPlan.cache_info().hits == 1
+  assert first.index == [NS, AS] and first.index is not second.index
+  assert first.fn is second.fn
+  flipped = op.khatriRaoProduct(G, z)
+  assert flipped.params[2] and flipped.index == [AS, NS]
+  assert op.khatriRaoProduct(H, y).index == [NS, AS]
+  assert y.index == [N, AS]                            # Operand not modified
+  assert np.allclose(flipped.ex(), first.ex().T)
+  assert capsys.readouterr().out == ''
+
+
+def test_khatri_rao_of_vectors_and_matrices():
+  N, A, S, NS, AS = makeSets()
+  rng = np.random.RandomState(5)
+  x = Variable('x', 'testvariable', 'state', [1]*8, [N])
+  a = Variable('a', 'testvariable', 'state', [1]*8, [A])
+  w = Variable('w', 'testvariable', 'state', [1]*8, [AS])
+  F = Variable('F', 'testvariable', 'network', [1]*8, [N, A])
+  z = Variable('z', 'testvariable', 'state', [1]*8, [NS, AS])
+  H = Variable('H', 'testvariable', 'network', [1]*8, [NS, A])
+  K = Variable('K', 'testvariable', 'state', [1]*8, [AS, N])
+  x.value, a.value, w.value = rng.rand(3, 1), rng.rand(2, 1), rng.rand(4, 1)
+  F.value, z.value = rng.rand(3, 2), rng.rand(6, 4)
+  H.value, K.value = rng.rand(6, 2), rng.rand(4, 3)
+  rows = np.repeat(x.value, 2, 0)
+  for exe in (op.khatriRaoProduct(x, z), op.khatriRaoProduct(z, x)):
+    assert exe.index == [NS, AS] and np.allclose(exe.ex(), z.value * rows)
+  exe = op.khatriRaoProduct(a, z)
+  assert exe.index == [AS, NS]
+  assert np.allclose(exe.ex(), (z.value * np.repeat(a.value.T, 2, 1)).T)
+  exe = op.khatriRaoProduct(F, w)
+  assert exe.index == [N, AS]
+  assert np.allclose(exe.ex(), np.repeat(F.value, 2, 1) * w.value.T)
+  exe = op.khatriRaoProduct(H, K)                     # NS,A : AS,N ==> NS,AS
+  expected = np.zeros((6, 4))
+  for n in range(3):
+    for k in range(2):
+      expected[2*n:2*n+2, 2*k:2*k+2] = np.kron(H.value[2*n:2*n+2, k:k+1],
+                                               K.value[2*k:2*k+2, n:n+1].T)
+  assert exe.index == [NS, AS] and np.allclose(exe.ex(), expected)
+
+
+def test_khatri_rao_plans_are_not_shared_between_models():
+  import gc
+  import weakref
+  from OntoSim.objects import Model
+  with Model('first') as first:
+    N, A, S, NS, AS = makeSets()
+    F = Variable('F', 'testvariable', 'network', [1]*8, [N, A])
+    z = Variable('z', 'testvariable', 'state', [1]*8, [NS, AS])
+    op.khatriRaoProduct(F, z)
+  with Model('second'):
+    sets = makeSets()
+    G = Variable('G', 'testvariable', 'network', [1]*8, sets[:2])
+    y = Variable('y', 'testvariable', 'state', [1]*8, sets[3:])
+    exe = op.khatriRaoProduct(G, y)
+  assert exe.index[0] is sets[3] and exe.index[1] is sets[4]
+  reference = weakref.ref(first)
+  del first, N, A, S, NS, AS, F, z
+  gc.collect()
+  assert reference() is None
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_scheduler
+----------------------------------
+
+Tests for `OntoSim.scheduler` module.
+"""
+
+import numpy as np
+import pytest
+
+from OntoSim.objects import IndexSet, Variable
+from OntoSim import operators as op
+from OntoSim.scheduler import Scheduler, LevelExecutor
+from OntoSim.myerrors import CycleError
+
+
+def makeModel():
+  N = IndexSet('N', mapping = [0, 1], blocking = [1, 1])
+  a = Variable('a', 'testvariable', 'constant', [1]*8, [N])
+  b = Variable('b', 'testvariable', 'constant', [1]*8, [N])
+  c = Variable('c', 'testvariable', 'closure', [1]*8, [N])
+  d = Variable('d', 'testvariable', 'closure', [1]*8, [N])
+  e = Variable('e', 'testvariable', 'closure', [1]*8, [N])
+  e.makeExecuteable(op.expandproduct(c, d))        # Registered before inputs
+  d.makeExecuteable(op.add(c, b))
+  c.makeExecuteable(op.add(a, b))
+  a.value = np.array([[1.], [2.]])
+  b.value = np.array([[3.], [4.]])
+  return a, b, c, d, e
+
+
+def test_evaluate_all_in_dependency_order():
+  a, b, c, d, e = makeModel()
+  scheduler = Scheduler([a, b, c, d, e])
+  assert scheduler.order == [c, d, e]
+  scheduler.evaluateAll()
+  assert np.allclose(c.value, [[4.], [6.]])
+  assert np.allclose(e.value, [[28.], [60.]])
+
+
+def test_evaluate_subset_updates_dependencies_only():
+  a, b, c, d, e = makeModel()
+  scheduler = Scheduler([a, b, c, d, e])
+  scheduler.evaluate([d])
+  assert np.allclose(d.value, [[7.], [10.]])
+  assert e.value is None
+
+
+def test_cycles_are_reported():
+  a, b, c, d, e = makeModel()
+  a.makeExecuteable(op.add(e, b))
+  with pytest.raises(CycleError):
+    Scheduler([a, b, c, d, e], loops = False)
+
+
+def test_loops_are_solved():
+  N = IndexSet('N', mapping = [0, 1], blocking = [1, 1])
+  k = Variable('k', 'testvariable', 'constant', [1]*8, [N])
+  x = Variable('x', 'testvariable', 'closure', [1]*8, [N])
+  y = Variable('y', 'testvariable', 'closure', [1]*8, [N])
+  z = Variable('z', 'testvariable', 'closure', [1]*8, [N])
+  z.makeExecuteable(op.add(x, y))
+  x.makeExecuteable(op.add(k, y))                          # x = k + sqrt(x)
+  y.makeExecuteable(op.sqrt(x))
+  k.value = np.array([[2.], [6.]])
+  x.value = np.array([[1.], [1.]])
+  scheduler = Scheduler([k, x, y, z])
+  assert scheduler.order == [x, y, z]
+  assert scheduler.levels == [[x], [z]]
+  scheduler.evaluateAll()
+  assert np.allclose(x.value, [[4.], [9.]])
+  assert np.allclose(z.value, [[6.], [12.]])
+  k.value = np.array([[2.1], [6.1]])
+  assert scheduler.update() == 2                              # The loop and z
+  assert np.allclose(x.value - np.sqrt(x.value), k.value)
+  assert scheduler.solvers[x].factorisations <= 2
+
+
+def test_update_only_recomputes_downstream():
+  a, b, c, d, e = makeModel()
+  f = Variable('f', 'testvariable', 'closure', [1]*8, a.index)
+  f.makeExecuteable(op.exp(a))
+  scheduler = Scheduler([a, b, c, d, e, f])
+  scheduler.evaluateAll()
+  assert scheduler.update() == 0
+  assert scheduler.affected([b]) == [c, d, e]
+  b.value = np.array([[0.], [0.]])
+  assert scheduler.update() == 3                     # c, d and e but not f
+  assert np.allclose(e.value, [[1.], [4.]])
+  a.value[0, 0] = 2.                                   # In place modification
+  a.touch()
+  assert scheduler.update() == 4
+
+
+def test_level_executor_matches_serial():
+  a, b, c, d, e = makeModel()
+  f = Variable('f', 'testvariable', 'closure', [1]*8, a.index)
+  f.makeExecuteable(op.exp(a))
+  scheduler = Scheduler([a, b, c, d, e, f])
+  assert scheduler.levels == [[c, f], [d], [e]]
+  with LevelExecutor(scheduler, workers = 4) as executor:
+    executor.evaluateAll()
+    assert np.allclose(e.value, [[28.], [60.]])
+    assert np.allclose(f.value, np.exp(a.value))
+    b.value = np.array([[0.], [0.]])
+    assert executor.update() == 3
+  assert np.allclose(e.value, [[1.], [4.]])
+
+
+def test_sparse_incidence_matrix_through_a_model():
+  sparse = pytest.importorskip('scipy.sparse')
+  from OntoSim.objects import Model
+  D = np.array([[-1., 0.], [1., -1.], [0., 1.]])
+  results = []
+  for value in (D, sparse.csr_matrix(D)):
+    with Model('sparse'):
+      N = IndexSet('N', mapping = [0, 1, 2], blocking = [1, 1, 1])
+      A = IndexSet('A', mapping = [0, 1], blocking = [1, 1])
+      S = IndexSet('S', mapping = [0, 1], blocking = [1, 1])
+      NS = IndexSet('NS', mapping = [0, 1, 2], blocking = [2, 2, 2],
+                    sets = [N, S], superset = N)
+      AS = IndexSet('AS', mapping = [0, 1], blocking = [2, 2],
+                    sets = [A, S], superset = A)
+      Nv = IndexSet('Nv', mapping = [0, 2], blocking = [1, 1], superset = N)
+      F = Variable('F', 'testvariable', 'network', [1]*8, [N, A])
+      x = Variable('x', 'testvariable', 'state', [1]*8, [N])
+      z = Variable('z', 'testvariable', 'state', [1]*8, [NS, AS])
+      q = Variable('q', 'testvariable', 'closure', [1]*8, [A])
+      w = Variable('w', 'testvariable', 'closure', [1]*8, [N, A])
+      k = Variable('k', 'testvariable', 'closure', [1]*8, [NS, AS])
+      s = Variable('s', 'testvariable', 'closure', [1]*8, [Nv, A])
+      q.makeExecuteable(op.reduceproduct(F, N, x))
+      w.makeExecuteable(op.add(op.expandproduct(F, q), op.abs(F)))
+      k.makeExecuteable(op.khatriRaoProduct(F, z))
+      s.makeExecuteable(op.select(F, N, Nv))
+      F.value = value
+      x.value = np.array([[1.], [2.], [4.]])
+      z.value = np.arange(24.).reshape(6, 4)
+      scheduler = Scheduler([F, x, z, q, w, k, s])
+      scheduler.evaluateAll()
+      results.append([var.value.toarray() if sparse.issparse(var.value)
+                      else var.value for var in (q, w, k, s)])
+  for dense, fromSparse in zip(*results):
+    assert np.allclose(dense, fromSparse)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_simulation
+----------------------------------
+
+Tests for `OntoSim.simulation` module.
+"""
+
+import numpy as np
+
+from OntoSim.objects import IndexSet, Model, Variable
+from OntoSim import operators as op
+from OntoSim.scheduler import Scheduler
+from OntoSim.simulation import Simulation
+
+
+def makeModel():
+  """Stiff linear exchange  dx/dt = -k x + c y,  dy/dt = k x - c y"""
+  N = IndexSet('N', mapping = [0, 1], blocking = [1, 1])
+  k = Variable('k', 'testvariable', 'constant', [1]*8, [N])
+  c = Variable('c', 'testvariable', 'constant', [1]*8, [N])
+  x = Variable('x', 'testvariable', 'diffstate', [1]*8, [N])
+  y = Variable('y', 'testvariable', 'diffstate', [1]*8, [N])
+  q = Variable('q', 'testvariable', 'transport', [1]*8, [N])
+  dx = Variable('dx', 'testvariable', 'closure', [1]*8, [N])
+  dy = Variable('dy', 'testvariable', 'closure', [1]*8, [N])
+  kc = Variable('kc', 'testvariable', 'network', [1]*8, [N])  # Constant only
+  kc.makeExecuteable(op.expandproduct(k, c))
+  q.makeExecuteable(op.subtract(op.expandproduct(k, x),
+                                op.expandproduct(c, y)))
+  dy.makeExecuteable(op.add(q, op.subtract(kc, kc)))
+  dx.makeExecuteable(op.subtract(op.subtract(kc, kc), q))
+  k.value = np.array([[1000.], [1.]])
+  c.value = np.array([[1.], [2.]])
+  x.value = np.array([[1.], [1.]])
+  y.value = np.array([[0.], [0.]])
+  return Scheduler([k, c, x, y, kc, q, dx, dy]), {x: dx, y: dy}, k, c
+
+
+def exact(k, c, t):
+  """x(t) of the exchange from x = 1, y = 0"""
+  return (c + k * np.exp(-(k + c) * t)) / (k + c)
+
+
+def test_states_are_views_of_the_state_vector():
+  with Model('simulation'):
+    scheduler, rates, k, c = makeModel()
+  simulation = Simulation(rates, scheduler)
+  x, y = simulation.states
+  assert np.shares_memory(x.value, simulation.y)
+  assert x.value.shape == (2, 1)
+  dy = simulation.rhs(0., np.array([1., 2., 3., 4.]))
+  assert np.allclose(dy, [-997., 6., 997., -6.])
+
+
+def test_stiff_integration_with_derivatives():
+  with Model('simulation'):
+    scheduler, rates, k, c = makeModel()
+  simulation = Simulation(rates, scheduler, method = 'Radau')
+  assert simulation.jacobian is not None
+  result = simulation.run((0., 1.), rtol = 1e-8, atol = 1e-10)
+  assert result.success
+  x, y = simulation.states
+  assert np.allclose(x.value, exact(k.value, c.value, 1.), rtol = 1e-5)
+  assert np.allclose(x.value + y.value, 1.)
+
+
+def test_stiff_integration_with_sparse_differences():
+  with Model('simulation'):
+    scheduler, rates, k, c = makeModel()
+  simulation = Simulation(rates, scheduler, jacobian = False)
+  assert simulation.sparsity().sum() == 16
+  times = np.linspace(0., 1., 11)
+  result = simulation.run((0., 1.), t_eval = times, rtol = 1e-8, atol = 1e-10)
+  assert result.success
+  x, y = simulation.states
+  assert np.allclose(x.value, exact(k.value, c.value, 1.), rtol = 1e-5)
+  with Model('simulation'):
+    scheduler, rates, k, c = makeModel()
+  reference = Simulation(rates, scheduler).run((0., 1.), t_eval = times,
+                                                rtol = 1e-8, atol = 1e-10)
+  assert np.allclose(result.y, reference.y, rtol = 1e-5, atol = 1e-8)
+
+
+
+def test_constant_equations_are_evaluated_once_per_run():
+  with Model('simulation'):
+    scheduler, rates, k, c = makeModel()
+  simulation = Simulation(rates, scheduler)
+  kc = [var for var in scheduler.order if var.symbol == 'kc'][0]
+  assert kc in simulation.constant and kc not in simulation.sequence
+  evaluated = []
+  update = scheduler.updateVariable
+  scheduler.updateVariable = lambda var: evaluated.append(var) or update(var)
+  assert simulation.run((0., 0.1)).success
+  assert evaluated.count(kc) == 0 and simulation.evaluations > 2
+  k.value = 2 * k.value                           # Parameter changed between runs
+  simulation.run((0.1, 0.2))
+  assert evaluated.count(kc) == 1
+  assert np.allclose(kc.value, k.value * c.value)
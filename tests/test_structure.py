@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_structure
+----------------------------------
+
+Tests for `OntoSim.structure` module.
+"""
+
+from OntoSim.objects import IndexSet, Model, Variable
+from OntoSim import operators as op
+from OntoSim.structure import analyse, components
+from OntoSim.equationTree import SubTree
+
+
+def variables(N, *symbols):
+  return [Variable(symbol, 'testvariable', 'closure', [1]*8, [N])
+          for symbol in symbols]
+
+
+def test_components_in_dependency_order():
+  graph = {1: [2], 2: [3], 3: [2, 4], 4: []}
+  assert components([1, 2, 3, 4], graph.get) == [[4], [2, 3], [1]]
+
+
+def test_alternatives_without_loops_are_preferred():
+  with Model('structure'):
+    N = IndexSet('N', mapping = [0], blocking = [1])
+    a, b, c = variables(N, 'a', 'b', 'c')
+    k = Variable('k', 'testvariable', 'constant', [1]*8, [N])
+    b.makeExecuteable(op.add(c, k))                # Would loop with c = b + k
+    b.makeExecuteable(op.add(a, k))
+    c.makeExecuteable(op.add(b, k))
+    result = analyse([a, b, c, k], given = [a])
+  assert result.selection == {b: 1, c: 0}
+  assert result.order == [b, c]
+  assert result.loops == [] and result.tears == []
+
+
+def test_loops_are_torn():
+  with Model('structure'):
+    N = IndexSet('N', mapping = [0], blocking = [1])
+    a, b, c, d = variables(N, 'a', 'b', 'c', 'd')
+    a.makeExecuteable(op.add(b, c))
+    b.makeExecuteable(op.add(a, a))
+    c.makeExecuteable(op.add(a, a))
+    d.makeExecuteable(op.add(b, c))
+    result = analyse([a, b, c, d])
+  assert result.tears == [a]
+  assert len(result.loops) == 1 and set(result.loops[0]) == {a, b, c}
+  assert result.order[-1] is d
+
+
+def test_subtree_selects_alternatives():
+  with Model('structure'):
+    N = IndexSet('N', mapping = [0], blocking = [1])
+    a, b, c = variables(N, 'a', 'b', 'c')
+    k = Variable('k', 'testvariable', 'constant', [1]*8, [N])
+    a.makeExecuteable(op.add(b, c))
+    b.makeExecuteable(op.add(c, k))
+    b.makeExecuteable(op.add(k, k))
+    c.makeExecuteable(op.add(b, k))
+    c.makeExecuteable(op.add(k, k))
+    b.selector = 0
+    tree = SubTree('a', a)
+    tree.setGivenVariableByName('c')
+    result = tree.selectAlternatives()
+  assert result.selection[b] == 0 and b.selector == 0
+  assert tree.allElements['eq0b'].select and not tree.allElements['eq1b'].select
+  assert 'eq1b' not in tree.active and 'eq0c' not in tree.active